@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+计算器性能基准测试
+对比启用/禁用表达式编译缓存时 basic_calculate 的吞吐量（次/秒）
+"""
+
+import argparse
+import random
+import time
+
+from server import Calculator
+
+
+def build_workload(shapes: int, total: int, seed: int = 42) -> list:
+    """生成由少量表达式形态重复组成的请求序列"""
+    rng = random.Random(seed)
+    templates = [
+        "{a}+{b}*{c}",
+        "({a}+{b})/{c}",
+        "sqrt({a})+{b}^2",
+        "sin({a})*cos({b})",
+        "ln({a})+log({b})",
+        "abs({a}-{b})*exp(1)",
+        "abs({a})*pi/{c}",
+    ]
+    expressions = []
+    for _ in range(shapes):
+        template = rng.choice(templates)
+        expressions.append(template.format(
+            a=rng.randint(1, 1000), b=rng.randint(1, 1000), c=rng.randint(1, 1000)))
+    return [rng.choice(expressions) for _ in range(total)]
+
+
+def run(calculator: Calculator, workload: list) -> float:
+    """执行请求序列，返回每秒请求数"""
+    start = time.perf_counter()
+    for expression in workload:
+        calculator.basic_calculate(expression)
+    elapsed = time.perf_counter() - start
+    return len(workload) / elapsed
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="计算器性能基准测试")
+    parser.add_argument("--shapes", type=int, default=300,
+                        help="不同表达式的数量 (默认: 300)")
+    parser.add_argument("--requests", type=int, default=100000,
+                        help="请求总数 (默认: 100000)")
+    parser.add_argument("--cache-size", type=int, default=512,
+                        help="缓存容量 (默认: 512)")
+    args = parser.parse_args()
+
+    workload = build_workload(args.shapes, args.requests)
+
+    uncached = Calculator(cache_size=0)
+    cached = Calculator(cache_size=args.cache_size)
+
+    uncached_rps = run(uncached, workload)
+    cached_rps = run(cached, workload)
+
+    print(f"请求数: {args.requests}, 表达式形态: {args.shapes}")
+    print(f"无缓存: {uncached_rps:,.0f} 次/秒")
+    print(f"有缓存: {cached_rps:,.0f} 次/秒 ({cached_rps / uncached_rps:.1f}x)")
+    print(f"缓存统计: {cached.expression_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
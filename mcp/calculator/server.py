@@ -4,19 +4,35 @@
 提供基础数学计算、高级数学函数等功能的 MCP 工具
 """
 
+import ast
 import asyncio
+import base64
+import binascii
+import copy
+import decimal
+import functools
+import hashlib
+import itertools
 import json
 import logging
 import math
+import multiprocessing
+import operator
+import os
 import re
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import argparse
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from mcp.server import Server
 from mcp.types import (
@@ -25,56 +41,939 @@ from mcp.types import (
     TextContent,
 )
 
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，仅批量/向量化计算需要
+    np = None
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("calculator-mcp-server")
 
 
+# 支持的数学函数名称
+_MATH_FUNCTIONS = ('sin', 'cos', 'tan', 'log', 'ln', 'sqrt', 'abs', 'exp')
+
+# 预编译的数学函数规范化正则（函数名统一为小写）
+_MATH_FUNCTION_PATTERN = re.compile(
+    r'(' + '|'.join(_MATH_FUNCTIONS) + r')\(([^)]+)\)', re.IGNORECASE)
+
+# 表达式中可调用的函数
+_FUNCTION_TABLE = {
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "log": math.log10, "ln": math.log, "sqrt": math.sqrt,
+    "abs": abs, "exp": math.exp,
+}
+
+# 表达式中可用的常数
+_CONSTANTS = {"pi": math.pi, "e": math.e}
+
+# log10(2)，用于由二进制位数估算十进制位数
+_LOG10_2 = math.log10(2)
+
+# 支持的二元、一元运算
+_BINARY_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub,
+    ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+class EvaluationBudgetError(ValueError):
+    """表达式超出计算预算"""
+
+
+class ExpressionEvaluator:
+    """基于 AST 的数值表达式求值器
+
+    只接受数字、常数、四则/幂运算和函数表中的函数调用。解析阶段限制
+    表达式长度、节点数和嵌套深度；求值阶段限制运算次数、指数大小和
+    中间结果的位数，在真正消耗 CPU 之前拒绝超预算的表达式。
+    """
+
+    def __init__(self, functions: Dict[str, Any], constants: Dict[str, Any],
+                 max_length: int = 4000, max_nodes: int = 1024, max_depth: int = 500,
+                 max_operations: int = 1024, max_exponent: int = 10000,
+                 max_bits: int = 8192):
+        """初始化求值器"""
+        self.functions = functions
+        self.constants = constants
+        self.max_length = max_length
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_operations = max_operations
+        self.max_exponent = max_exponent
+        self.max_bits = max_bits
+
+    def parse(self, expression: str, variables: Tuple[str, ...] = ()) -> ast.Expression:
+        """解析并校验表达式，返回可重复求值的 AST
+
+        variables 为表达式中额外允许出现的变量名。
+        """
+        if len(expression) > self.max_length:
+            raise EvaluationBudgetError(f"表达式过长（超过 {self.max_length} 个字符）")
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"语法错误: {e.msg}")
+        except (RecursionError, MemoryError):
+            raise EvaluationBudgetError("表达式嵌套过深")
+        self._validate(tree.body, variables)
+        return tree
+
+    def _validate(self, root: ast.AST, variables: Tuple[str, ...] = ()) -> None:
+        """检查节点类型、节点数和嵌套深度"""
+        count = 0
+        stack = [(root, 1)]
+        while stack:
+            node, depth = stack.pop()
+            count += 1
+            if count > self.max_nodes:
+                raise EvaluationBudgetError(f"表达式过于复杂（超过 {self.max_nodes} 个节点）")
+            if depth > self.max_depth:
+                raise EvaluationBudgetError(f"表达式嵌套过深（超过 {self.max_depth} 层）")
+
+            if isinstance(node, ast.Constant):
+                if type(node.value) not in (int, float):
+                    raise ValueError(f"不支持的常量: {node.value!r}")
+            elif isinstance(node, ast.Name):
+                if node.id not in self.constants and node.id not in variables:
+                    raise ValueError(f"未知的名称: {node.id}")
+            elif isinstance(node, ast.BinOp):
+                if type(node.op) not in _BINARY_OPERATORS:
+                    raise ValueError(f"不支持的运算: {type(node.op).__name__}")
+                stack.append((node.left, depth + 1))
+                stack.append((node.right, depth + 1))
+            elif isinstance(node, ast.UnaryOp):
+                if type(node.op) not in _UNARY_OPERATORS:
+                    raise ValueError(f"不支持的运算: {type(node.op).__name__}")
+                stack.append((node.operand, depth + 1))
+            elif isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in self.functions:
+                    raise ValueError("不支持的函数调用")
+                if node.keywords or any(isinstance(arg, ast.Starred) for arg in node.args):
+                    raise ValueError(f"函数 {node.func.id} 只接受位置参数")
+                for arg in node.args:
+                    stack.append((arg, depth + 1))
+            else:
+                raise ValueError(f"不支持的语法: {type(node).__name__}")
+
+    def evaluate(self, tree: ast.Expression, variables: Optional[Dict[str, Any]] = None) -> Any:
+        """对已校验的 AST 求值"""
+        operations = 0
+        names = {**self.constants, **variables} if variables else self.constants
+
+        def visit(node: ast.AST) -> Any:
+            nonlocal operations
+            if isinstance(node, ast.Constant):
+                return node.value
+            if isinstance(node, ast.Name):
+                return names[node.id]
+
+            operations += 1
+            if operations > self.max_operations:
+                raise EvaluationBudgetError(f"运算次数超过上限 {self.max_operations}")
+
+            if isinstance(node, ast.BinOp):
+                left = visit(node.left)
+                right = visit(node.right)
+                op_type = type(node.op)
+                if op_type is ast.Pow:
+                    self._check_power(left, right)
+                elif op_type is ast.Mult:
+                    self._check_product(left, right)
+                result = _BINARY_OPERATORS[op_type](left, right)
+            elif isinstance(node, ast.UnaryOp):
+                result = _UNARY_OPERATORS[type(node.op)](visit(node.operand))
+            else:
+                args = [visit(arg) for arg in node.args]
+                result = self.functions[node.func.id](*args)
+
+            if isinstance(result, complex):
+                raise ValueError("结果不是实数")
+            if isinstance(result, int) and result.bit_length() > self.max_bits:
+                raise EvaluationBudgetError(f"中间结果超过 {self.max_bits} 位")
+            return result
+
+        return visit(tree.body)
+
+    def _check_power(self, base: Any, exponent: Any) -> None:
+        """幂运算前估算结果规模"""
+        if abs(exponent) > self.max_exponent:
+            raise EvaluationBudgetError(f"指数超过上限 {self.max_exponent}")
+        if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+            if math.log2(abs(base)) * exponent > self.max_bits:
+                raise EvaluationBudgetError(f"幂运算结果超过 {self.max_bits} 位")
+
+    def _check_product(self, left: Any, right: Any) -> None:
+        """整数乘法前估算结果规模"""
+        if isinstance(left, int) and isinstance(right, int):
+            if left.bit_length() + right.bit_length() > self.max_bits + 1:
+                raise EvaluationBudgetError(f"乘法结果超过 {self.max_bits} 位")
+
+
+class VectorEvaluator(ExpressionEvaluator):
+    """基于 NumPy 的向量化求值器，变量可以是可广播的 float64 数组"""
+
+    def __init__(self, **budgets: Any):
+        """初始化向量化求值器"""
+        super().__init__({
+            "sin": np.sin, "cos": np.cos, "tan": np.tan,
+            "log": np.log10, "ln": np.log, "sqrt": np.sqrt,
+            "abs": np.abs, "exp": np.exp,
+        }, _CONSTANTS, **budgets)
+
+    def evaluate(self, tree: ast.Expression, variables: Optional[Dict[str, Any]] = None) -> Any:
+        """对已校验的 AST 求值，除零、溢出等以 inf/nan 表示"""
+        with np.errstate(all="ignore"):
+            return super().evaluate(tree, variables)
+
+    def _check_power(self, base: Any, exponent: Any) -> None:
+        """数组幂运算只检查指数大小，标量沿用整数位数检查"""
+        if isinstance(base, np.ndarray) or isinstance(exponent, np.ndarray):
+            exponent = np.abs(np.asarray(exponent))
+            if exponent.size and np.nanmax(exponent) > self.max_exponent:
+                raise EvaluationBudgetError(f"指数超过上限 {self.max_exponent}")
+            return
+        super()._check_power(base, exponent)
+
+    def _check_product(self, left: Any, right: Any) -> None:
+        """数组乘法不会产生大整数，无需检查"""
+        if not isinstance(left, np.ndarray) and not isinstance(right, np.ndarray):
+            super()._check_product(left, right)
+
+
+_NON_FINITE_ERROR = "结果不是有限数（可能是除零、溢出或超出定义域）"
+
+
+def _lift_constants(tree: ast.Expression) -> Tuple[tuple, List[float]]:
+    """计算表达式的结构键，并按先序提取数字常量
+
+    结构相同、仅常量不同的表达式具有相同的键，可以共享同一个模板。
+    """
+    tokens: List[Any] = []
+    constants: List[float] = []
+    stack = [tree.body]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Constant):
+            tokens.append("#")
+            constants.append(node.value)
+        elif isinstance(node, ast.Name):
+            tokens.append(node.id)
+        elif isinstance(node, ast.BinOp):
+            tokens.append(type(node.op))
+            stack.append(node.right)
+            stack.append(node.left)
+        elif isinstance(node, ast.UnaryOp):
+            tokens.append(type(node.op))
+            stack.append(node.operand)
+        elif isinstance(node, ast.Call):
+            tokens.append((node.func.id, len(node.args)))
+            stack.extend(reversed(node.args))
+    return tuple(tokens), constants
+
+
+def _make_template(tree: ast.Expression) -> ast.Expression:
+    """将数字常量按先序替换为占位变量 _c0, _c1, ..."""
+    counter = itertools.count()
+
+    class Lifter(ast.NodeTransformer):
+        def visit_Constant(self, node: ast.Constant) -> ast.AST:
+            return ast.Name(id=f"_c{next(counter)}", ctx=ast.Load())
+
+    return Lifter().visit(copy.deepcopy(tree))
+
+
+def _check_variable_name(name: Any) -> None:
+    """变量名必须是普通标识符，且不能与函数、常数或内部占位变量冲突"""
+    if (not isinstance(name, str) or not name.isidentifier() or name.startswith("_")
+            or name in _FUNCTION_TABLE or name in _CONSTANTS):
+        raise ValueError(f"无效的变量名: {name}")
+
+
+def _to_json_list(values: Any) -> Tuple[List[Optional[float]], int]:
+    """将数组转为列表，非有限值替换为 None，返回列表和被替换的数量"""
+    results = values.tolist()
+    invalid = np.flatnonzero(~np.isfinite(values))
+    for index in invalid.tolist():
+        results[index] = None
+    return results, int(invalid.size)
+
+
+class SweepPlan:
+    """参数扫描计划：在各变量取值的笛卡尔积网格上按块向量化求值
+
+    网格按行优先展开（第一个变量变化最慢），每块只生成该块的坐标，
+    内存占用与块大小成正比，与网格总大小无关。
+    """
+
+    def __init__(self, evaluator: "VectorEvaluator", expression: str,
+                 tree: ast.Expression, axes: Dict[str, Any]):
+        """初始化扫描计划"""
+        self.evaluator = evaluator
+        self.expression = expression
+        self.tree = tree
+        self.axes = axes
+        self.shape = tuple(len(axis) for axis in axes.values())
+        self.total = math.prod(self.shape)
+
+    def meta(self) -> Dict[str, Any]:
+        """扫描的描述信息"""
+        return {
+            "type": "meta",
+            "expression": self.expression,
+            "variables": list(self.axes),
+            "shape": list(self.shape),
+            "total": self.total
+        }
+
+    def evaluate(self, offset: int, count: int) -> Tuple[Dict[str, Any], Any]:
+        """计算网格中 [offset, offset + count) 的部分，返回坐标和结果数组"""
+        index = np.arange(offset, min(offset + count, self.total))
+        coordinates = np.unravel_index(index, self.shape)
+        grid = {name: axis[position]
+                for (name, axis), position in zip(self.axes.items(), coordinates)}
+        values = np.broadcast_to(np.asarray(
+            self.evaluator.evaluate(self.tree, grid), dtype=np.float64), index.shape)
+        return grid, values
+
+    def iter_chunks(self, chunk_size: int, include_grid: bool = True,
+                    decimals: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """逐块产生结果，最后产生一条汇总
+
+        decimals 不为空时结果四舍五入到指定小数位，可显著减少序列化耗时和响应体积。
+        """
+        invalid_total = 0
+        for offset in range(0, self.total, chunk_size):
+            grid, values = self.evaluate(offset, chunk_size)
+            if decimals is not None:
+                values = np.round(values, decimals)
+            results, invalid_count = _to_json_list(values)
+            invalid_total += invalid_count
+            chunk: Dict[str, Any] = {"type": "chunk", "offset": offset, "count": len(results)}
+            if include_grid:
+                chunk["grid"] = {name: column.tolist() for name, column in grid.items()}
+            chunk["results"] = results
+            yield chunk
+        yield {"type": "end", "count": self.total, "invalid_count": invalid_total}
+
+
+class QuantileSketch:
+    """可合并的分位数草图（对数分桶，类似 DDSketch）
+
+    每个桶覆盖 (gamma^(i-1), gamma^i]，估计值的相对误差不超过 alpha。
+    桶数超过 max_buckets 时合并最小的桶，内存占用与数据量无关。
+    """
+
+    def __init__(self, alpha: float = 0.01, max_buckets: int = 2048,
+                 min_value: float = 1e-12):
+        """初始化草图"""
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, values: Any) -> None:
+        """加入一批数值（float64 数组）"""
+        magnitudes = np.abs(values)
+        small = magnitudes <= self.min_value
+        self.zero_count += int(np.count_nonzero(small))
+        self._add_to(self.positive, values[(values > 0) & ~small])
+        self._add_to(self.negative, -values[(values < 0) & ~small])
+        self.count += int(values.size)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """合并另一个参数相同的草图"""
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_store.items():
+                store[index] = store.get(index, 0) + count
+            self._collapse(store)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """估计 q 分位数"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._bucket_value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._bucket_value(index)
+        return self._bucket_value(max(self.positive)) if self.positive else 0.0
+
+    def _add_to(self, store: Dict[int, int], magnitudes: Any) -> None:
+        """按桶号累加计数"""
+        if magnitudes.size == 0:
+            return
+        indexes = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        unique, counts = np.unique(indexes, return_counts=True)
+        for index, count in zip(unique.tolist(), counts.tolist()):
+            store[index] = store.get(index, 0) + count
+        self._collapse(store)
+
+    def _collapse(self, store: Dict[int, int]) -> None:
+        """桶数超限时把最小的桶合并到一起"""
+        if len(store) <= self.max_buckets:
+            return
+        ordered = sorted(store)
+        excess = ordered[:len(store) - self.max_buckets + 1]
+        target = excess[-1]
+        store[target] = sum(store.pop(index) for index in excess[:-1]) + store[target]
+
+    def _bucket_value(self, index: int) -> float:
+        """桶的代表值"""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+
+class StreamingStatistics:
+    """流式统计累加器
+
+    均值和方差按 Welford/Chan 公式逐块合并，另外维护极值、分位数草图，
+    以及在创建时给定范围后的定长直方图；内存占用与数据总量无关。
+    """
+
+    def __init__(self, bins: int = 10, hist_range: Optional[Tuple[float, float]] = None):
+        """初始化累加器"""
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.ignored = 0
+        self.sketch = QuantileSketch()
+        self.edges = np.linspace(hist_range[0], hist_range[1], bins + 1) if hist_range else None
+        self.histogram = np.zeros(bins, dtype=np.int64) if hist_range else None
+        self.outside = 0
+        self.updated_at = time.time()
+
+    def update(self, values: Any) -> None:
+        """加入一块数据（已过滤非有限值的 float64 数组）"""
+        self.updated_at = time.time()
+        n = int(values.size)
+        if n == 0:
+            return
+        chunk_mean = float(values.mean())
+        chunk_m2 = float(np.square(values - chunk_mean).sum())
+        combined = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / combined
+        self.m2 += chunk_m2 + delta * delta * self.count * n / combined
+        self.count = combined
+        self.total += float(values.sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.sketch.add(values)
+        if self.edges is not None:
+            counts, _ = np.histogram(values, bins=self.edges)
+            self.histogram += counts
+            self.outside += n - int(counts.sum())
+
+    def summary(self, quantiles: List[float], ddof: int) -> Dict[str, Any]:
+        """当前统计结果"""
+        variance = self.m2 / (self.count - ddof) if self.count > ddof else None
+        result: Dict[str, Any] = {
+            "count": self.count,
+            "ignored_count": self.ignored,
+            "sum": self.total,
+            "mean": self.mean if self.count else None,
+            "variance": variance,
+            "std": math.sqrt(variance) if variance is not None else None,
+            "min": self.minimum if self.count else None,
+            "max": self.maximum if self.count else None,
+            "quantiles": {str(q): self.sketch.quantile(q) for q in quantiles},
+            "quantile_relative_error": self.sketch.alpha
+        }
+        if self.edges is not None:
+            result["histogram"] = {
+                "edges": self.edges.tolist(),
+                "counts": self.histogram.tolist(),
+                "outside_count": self.outside
+            }
+        return result
+
+
+# 线性代数操作
+_LINALG_OPERATIONS = ("matrix_multiply", "solve", "inverse", "determinant",
+                      "eigenvalues", "least_squares")
+
+
+def _decode_matrix(value: Any, name: str, max_elements: int) -> Any:
+    """解析矩阵参数：嵌套列表，或 {"base64": ..., "shape": [...]}（小端 float64 字节）"""
+    if value is None:
+        raise ValueError(f"缺少矩阵参数 {name}")
+    if isinstance(value, dict):
+        try:
+            raw = base64.b64decode(value.get("base64", ""), validate=True)
+        except (binascii.Error, TypeError) as e:
+            raise ValueError(f"矩阵 {name} 的 base64 数据无效: {e}")
+        if len(raw) % 8:
+            raise ValueError(f"矩阵 {name} 的字节数不是 float64 的整数倍")
+        array = np.frombuffer(raw, dtype="<f8")
+        shape = value.get("shape")
+        if shape is not None:
+            array = array.reshape(shape)
+    else:
+        array = np.asarray(value, dtype=np.float64)
+    if array.ndim not in (1, 2):
+        raise ValueError(f"矩阵 {name} 必须是一维或二维")
+    if array.size > max_elements:
+        raise EvaluationBudgetError(f"矩阵 {name} 的元素数超过上限 {max_elements}")
+    if not np.isfinite(array).all():
+        raise ValueError(f"矩阵 {name} 含有非有限值")
+    return array
+
+
+def _result_elements(operation: str, a: Any, b: Any) -> int:
+    """按输入形状估算结果的元素数（矩阵乘法和最小二乘的结果可能远大于输入）"""
+    columns = b.shape[-1] if b is not None and b.ndim == 2 else 1
+    if operation == "matrix_multiply":
+        return (a.shape[0] if a.ndim == 2 else 1) * columns
+    if operation == "least_squares":
+        return (a.shape[-1] if a.ndim == 2 else 1) * columns
+    return a.size if b is None else max(a.size, b.size)
+
+
+def _encode_array(array: Any, output_format: str) -> Any:
+    """按请求的格式输出数组"""
+    if output_format == "base64":
+        data = np.ascontiguousarray(array, dtype="<f8")
+        return {
+            "base64": base64.b64encode(data.tobytes()).decode("ascii"),
+            "shape": list(data.shape),
+            "dtype": "float64"
+        }
+    return array.tolist()
+
+
+def _linalg_task(operation: str, a: Any, b: Any, output_format: str) -> Dict[str, Any]:
+    """执行线性代数运算（在线程池中运行，NumPy/BLAS 计算期间会释放 GIL）"""
+    if operation == "matrix_multiply":
+        return {"result": _encode_array(np.matmul(a, b), output_format)}
+
+    if operation == "solve":
+        return {"result": _encode_array(np.linalg.solve(a, b), output_format)}
+
+    if operation == "inverse":
+        return {"result": _encode_array(np.linalg.inv(a), output_format)}
+
+    if operation == "determinant":
+        sign, log_abs = np.linalg.slogdet(a)
+        determinant = float(sign * math.exp(log_abs)) if log_abs < 700 else None
+        return {
+            "result": determinant,
+            "sign": float(sign),
+            "log_abs_determinant": float(log_abs)
+        }
+
+    if operation == "eigenvalues":
+        if a.ndim == 2 and a.shape[0] == a.shape[1] and np.allclose(a, a.T):
+            # 对称矩阵使用 eigvalsh，更快且结果为实数
+            return {"result": _encode_array(np.linalg.eigvalsh(a), output_format), "symmetric": True}
+        values = np.linalg.eigvals(a)
+        if np.iscomplexobj(values) and np.any(values.imag != 0):
+            return {
+                "result": {
+                    "real": _encode_array(values.real, output_format),
+                    "imag": _encode_array(values.imag, output_format)
+                },
+                "symmetric": False
+            }
+        return {"result": _encode_array(values.real, output_format), "symmetric": False}
+
+    # least_squares
+    solution, residuals, rank, singular_values = np.linalg.lstsq(a, b, rcond=None)
+    return {
+        "result": _encode_array(solution, output_format),
+        "residuals": residuals.tolist(),
+        "rank": int(rank),
+        "singular_values": singular_values.tolist()
+    }
+
+
+class ExpressionCache:
+    """表达式解析缓存（LRU），键为规范化后的表达式
+
+    批量计算等在计算线程池中执行，缓存会被多个线程同时访问，读写都加锁。
+    """
+
+    def __init__(self, capacity: int = 512):
+        """初始化缓存"""
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, Any]]:
+        """查找缓存项，命中时将其移到队尾"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: Tuple[str, Any]) -> None:
+        """写入缓存项，超出容量时淘汰最久未使用的项"""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """清空缓存（不重置计数器）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class CalculationRecord:
+    """一条计算历史记录"""
+
+    __slots__ = ("expression", "result", "timestamp")
+
+    def __init__(self, expression: str, result: Any, timestamp: float):
+        """初始化记录"""
+        self.expression = expression
+        self.result = result
+        self.timestamp = timestamp
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为响应中使用的字典"""
+        return {
+            "expression": self.expression,
+            "result": self.result,
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat()
+        }
+
+
+class CalculationHistory:
+    """定长环形缓冲区实现的计算历史
+
+    append 为 O(1)，latest(k) 为 O(k)。缓冲区满后最旧的记录被覆盖；
+    配置了 spill_path 时，被覆盖的记录会先以 JSON 行追加写入磁盘段文件。
+    """
+
+    def __init__(self, capacity: int = 1000, spill_path: Optional[str] = None):
+        """初始化历史缓冲区"""
+        if capacity < 1:
+            raise ValueError("历史记录容量必须为正整数")
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self._slots: List[Optional[CalculationRecord]] = [None] * capacity
+        self._next = 0
+        self._size = 0
+        self._spill_file = None
+        self.total = 0
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, expression: str, result: Any) -> None:
+        """追加一条记录"""
+        if self._size == self.capacity:
+            if self.spill_path:
+                self._spill(self._slots[self._next])
+        else:
+            self._size += 1
+        self._slots[self._next] = CalculationRecord(expression, result, time.time())
+        self._next = (self._next + 1) % self.capacity
+        self.total += 1
+
+    def latest(self, limit: int) -> List[Dict[str, Any]]:
+        """按时间顺序返回最近 limit 条记录"""
+        count = max(0, min(limit, self._size))
+        start = self._next - count
+        return [self._slots[i % self.capacity].to_dict() for i in range(start, self._next)]
+
+    def clear(self) -> int:
+        """清空内存中的记录（已落盘的记录保留），返回清除的条数"""
+        count = self._size
+        self._slots = [None] * self.capacity
+        self._next = 0
+        self._size = 0
+        self.total = 0
+        if self._spill_file is not None:
+            self._spill_file.flush()
+        return count
+
+    def close(self) -> None:
+        """关闭磁盘段文件"""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _spill(self, record: CalculationRecord) -> None:
+        """将即将被覆盖的记录写入磁盘段文件"""
+        try:
+            if self._spill_file is None:
+                self._spill_file = open(self.spill_path, "a", encoding="utf-8")
+            self._spill_file.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+            self.spilled += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"历史记录落盘失败: {e}")
+
+
+def _summarize_integer(value: int, exact_digits: int, edge_digits: int) -> Dict[str, Any]:
+    """整数结果摘要：不超过 exact_digits 位时返回精确值，否则返回科学计数法、位数和首尾数字
+
+    首位数字由最高若干二进制位和 2 的幂（decimal 高精度）计算，整个过程不把大整数转成字符串。
+    """
+    if value.bit_length() * _LOG10_2 < exact_digits:
+        return {"result": value, "exact": True}
+
+    magnitude = abs(value)
+    shift = max(0, magnitude.bit_length() - 256)
+    context = decimal.Context(prec=edge_digits + 30, Emax=decimal.MAX_EMAX)
+    approx = context.multiply(decimal.Decimal(magnitude >> shift),
+                              context.power(decimal.Decimal(2), shift))
+    digits = approx.adjusted() + 1
+    leading = "".join(map(str, approx.as_tuple().digits))[:edge_digits]
+    trailing = str(magnitude % 10 ** edge_digits).zfill(edge_digits)
+    sign = "-" if value < 0 else ""
+    return {
+        "result": f"{sign}{leading[0]}.{leading[1:]}e+{digits - 1}",
+        "exact": False,
+        "digits": digits,
+        "leading_digits": sign + leading,
+        "trailing_digits": trailing
+    }
+
+
+def _big_number_task(operation: str, args: Tuple[int, ...],
+                     exact_digits: int, edge_digits: int) -> Dict[str, Any]:
+    """计算阶乘或整数幂并返回摘要（在工作进程或当前线程中运行）"""
+    if operation == "factorial":
+        value = math.factorial(args[0])
+    else:
+        value = args[0] ** args[1]
+    return _summarize_integer(value, exact_digits, edge_digits)
+
+
+def _big_number_worker(conn: Any) -> None:
+    """大数计算工作进程：循环接收任务并返回结果"""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        try:
+            conn.send((True, _big_number_task(*task)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class BigNumberEngine:
+    """大数计算引擎（阶乘、整数幂）
+
+    计算前先估算结果位数：小结果直接计算；大结果交给工作进程池，并在截止时间
+    到达后杀掉并替换对应的工作进程，事件循环不会被单个请求阻塞；超大结果直接拒绝。
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 10.0, inline_digits: int = 2000,
+                 exact_digits: int = 1000, max_digits: int = 10_000_000, edge_digits: int = 20):
+        """初始化引擎，工作进程在首次使用时才启动"""
+        self.workers = workers
+        self.timeout = timeout
+        self.inline_digits = inline_digits
+        self.exact_digits = exact_digits
+        self.max_digits = max_digits
+        self.edge_digits = edge_digits
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: Optional[asyncio.Queue] = None
+        self._processes: Dict[int, Any] = {}
+        self.offloaded = 0
+        self.timeouts = 0
+
+    @staticmethod
+    def estimate_digits(operation: str, args: Tuple[int, ...]) -> float:
+        """估算结果的十进制位数"""
+        try:
+            if operation == "factorial":
+                return math.lgamma(args[0] + 1) / math.log(10) + 1
+            base, exponent = args
+            if abs(base) <= 1:
+                return 1
+            return exponent * math.log10(abs(base)) + 1
+        except OverflowError:
+            return math.inf
+
+    async def compute(self, operation: str, *args: int) -> Dict[str, Any]:
+        """计算并返回结果摘要"""
+        digits = self.estimate_digits(operation, args)
+        if digits > self.max_digits:
+            raise EvaluationBudgetError(f"结果约有 {digits:.3g} 位，超过上限 {self.max_digits} 位")
+        task = (operation, args, self.exact_digits, self.edge_digits)
+        if digits <= self.inline_digits:
+            return _big_number_task(*task)
+        self.offloaded += 1
+        return await self._submit(task)
+
+    async def start(self) -> None:
+        """启动工作进程（已启动时直接返回）"""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        workers = await asyncio.gather(
+            *(loop.run_in_executor(None, self._spawn) for _ in range(self.workers)))
+        for worker in workers:
+            self._idle.put_nowait(worker)
+
+    async def _submit(self, task: Tuple[Any, ...]) -> Dict[str, Any]:
+        """把任务交给空闲的工作进程，超时则杀掉并替换该进程"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        await self.start()
+
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TimeoutError(f"等待计算进程超时（{self.timeout} 秒）")
+
+        process, conn = worker
+        try:
+            conn.send(task)
+            remaining = max(0.0, deadline - loop.time())
+            ready = await loop.run_in_executor(None, conn.poll, remaining)
+            if not ready:
+                self.timeouts += 1
+                raise TimeoutError(f"计算超时（超过 {self.timeout} 秒）")
+            ok, payload = conn.recv()
+        except BaseException:
+            # 工作进程状态未知（超时、取消或通信失败），直接替换
+            self._kill(process, conn)
+            replacement = loop.run_in_executor(None, self._spawn)
+            replacement.add_done_callback(self._add_idle)
+            raise
+
+        self._idle.put_nowait(worker)
+        if not ok:
+            raise ValueError(payload)
+        return payload
+
+    def _spawn(self) -> Tuple[Any, Any]:
+        """启动一个工作进程"""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_big_number_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[process.pid] = (process, parent_conn)
+        return process, parent_conn
+
+    def _add_idle(self, future: "asyncio.Future") -> None:
+        """替换进程启动完成后放回空闲队列"""
+        if future.exception() is not None:
+            logger.error(f"启动大数计算进程失败: {future.exception()}")
+        elif self._idle is not None:
+            self._idle.put_nowait(future.result())
+
+    def _kill(self, process: Any, conn: Any) -> None:
+        """结束工作进程"""
+        self._processes.pop(process.pid, None)
+        process.kill()
+        process.join(1)
+        conn.close()
+
+    def close(self) -> None:
+        """结束所有工作进程"""
+        for process, conn in list(self._processes.values()):
+            self._kill(process, conn)
+        self._idle = None
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "workers": self.workers,
+            "running_workers": len(self._processes),
+            "offloaded": self.offloaded,
+            "timeouts": self.timeouts,
+            "timeout_seconds": self.timeout
+        }
+
+
 class Calculator:
     """计算器核心类"""
 
-    def __init__(self):
-        """初始化计算器"""
-        self.history = []
+    def __init__(self, cache_size: int = 512, history_size: int = 1000,
+                 history_spill: Optional[str] = None,
+                 big_numbers: Optional[BigNumberEngine] = None,
+                 compute_executor: Optional[ThreadPoolExecutor] = None,
+                 expression_cache: Optional[ExpressionCache] = None):
+        """初始化计算器
+
+        big_numbers、compute_executor 与 expression_cache 可由多个会话共享，
+        history、memory 与 stat_streams 始终属于单个会话。
+        """
+        self.big_numbers = big_numbers or BigNumberEngine()
+        self.compute_executor = compute_executor or ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="calculator-compute")
+        self.max_matrix_elements = 4_000_000
+        self.history = CalculationHistory(history_size, history_spill)
         self.memory = 0
+        self.expression_cache = expression_cache or ExpressionCache(cache_size)
+        self.evaluator = ExpressionEvaluator(_FUNCTION_TABLE, _CONSTANTS)
+        self.vector_evaluator = VectorEvaluator() if np is not None else None
+        self.max_batch_size = 1_000_000
+        # 表达式列表中的每一项都要单独解析，上限远小于数值数组
+        self.max_batch_expressions = 100_000
+        self.max_sweep_samples = 10_000_000
+        self.max_inline_samples = 10_000
+        self.stat_streams: "OrderedDict[str, StreamingStatistics]" = OrderedDict()
+        self.max_stat_streams = 64
+        self._stream_lock = threading.Lock()
 
     def basic_calculate(self, expression: str) -> Dict[str, Any]:
         """基础计算"""
         try:
-            # 清理表达式
-            expression = expression.strip()
-
-            # 安全的数学表达式评估
-            allowed_chars = set('0123456789+-*/().^ ')
-            if not all(c in allowed_chars or c.isspace() for c in expression):
-                # 检查是否包含数学函数
-                math_functions = ['sin', 'cos', 'tan',
-                                  'log', 'ln', 'sqrt', 'abs', 'exp']
-                if not any(func in expression.lower() for func in math_functions):
-                    raise ValueError("表达式包含不允许的字符")
-
-            # 替换常见的数学符号
-            expression = expression.replace('^', '**')
-            expression = expression.replace('×', '*')
-            expression = expression.replace('÷', '/')
-
-            # 处理数学函数
-            expression = self._process_math_functions(expression)
+            # 规范化表达式：去掉首尾空白并合并连续空白
+            expression = " ".join(expression.split())
+            expression, tree = self._parse_cached(expression)
 
             # 计算结果
-            result = eval(expression, {"__builtins__": {}}, {
-                "sin": math.sin, "cos": math.cos, "tan": math.tan,
-                "log": math.log10, "ln": math.log, "sqrt": math.sqrt,
-                "abs": abs, "exp": math.exp, "pi": math.pi, "e": math.e
-            })
+            result = self.evaluator.evaluate(tree)
 
             # 记录历史
-            calculation_record = {
-                "expression": expression,
-                "result": result,
-                "timestamp": datetime.now().isoformat()
-            }
-            self.history.append(calculation_record)
+            self.history.append(expression, result)
 
             return {
                 "success": True,
@@ -83,6 +982,14 @@ class Calculator:
                 "type": "number" if isinstance(result, (int, float)) else "other"
             }
 
+        except EvaluationBudgetError as e:
+            return {
+                "success": False,
+                "expression": expression,
+                "error": str(e),
+                "type": "budget_error"
+            }
+
         except Exception as e:
             return {
                 "success": False,
@@ -91,39 +998,362 @@ class Calculator:
                 "type": "error"
             }
 
+    def _parse_cached(self, expression: str, variables: Tuple[str, ...] = ()) -> Tuple[str, Any]:
+        """通过缓存获取处理后的表达式和 AST"""
+        cache_key = f"{expression}\0{','.join(variables)}" if variables else expression
+        cached = self.expression_cache.get(cache_key)
+        if cached is None:
+            cached = self._compile_expression(expression, variables)
+            self.expression_cache.put(cache_key, cached)
+        return cached
+
+    def _compile_expression(self, expression: str, variables: Tuple[str, ...] = ()) -> Tuple[str, Any]:
+        """校验并解析表达式，返回处理后的表达式和 AST"""
+        # 替换常见的数学符号
+        expression = expression.replace('^', '**')
+        expression = expression.replace('×', '*')
+        expression = expression.replace('÷', '/')
+
+        # 处理数学函数
+        expression = self._process_math_functions(expression)
+
+        return expression, self.evaluator.parse(expression, variables)
+
     def _process_math_functions(self, expression: str) -> str:
         """处理数学函数"""
         # 处理常见的数学函数格式
-        replacements = {
-            r'sin\(([^)]+)\)': r'sin(\1)',
-            r'cos\(([^)]+)\)': r'cos(\1)',
-            r'tan\(([^)]+)\)': r'tan(\1)',
-            r'log\(([^)]+)\)': r'log(\1)',
-            r'ln\(([^)]+)\)': r'ln(\1)',
-            r'sqrt\(([^)]+)\)': r'sqrt(\1)',
-            r'abs\(([^)]+)\)': r'abs(\1)',
-            r'exp\(([^)]+)\)': r'exp(\1)',
+        return _MATH_FUNCTION_PATTERN.sub(
+            lambda m: f"{m.group(1).lower()}({m.group(2)})", expression)
+
+    def batch_calculate(self, expressions: Optional[List[str]] = None,
+                        expression: Optional[str] = None,
+                        variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """批量计算：多个表达式，或一个表达式配合变量数组，使用 NumPy 向量化求值"""
+        try:
+            if self.vector_evaluator is None:
+                raise RuntimeError("批量计算需要安装 numpy")
+            if expressions is not None:
+                return self._batch_expressions(expressions)
+            if expression is not None:
+                return self._batch_variables(expression, variables or {})
+            raise ValueError("需要提供 expressions 或 expression")
+
+        except EvaluationBudgetError as e:
+            return {"success": False, "error": str(e), "type": "budget_error"}
+
+        except Exception as e:
+            return {"success": False, "error": str(e), "type": "error"}
+
+    def _batch_expressions(self, expressions: List[str]) -> Dict[str, Any]:
+        """多个表达式：按结构分组，每组用一次向量化求值完成"""
+        if not isinstance(expressions, list):
+            raise ValueError("expressions 必须是字符串列表")
+        if len(expressions) > self.max_batch_expressions:
+            raise EvaluationBudgetError(f"表达式数量超过上限 {self.max_batch_expressions}")
+
+        results: List[Optional[float]] = [None] * len(expressions)
+        errors = []
+        # 结构键 -> (模板 AST, 表达式下标列表, 常量列表)
+        groups: Dict[tuple, Tuple[ast.Expression, List[int], List[List[float]]]] = {}
+
+        for index, raw in enumerate(expressions):
+            try:
+                if not isinstance(raw, str):
+                    raise ValueError("表达式必须是字符串")
+                _, tree = self._parse_cached(" ".join(raw.split()))
+            except Exception as e:
+                errors.append({"index": index, "error": str(e)})
+                continue
+            key, constants = _lift_constants(tree)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (_make_template(tree), [], [])
+            group[1].append(index)
+            group[2].append(constants)
+
+        for template, indices, constants in groups.values():
+            columns = np.array(constants, dtype=np.float64).reshape(
+                len(indices), len(constants[0]))
+            variables = {f"_c{i}": columns[:, i] for i in range(columns.shape[1])}
+            try:
+                values = np.broadcast_to(
+                    self.vector_evaluator.evaluate(template, variables), (len(indices),))
+            except Exception:
+                # 整组失败（如某一项超出预算）时逐项求值，只让出错的项失败
+                values = np.full(len(indices), np.nan)
+                for position, index in enumerate(indices):
+                    row = {name: column[position:position + 1] for name, column in variables.items()}
+                    try:
+                        values[position] = np.broadcast_to(
+                            self.vector_evaluator.evaluate(template, row), (1,))[0]
+                    except Exception as e:
+                        errors.append({"index": index, "error": str(e)})
+                        indices[position] = -1
+            finite = np.isfinite(values)
+            for position, value in enumerate(values.tolist()):
+                index = indices[position]
+                if index < 0:
+                    continue
+                if finite[position]:
+                    results[index] = value
+                else:
+                    errors.append({"index": index, "error": _NON_FINITE_ERROR})
+
+        errors.sort(key=lambda item: item["index"])
+        return {
+            "success": True,
+            "mode": "expressions",
+            "count": len(expressions),
+            "groups": len(groups),
+            "results": results,
+            "errors": errors,
+            "type": "batch"
         }
 
-        for pattern, replacement in replacements.items():
-            expression = re.sub(pattern, replacement,
-                                expression, flags=re.IGNORECASE)
+    def _batch_variables(self, expression: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        """单个表达式配合变量数组：一次向量化求值"""
+        if not isinstance(variables, dict):
+            raise ValueError("variables 必须是 变量名 -> 数值数组 的映射")
+        arrays = {}
+        for name, values in variables.items():
+            _check_variable_name(name)
+            array = np.asarray(values, dtype=np.float64)
+            if array.ndim > 1:
+                raise ValueError(f"变量 {name} 必须是一维数组或数值")
+            if array.size > self.max_batch_size:
+                raise EvaluationBudgetError(f"变量 {name} 的长度超过上限 {self.max_batch_size}")
+            arrays[name] = array
+        shape = np.broadcast_shapes(*(array.shape for array in arrays.values()))
+
+        expression, tree = self._parse_cached(
+            " ".join(expression.split()), tuple(sorted(arrays)))
+        values = np.broadcast_to(np.asarray(
+            self.vector_evaluator.evaluate(tree, arrays), dtype=np.float64), shape).ravel()
+        results, invalid_count = _to_json_list(values)
+
+        return {
+            "success": True,
+            "mode": "variables",
+            "expression": expression,
+            "count": int(values.size),
+            "results": results,
+            "invalid_count": invalid_count,
+            "type": "batch"
+        }
+
+    def prepare_sweep(self, expression: str, variables: Dict[str, Any],
+                      steps: int = 100) -> SweepPlan:
+        """校验扫描参数并生成扫描计划
+
+        variables 中每个变量的取值范围可以写成 [start, stop]（使用 steps 个点），
+        或 {"start": ..., "stop": ..., "steps": ...}。
+        """
+        if self.vector_evaluator is None:
+            raise RuntimeError("参数扫描需要安装 numpy")
+        if not isinstance(variables, dict) or not variables:
+            raise ValueError("至少需要一个扫描变量")
+
+        ranges = {}
+        for name, spec in variables.items():
+            _check_variable_name(name)
+            if isinstance(spec, dict):
+                start, stop = spec.get("start"), spec.get("stop")
+                count = spec.get("steps", steps)
+            elif isinstance(spec, (list, tuple)) and len(spec) == 2:
+                start, stop = spec
+                count = steps
+            else:
+                raise ValueError(f"变量 {name} 的范围格式无效，应为 [start, stop] 或 {{start, stop, steps}}")
+            if not isinstance(count, int) or count < 1:
+                raise ValueError(f"变量 {name} 的步数必须是正整数")
+            ranges[name] = (float(start), float(stop), count)
+
+        # 先按步数检查总采样点数，再生成坐标轴，超大的 steps 不会先分配内存
+        total = math.prod(count for _, _, count in ranges.values())
+        if total > self.max_sweep_samples:
+            raise EvaluationBudgetError(f"采样点数 {total} 超过上限 {self.max_sweep_samples}")
+        axes = {name: np.linspace(start, stop, count) for name, (start, stop, count) in ranges.items()}
+
+        expression, tree = self._parse_cached(
+            " ".join(expression.split()), tuple(sorted(axes)))
+        return SweepPlan(self.vector_evaluator, expression, tree, axes)
+
+    def sweep_calculate(self, expression: str, variables: Dict[str, Any],
+                        steps: int = 100, include_grid: bool = True) -> Dict[str, Any]:
+        """参数扫描（一次性返回），大规模扫描请使用 HTTP 流式接口 /sweep"""
+        try:
+            plan = self.prepare_sweep(expression, variables, steps)
+            if plan.total > self.max_inline_samples:
+                raise EvaluationBudgetError(
+                    f"采样点数 {plan.total} 超过单次返回上限 {self.max_inline_samples}，"
+                    f"请使用 POST /sweep 流式接口")
+            grid, values = plan.evaluate(0, plan.total)
+            results, invalid_count = _to_json_list(values)
+            result = {
+                "success": True,
+                "expression": plan.expression,
+                "variables": list(plan.axes),
+                "shape": list(plan.shape),
+                "count": plan.total
+            }
+            if include_grid:
+                result["grid"] = {name: column.tolist() for name, column in grid.items()}
+            result.update({
+                "results": results,
+                "invalid_count": invalid_count,
+                "type": "sweep"
+            })
+            return result
+
+        except EvaluationBudgetError as e:
+            return {"success": False, "error": str(e), "type": "budget_error"}
 
-        return expression
+        except Exception as e:
+            return {"success": False, "error": str(e), "type": "error"}
+
+    def statistics_calculate(self, values: Optional[List[float]] = None,
+                             stream_id: Optional[str] = None, action: str = "update",
+                             quantiles: Optional[List[float]] = None, bins: int = 10,
+                             hist_range: Optional[List[float]] = None,
+                             ddof: int = 1) -> Dict[str, Any]:
+        """统计计算
+
+        不提供 stream_id 时对 values 一次性精确计算；提供 stream_id 时为流式模式，
+        数据可以分多次调用（action=update）追加，action=result 查看结果，action=reset 删除该流。
+        """
+        try:
+            if self.vector_evaluator is None:
+                raise RuntimeError("统计计算需要安装 numpy")
+            quantiles = [0.25, 0.5, 0.75] if quantiles is None else quantiles
+            if any(not isinstance(q, (int, float)) or not 0 <= q <= 1 for q in quantiles):
+                raise ValueError("分位数必须在 0 到 1 之间")
+            if not isinstance(bins, int) or bins < 1 or bins > 10000:
+                raise ValueError("直方图分箱数必须在 1 到 10000 之间")
+            if hist_range is not None:
+                if len(hist_range) != 2 or not hist_range[0] < hist_range[1]:
+                    raise ValueError("直方图范围应为 [最小值, 最大值]")
+                hist_range = (float(hist_range[0]), float(hist_range[1]))
+            if ddof not in (0, 1):
+                raise ValueError("ddof 只能是 0（总体）或 1（样本）")
+
+            if stream_id is None:
+                return self._batch_statistics(values, quantiles, bins, hist_range, ddof)
+            return self._stream_statistics(
+                str(stream_id), action, values, quantiles, bins, hist_range, ddof)
+
+        except EvaluationBudgetError as e:
+            return {"success": False, "error": str(e), "type": "budget_error"}
 
-    def advanced_calculate(self, operation: str, **kwargs) -> Dict[str, Any]:
+        except Exception as e:
+            return {"success": False, "error": str(e), "type": "error"}
+
+    def _prepare_values(self, values: Any) -> Tuple[Any, int]:
+        """转换为 float64 数组并去掉非有限值，返回数组和被忽略的数量"""
+        array = np.asarray(values if values is not None else [], dtype=np.float64).ravel()
+        if array.size > self.max_batch_size:
+            raise EvaluationBudgetError(f"单次数据量超过上限 {self.max_batch_size}")
+        finite = np.isfinite(array)
+        if finite.all():
+            return array, 0
+        return array[finite], int(array.size - np.count_nonzero(finite))
+
+    def _batch_statistics(self, values: Any, quantiles: List[float], bins: int,
+                          hist_range: Optional[Tuple[float, float]], ddof: int) -> Dict[str, Any]:
+        """一次性精确统计"""
+        array, ignored = self._prepare_values(values)
+        if array.size == 0:
+            raise ValueError("没有可统计的有限数值")
+        variance = float(array.var(ddof=ddof)) if array.size > ddof else None
+        counts, edges = np.histogram(array, bins=bins, range=hist_range)
+        return {
+            "success": True,
+            "mode": "batch",
+            "count": int(array.size),
+            "ignored_count": ignored,
+            "sum": float(array.sum()),
+            "mean": float(array.mean()),
+            "variance": variance,
+            "std": math.sqrt(variance) if variance is not None else None,
+            "min": float(array.min()),
+            "max": float(array.max()),
+            "quantiles": dict(zip(map(str, quantiles), np.quantile(array, quantiles).tolist())),
+            "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+            "type": "statistics"
+        }
+
+    def _stream_statistics(self, stream_id: str, action: str, values: Any,
+                           quantiles: List[float], bins: int,
+                           hist_range: Optional[Tuple[float, float]], ddof: int) -> Dict[str, Any]:
+        """流式统计：按 stream_id 累积多次调用的数据（在计算线程池中执行，同一会话的统计流串行更新）"""
+        with self._stream_lock:
+            return self._stream_statistics_locked(
+                stream_id, action, values, quantiles, bins, hist_range, ddof)
+
+    def _stream_statistics_locked(self, stream_id: str, action: str, values: Any,
+                                  quantiles: List[float], bins: int,
+                                  hist_range: Optional[Tuple[float, float]], ddof: int) -> Dict[str, Any]:
+        if action == "reset":
+            removed = self.stat_streams.pop(stream_id, None) is not None
+            return {"success": True, "mode": "stream", "stream_id": stream_id,
+                    "action": action, "removed": removed, "type": "statistics"}
+        if action not in ("update", "result"):
+            raise ValueError(f"不支持的流式操作: {action}")
+
+        stream = self.stat_streams.get(stream_id)
+        if stream is None:
+            if action == "result":
+                raise ValueError(f"统计流不存在: {stream_id}")
+            stream = self.stat_streams[stream_id] = StreamingStatistics(bins, hist_range)
+            while len(self.stat_streams) > self.max_stat_streams:
+                self.stat_streams.popitem(last=False)
+        self.stat_streams.move_to_end(stream_id)
+
+        if action == "update":
+            array, ignored = self._prepare_values(values)
+            stream.update(array)
+            stream.ignored += ignored
+
+        return {
+            "success": True,
+            "mode": "stream",
+            "stream_id": stream_id,
+            "action": action,
+            **stream.summary(quantiles, ddof),
+            "type": "statistics"
+        }
+
+    async def advanced_calculate(self, operation: str, **kwargs) -> Dict[str, Any]:
         """高级计算功能"""
+        parameters = kwargs
         try:
-            if operation == "factorial":
+            extra: Dict[str, Any] = {}
+            if operation in _LINALG_OPERATIONS:
+                if np is None:
+                    raise RuntimeError("线性代数运算需要安装 numpy")
+                # 矩阵可能很大，响应中只回显形状
+                parameters = {key: ({"shape": list(np.shape(value))} if isinstance(value, list)
+                                    else {"shape": value.get("shape")} if isinstance(value, dict)
+                                    else value)
+                              for key, value in kwargs.items()}
+                extra = await self._linear_algebra(operation, kwargs)
+                result = extra.pop("result")
+
+            elif operation == "factorial":
                 n = kwargs.get("n", 0)
                 if not isinstance(n, int) or n < 0:
                     raise ValueError("阶乘需要非负整数")
-                result = math.factorial(n)
+                extra = await self.big_numbers.compute("factorial", n)
+                result = extra.pop("result")
 
             elif operation == "power":
                 base = kwargs.get("base", 0)
                 exponent = kwargs.get("exponent", 1)
-                result = base ** exponent
+                if isinstance(base, int) and isinstance(exponent, int) and exponent >= 0:
+                    # 整数幂可能产生大整数，交给大数引擎
+                    extra = await self.big_numbers.compute("power", base, exponent)
+                    result = extra.pop("result")
+                else:
+                    result = base ** exponent
 
             elif operation == "root":
                 number = kwargs.get("number", 0)
@@ -150,32 +1380,68 @@ class Calculator:
             return {
                 "success": True,
                 "operation": operation,
-                "parameters": kwargs,
+                "parameters": parameters,
                 "result": result,
+                **extra,
                 "type": "advanced"
             }
 
-        except Exception as e:
+        except EvaluationBudgetError as e:
             return {
                 "success": False,
                 "operation": operation,
-                "parameters": kwargs,
+                "parameters": parameters,
                 "error": str(e),
+                "type": "budget_error"
+            }
+
+        except Exception as e:
+            return {
+                "success": False,
+                "operation": operation,
+                "parameters": parameters,
+                "error": str(e) or type(e).__name__,
                 "type": "error"
             }
 
+    async def _linear_algebra(self, operation: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """线性代数运算：解析输入后放到线程池中执行，避免阻塞事件循环（调用方已确认 numpy 可用）"""
+        output_format = kwargs.get("output_format", "list")
+        if output_format not in ("list", "base64"):
+            raise ValueError("output_format 只能是 list 或 base64")
+        a = _decode_matrix(kwargs.get("a"), "a", self.max_matrix_elements)
+        b = None
+        if operation in ("matrix_multiply", "solve", "least_squares"):
+            b = _decode_matrix(kwargs.get("b"), "b", self.max_matrix_elements)
+        if operation in ("solve", "inverse", "determinant", "eigenvalues") and \
+                (a.ndim != 2 or a.shape[0] != a.shape[1]):
+            raise ValueError(f"{operation} 需要方阵 a")
+        elements = _result_elements(operation, a, b)
+        if elements > self.max_matrix_elements:
+            raise EvaluationBudgetError(f"结果的元素数 {elements} 超过上限 {self.max_matrix_elements}")
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.compute_executor, _linalg_task, operation, a, b, output_format)
+
+    async def offload(self, func: Callable[..., Dict[str, Any]], *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        """在计算线程池中执行批量、扫描、统计等耗时计算，避免阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.compute_executor, functools.partial(func, *args, **kwargs))
+
     def get_history(self, limit: int = 10) -> Dict[str, Any]:
         """获取计算历史"""
         return {
-            "history": self.history[-limit:],
-            "total_calculations": len(self.history),
+            "history": self.history.latest(limit),
+            "total_calculations": self.history.total,
+            "retained": len(self.history),
+            "capacity": self.history.capacity,
             "timestamp": datetime.now().isoformat()
         }
 
     def clear_history(self) -> Dict[str, Any]:
         """清空历史记录"""
-        count = len(self.history)
-        self.history.clear()
+        count = self.history.clear()
         return {
             "success": True,
             "cleared_count": count,
@@ -214,16 +1480,211 @@ class Calculator:
                 "error": str(e)
             }
 
+    def approx_memory(self) -> int:
+        """粗略估算会话私有状态占用的内存（字节），供会话淘汰使用"""
+        size = 8 * self.history.capacity + 240 * len(self.history)
+        with self._stream_lock:
+            streams = list(self.stat_streams.values())
+        for stream in streams:
+            size += 512 + 100 * (len(stream.sketch.positive) + len(stream.sketch.negative))
+            if stream.histogram is not None:
+                size += stream.histogram.nbytes + stream.edges.nbytes
+        return size
+
+    def close(self) -> None:
+        """释放会话私有资源（共享的进程池和线程池不在此关闭）"""
+        self.history.close()
+
+
+DEFAULT_SESSION = "default"
+_SESSION_ID_PATTERN = re.compile(r"^[\w.:@-]{1,128}$")
+
+
+class _SessionEntry:
+    """会话表中的一项"""
+
+    __slots__ = ("calculator", "last_access")
+
+    def __init__(self, calculator: Calculator, last_access: float):
+        self.calculator = calculator
+        self.last_access = last_access
+
+
+class CalculatorSessions:
+    """按会话隔离的计算器状态
+
+    会话 ID 经哈希分布到若干分片，每个分片有独立的锁和按最近使用排序的表，
+    不同会话之间不争用同一把锁。空闲超时的会话会被回收；会话数或估算内存
+    超出上限时，淘汰全局最久未使用的会话。
+    """
+
+    def __init__(self, factory: Callable[[str], Calculator], shards: int = 16,
+                 idle_timeout: float = 1800.0, max_sessions: int = 1024,
+                 max_memory: int = 256 * 1024 * 1024):
+        """初始化会话表"""
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_memory = max_memory
+        self._shards: List[Tuple[threading.Lock, "OrderedDict[str, _SessionEntry]"]] = [
+            (threading.Lock(), OrderedDict()) for _ in range(max(1, shards))]
+        self._counter_lock = threading.Lock()
+        self.created = 0
+        self.idle_evictions = 0
+        self.pressure_evictions = 0
+        self.memory_estimate = 0
+
+    def _shard(self, session_id: str) -> Tuple[threading.Lock, "OrderedDict[str, _SessionEntry]"]:
+        return self._shards[hash(session_id) % len(self._shards)]
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _, entries in self._shards)
+
+    def get(self, session_id: Optional[str] = None) -> Calculator:
+        """返回会话对应的计算器，不存在时创建"""
+        session_id = session_id or DEFAULT_SESSION
+        if not isinstance(session_id, str) or not _SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("会话 ID 只能包含字母、数字和 . : @ _ -，长度不超过 128")
+
+        lock, entries = self._shard(session_id)
+        now = time.monotonic()
+        with lock:
+            entry = entries.get(session_id)
+            if entry is not None:
+                entry.last_access = now
+                entries.move_to_end(session_id)
+                return entry.calculator
+            entry = _SessionEntry(self.factory(session_id), now)
+            entries[session_id] = entry
+
+        with self._counter_lock:
+            self.created += 1
+        while len(self) > self.max_sessions:
+            if not self._evict_oldest(keep=session_id):
+                break
+        return entry.calculator
+
+    def _evict_oldest(self, keep: Optional[str] = None) -> bool:
+        """淘汰全局最久未使用的会话（各分片队首中最旧的一个）"""
+        oldest = None
+        for lock, entries in self._shards:
+            with lock:
+                for session_id, entry in entries.items():
+                    if session_id == keep:
+                        continue
+                    if oldest is None or entry.last_access < oldest[0]:
+                        oldest = (entry.last_access, session_id)
+                    break
+        if oldest is None:
+            return False
+        if self._remove(oldest[1], oldest[0]) is None:
+            # 期间被再次访问，视为已处理，由调用方重新检查
+            return True
+        with self._counter_lock:
+            self.pressure_evictions += 1
+        return True
+
+    def _remove(self, session_id: str, last_access: Optional[float] = None) -> Optional[Calculator]:
+        """移除会话；给定 last_access 时，仅在会话此后未被访问过才移除"""
+        lock, entries = self._shard(session_id)
+        with lock:
+            entry = entries.get(session_id)
+            if entry is None or (last_access is not None and entry.last_access != last_access):
+                return None
+            del entries[session_id]
+        entry.calculator.close()
+        return entry.calculator
+
+    def maintain(self) -> None:
+        """回收空闲会话，并在估算内存超出上限时按最近使用顺序淘汰"""
+        now = time.monotonic()
+        expired: List[Calculator] = []
+        usage: List[Tuple[float, str, int]] = []
+        for lock, entries in self._shards:
+            with lock:
+                for session_id in list(entries):
+                    entry = entries[session_id]
+                    if now - entry.last_access > self.idle_timeout:
+                        expired.append(entries.pop(session_id).calculator)
+                    else:
+                        usage.append((entry.last_access, session_id,
+                                      entry.calculator.approx_memory()))
+        for calculator in expired:
+            calculator.close()
+
+        total = sum(memory for _, _, memory in usage)
+        pressure = 0
+        if total > self.max_memory:
+            usage.sort()
+            for last_access, session_id, memory in usage:
+                if total <= self.max_memory:
+                    break
+                if self._remove(session_id, last_access) is not None:
+                    total -= memory
+                    pressure += 1
+
+        with self._counter_lock:
+            self.idle_evictions += len(expired)
+            self.pressure_evictions += pressure
+            self.memory_estimate = total
+        if expired or pressure:
+            logger.info(f"回收空闲会话 {len(expired)} 个，内存超限淘汰 {pressure} 个")
+
+    def close(self) -> None:
+        """关闭所有会话"""
+        for lock, entries in self._shards:
+            with lock:
+                calculators = [entry.calculator for entry in entries.values()]
+                entries.clear()
+            for calculator in calculators:
+                calculator.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """会话统计信息"""
+        return {
+            "sessions": len(self),
+            "shards": len(self._shards),
+            "max_sessions": self.max_sessions,
+            "idle_timeout_seconds": self.idle_timeout,
+            "max_memory_bytes": self.max_memory,
+            "memory_estimate_bytes": self.memory_estimate,
+            "created": self.created,
+            "idle_evictions": self.idle_evictions,
+            "pressure_evictions": self.pressure_evictions
+        }
+
+
+# 各会话共享的资源：解析缓存、大数计算进程池，以及执行线性代数、批量、扫描和统计计算的线程池
+expression_cache = ExpressionCache()
+big_numbers = BigNumberEngine()
+compute_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="calculator-compute")
+session_options: Dict[str, Any] = {"history_size": 1000, "history_spill_dir": None}
+
+
+def _create_calculator(session_id: str) -> Calculator:
+    """为新会话创建计算器，历史记录落盘文件按会话 ID 的哈希区分"""
+    spill_path = None
+    if session_options["history_spill_dir"]:
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:16]
+        spill_path = os.path.join(session_options["history_spill_dir"], f"history-{digest}.jsonl")
+    return Calculator(
+        history_size=session_options["history_size"],
+        history_spill=spill_path,
+        big_numbers=big_numbers,
+        compute_executor=compute_executor,
+        expression_cache=expression_cache
+    )
+
 
 # 创建服务器实例
 server = Server("calculator-mcp-server")
-calculator = Calculator()
+sessions = CalculatorSessions(_create_calculator)
 
 
 @server.list_tools()
 async def handle_list_tools() -> list[Tool]:
     """列出可用的工具"""
-    return [
+    tools = [
         Tool(
             name="basic_calculate",
             description="基础数学计算，支持四则运算、括号、数学函数等",
@@ -240,14 +1701,30 @@ async def handle_list_tools() -> list[Tool]:
         ),
         Tool(
             name="advanced_calculate",
-            description="高级数学计算，包括阶乘、幂运算、开方、百分比、复利等",
+            description="高级数学计算，包括阶乘、幂运算、开方、百分比、复利，以及矩阵乘法、解线性方程组、求逆、行列式、特征值、最小二乘等",
             inputSchema={
                 "type": "object",
                 "properties": {
                     "operation": {
                         "type": "string",
                         "description": "操作类型",
-                        "enum": ["factorial", "power", "root", "percentage", "compound_interest"]
+                        "enum": ["factorial", "power", "root", "percentage", "compound_interest",
+                                 "matrix_multiply", "solve", "inverse", "determinant",
+                                 "eigenvalues", "least_squares"]
+                    },
+                    "a": {
+                        "description": "线性代数运算的矩阵 A：嵌套列表，或 {\"base64\": 小端 float64 字节的 base64, \"shape\": [行, 列]}",
+                        "anyOf": [{"type": "array"}, {"type": "object"}]
+                    },
+                    "b": {
+                        "description": "矩阵乘法的右矩阵、solve/least_squares 的右端项，格式同 a",
+                        "anyOf": [{"type": "array"}, {"type": "object"}]
+                    },
+                    "output_format": {
+                        "type": "string",
+                        "description": "矩阵结果的输出格式：list（嵌套列表，默认）或 base64（小端 float64）",
+                        "enum": ["list", "base64"],
+                        "default": "list"
                     },
                     "n": {
                         "type": "integer",
@@ -293,6 +1770,116 @@ async def handle_list_tools() -> list[Tool]:
                 "required": ["operation"]
             }
         ),
+        Tool(
+            name="batch_calculate",
+            description="批量计算：一次计算多个表达式，或对一个表达式代入变量数组（NumPy 向量化，结果为浮点数）",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "expressions": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "要计算的表达式列表，如: [\"2+3\", \"sin(1)\", \"sqrt(16)\"]"
+                    },
+                    "expression": {
+                        "type": "string",
+                        "description": "含变量的表达式，与 variables 配合使用，如: x^2 + sin(y)"
+                    },
+                    "variables": {
+                        "type": "object",
+                        "description": "变量名到数值数组（或单个数值）的映射，数组需等长，如: {\"x\": [1, 2, 3], \"y\": 0}",
+                        "additionalProperties": {
+                            "anyOf": [
+                                {"type": "number"},
+                                {"type": "array", "items": {"type": "number"}}
+                            ]
+                        }
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="sweep_calculate",
+            description="参数扫描：在变量的取值范围（网格）上计算表达式，适合绘图采样；大规模采样请使用 HTTP 流式接口 POST /sweep",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "expression": {
+                        "type": "string",
+                        "description": "含变量的表达式，如: sin(x) * exp(-x / 10)"
+                    },
+                    "variables": {
+                        "type": "object",
+                        "description": "变量名到取值范围的映射，范围写成 [start, stop] 或 {\"start\": 0, \"stop\": 1, \"steps\": 50}；多个变量时在笛卡尔积网格上计算",
+                        "additionalProperties": {
+                            "anyOf": [
+                                {"type": "array", "items": {"type": "number"}, "minItems": 2, "maxItems": 2},
+                                {"type": "object"}
+                            ]
+                        }
+                    },
+                    "steps": {
+                        "type": "integer",
+                        "description": "每个变量默认的采样点数，默认100",
+                        "default": 100,
+                        "minimum": 1
+                    },
+                    "include_grid": {
+                        "type": "boolean",
+                        "description": "是否返回每个采样点的变量取值，默认true",
+                        "default": True
+                    }
+                },
+                "required": ["expression", "variables"]
+            }
+        ),
+        Tool(
+            name="statistics_calculate",
+            description="统计计算：均值、方差、极值、分位数、直方图。提供 stream_id 时为流式模式，数据可分多次追加，内存占用恒定",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "values": {
+                        "type": "array",
+                        "items": {"type": "number"},
+                        "description": "数值数组（流式模式下为本次追加的一块数据）"
+                    },
+                    "stream_id": {
+                        "type": "string",
+                        "description": "统计流 ID，提供时启用流式模式"
+                    },
+                    "action": {
+                        "type": "string",
+                        "description": "流式模式操作：update 追加数据并返回当前结果，result 只查看结果，reset 删除该流",
+                        "enum": ["update", "result", "reset"],
+                        "default": "update"
+                    },
+                    "quantiles": {
+                        "type": "array",
+                        "items": {"type": "number", "minimum": 0, "maximum": 1},
+                        "description": "要计算的分位数，默认 [0.25, 0.5, 0.75]；流式模式下为近似值（相对误差 1%）"
+                    },
+                    "bins": {
+                        "type": "integer",
+                        "description": "直方图分箱数，默认10",
+                        "default": 10,
+                        "minimum": 1,
+                        "maximum": 10000
+                    },
+                    "range": {
+                        "type": "array",
+                        "items": {"type": "number"},
+                        "description": "直方图范围 [最小值, 最大值]；流式模式下需在第一次 update 时提供才会统计直方图"
+                    },
+                    "ddof": {
+                        "type": "integer",
+                        "description": "方差自由度修正：1 为样本方差（默认），0 为总体方差",
+                        "enum": [0, 1],
+                        "default": 1
+                    }
+                }
+            }
+        ),
         Tool(
             name="get_history",
             description="获取计算历史记录",
@@ -337,12 +1924,21 @@ async def handle_list_tools() -> list[Tool]:
             }
         )
     ]
+    # 所有工具都接受可选的 session_id，用于隔离不同客户端的历史、内存和统计流
+    for tool in tools:
+        tool.inputSchema["properties"]["session_id"] = {
+            "type": "string",
+            "description": "会话 ID，不同会话的历史记录、内存和统计流互相隔离（默认: default）"
+        }
+    return tools
 
 
 @server.call_tool()
 async def handle_call_tool(name: str, arguments: dict) -> list[TextContent]:
     """处理工具调用"""
     try:
+        calculator = sessions.get(arguments.get("session_id"))
+
         if name == "basic_calculate":
             result = calculator.basic_calculate(
                 arguments.get("expression", ""))
@@ -353,8 +1949,42 @@ async def handle_call_tool(name: str, arguments: dict) -> list[TextContent]:
             if not isinstance(operation, str):
                 return [TextContent(type="text", text=json.dumps({"success": False, "error": "Missing or invalid 'operation' argument"}, ensure_ascii=False, indent=2))]
             # 移除operation参数，其余作为kwargs传递
-            kwargs = {k: v for k, v in arguments.items() if k != "operation"}
-            result = calculator.advanced_calculate(operation, **kwargs)
+            kwargs = {k: v for k, v in arguments.items()
+                      if k not in ("operation", "session_id")}
+            result = await calculator.advanced_calculate(operation, **kwargs)
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "batch_calculate":
+            result = await calculator.offload(
+                calculator.batch_calculate,
+                expressions=arguments.get("expressions"),
+                expression=arguments.get("expression"),
+                variables=arguments.get("variables")
+            )
+            # 批量结果可能很长，不做缩进以减小响应体积
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False))]
+
+        elif name == "sweep_calculate":
+            result = await calculator.offload(
+                calculator.sweep_calculate,
+                arguments.get("expression", ""),
+                arguments.get("variables", {}),
+                arguments.get("steps", 100),
+                arguments.get("include_grid", True)
+            )
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False))]
+
+        elif name == "statistics_calculate":
+            result = await calculator.offload(
+                calculator.statistics_calculate,
+                values=arguments.get("values"),
+                stream_id=arguments.get("stream_id"),
+                action=arguments.get("action", "update"),
+                quantiles=arguments.get("quantiles"),
+                bins=arguments.get("bins", 10),
+                hist_range=arguments.get("range"),
+                ddof=arguments.get("ddof", 1)
+            )
             return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
         elif name == "get_history":
@@ -408,6 +2038,16 @@ class ToolResponse(BaseModel):
     error: Optional[str] = None
 
 
+class SweepRequest(BaseModel):
+    expression: str
+    variables: Dict[str, Any]
+    steps: int = 100
+    chunk_size: int = 10000
+    include_grid: bool = True
+    decimals: Optional[int] = None
+    session_id: Optional[str] = None
+
+
 @app.get("/")
 async def root():
     """根路径，返回服务器信息"""
@@ -418,7 +2058,9 @@ async def root():
         "endpoints": {
             "tools": "/tools",
             "call_tool": "/call_tool",
-            "mcp_info": "/mcp/info"
+            "mcp_info": "/mcp/info",
+            "sweep": "/sweep",
+            "stats": "/stats"
         }
     }
 
@@ -438,7 +2080,19 @@ async def mcp_info():
             },
             {
                 "name": "advanced_calculate",
-                "description": "高级数学计算，包括阶乘、幂运算、开方、百分比、复利等"
+                "description": "高级数学计算，包括阶乘、幂运算、开方、百分比、复利、线性代数等"
+            },
+            {
+                "name": "batch_calculate",
+                "description": "批量计算：一次计算多个表达式，或对一个表达式代入变量数组"
+            },
+            {
+                "name": "sweep_calculate",
+                "description": "参数扫描：在变量的取值范围（网格）上计算表达式"
+            },
+            {
+                "name": "statistics_calculate",
+                "description": "统计计算：均值、方差、极值、分位数、直方图，支持分块流式追加数据"
             },
             {
                 "name": "get_history",
@@ -471,6 +2125,17 @@ async def get_config_schema():
     }
 
 
+@app.get("/stats")
+async def stats():
+    """运行时统计信息"""
+    return {
+        "expression_cache": expression_cache.stats(),
+        "big_numbers": big_numbers.stats(),
+        "sessions": sessions.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 @app.get("/tools")
 async def list_tools():
     """列出可用的工具"""
@@ -488,9 +2153,14 @@ async def list_tools():
 
 
 @app.post("/call_tool")
-async def call_tool(request: ToolCallRequest) -> ToolResponse:
-    """调用工具"""
+async def call_tool(
+    request: ToolCallRequest,
+    session_header: Optional[str] = Header(None, alias="X-Session-Id")
+) -> ToolResponse:
+    """调用工具，会话 ID 取自 session_id 参数或 X-Session-Id 请求头"""
     try:
+        calculator = sessions.get(request.arguments.get("session_id") or session_header)
+
         if request.tool_name == "basic_calculate":
             result = calculator.basic_calculate(
                 request.arguments.get("expression", ""))
@@ -500,9 +2170,41 @@ async def call_tool(request: ToolCallRequest) -> ToolResponse:
             operation = request.arguments.get("operation")
             if not isinstance(operation, str):
                 return ToolResponse(success=False, error="Missing or invalid 'operation' argument")
-            kwargs = {k: v for k, v in request.arguments.items() if k !=
-                      "operation"}
-            result = calculator.advanced_calculate(operation, **kwargs)
+            kwargs = {k: v for k, v in request.arguments.items()
+                      if k not in ("operation", "session_id")}
+            result = await calculator.advanced_calculate(operation, **kwargs)
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "batch_calculate":
+            result = await calculator.offload(
+                calculator.batch_calculate,
+                expressions=request.arguments.get("expressions"),
+                expression=request.arguments.get("expression"),
+                variables=request.arguments.get("variables")
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "sweep_calculate":
+            result = await calculator.offload(
+                calculator.sweep_calculate,
+                request.arguments.get("expression", ""),
+                request.arguments.get("variables", {}),
+                request.arguments.get("steps", 100),
+                request.arguments.get("include_grid", True)
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "statistics_calculate":
+            result = await calculator.offload(
+                calculator.statistics_calculate,
+                values=request.arguments.get("values"),
+                stream_id=request.arguments.get("stream_id"),
+                action=request.arguments.get("action", "update"),
+                quantiles=request.arguments.get("quantiles"),
+                bins=request.arguments.get("bins", 10),
+                hist_range=request.arguments.get("range"),
+                ddof=request.arguments.get("ddof", 1)
+            )
             return ToolResponse(success=True, data=result)
 
         elif request.tool_name == "get_history":
@@ -531,6 +2233,66 @@ async def call_tool(request: ToolCallRequest) -> ToolResponse:
         return ToolResponse(success=False, error=f"调用失败: {str(e)}")
 
 
+@app.post("/sweep")
+async def sweep(
+    request: SweepRequest,
+    session_header: Optional[str] = Header(None, alias="X-Session-Id")
+):
+    """参数扫描，以 NDJSON 分块流式返回结果
+
+    第一行为 meta（变量、网格形状、总点数），随后每行一个 chunk，最后一行为 end。
+    """
+    try:
+        calculator = sessions.get(request.session_id or session_header)
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(
+            calculator.compute_executor, calculator.prepare_sweep,
+            request.expression, request.variables, request.steps)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    chunk_size = max(1, min(request.chunk_size, 100_000))
+
+    def generate():
+        yield json.dumps(plan.meta(), ensure_ascii=False) + "\n"
+        try:
+            for chunk in plan.iter_chunks(chunk_size, request.include_grid, request.decimals):
+                yield json.dumps(chunk, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"参数扫描失败: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    # 同步生成器由 Starlette 放到线程池中迭代，不会阻塞事件循环
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def _maintain_sessions() -> None:
+    """定期回收空闲会话并检查内存上限"""
+    interval = max(1.0, min(60.0, sessions.idle_timeout / 4))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sessions.maintain()
+        except Exception as e:
+            logger.error(f"会话维护失败: {e}")
+
+
+@app.on_event("startup")
+async def startup_event():
+    """预先启动大数计算进程，避免首个大数请求承担进程启动开销；启动会话维护任务"""
+    await big_numbers.start()
+    app.state.session_maintenance = asyncio.create_task(_maintain_sessions())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时的清理工作"""
+    app.state.session_maintenance.cancel()
+    sessions.close()
+    big_numbers.close()
+    compute_executor.shutdown(wait=False)
+
+
 async def main():
     """运行HTTP服务器"""
     parser = argparse.ArgumentParser(description="计算器 MCP 服务器")
@@ -538,8 +2300,47 @@ async def main():
                         help="服务器端口 (默认: 8765)")
     parser.add_argument("--host", type=str, default="0.0.0.0",
                         help="服务器主机 (默认: 0.0.0.0)")
+    parser.add_argument("--cache-size", type=int, default=512,
+                        help="表达式编译缓存容量，0 表示禁用 (默认: 512)")
+    parser.add_argument("--history-size", type=int, default=1000,
+                        help="内存中保留的历史记录条数 (默认: 1000)")
+    parser.add_argument("--history-spill", type=str, default=None,
+                        help="超出容量的历史记录按会话追加写入的目录 (默认: 不落盘)")
+    parser.add_argument("--bignum-workers", type=int, default=2,
+                        help="大数计算进程数 (默认: 2)")
+    parser.add_argument("--bignum-timeout", type=float, default=10.0,
+                        help="单次大数计算的截止时间，秒 (默认: 10)")
+    parser.add_argument("--compute-threads", type=int, default=4,
+                        help="线性代数、批量、扫描和统计计算的线程数 (默认: 4)")
+    parser.add_argument("--session-shards", type=int, default=16,
+                        help="会话表分片数 (默认: 16)")
+    parser.add_argument("--session-idle-timeout", type=float, default=1800.0,
+                        help="会话空闲多少秒后被回收 (默认: 1800)")
+    parser.add_argument("--max-sessions", type=int, default=1024,
+                        help="同时保留的最大会话数 (默认: 1024)")
+    parser.add_argument("--session-memory-mb", type=int, default=256,
+                        help="所有会话状态的估算内存上限，MB (默认: 256)")
     args = parser.parse_args()
 
+    global sessions, compute_executor
+    compute_executor.shutdown(wait=False)
+    compute_executor = ThreadPoolExecutor(max_workers=args.compute_threads,
+                                          thread_name_prefix="calculator-compute")
+    big_numbers.workers = args.bignum_workers
+    big_numbers.timeout = args.bignum_timeout
+    expression_cache.capacity = args.cache_size
+    session_options["history_size"] = args.history_size
+    if args.history_spill:
+        os.makedirs(args.history_spill, exist_ok=True)
+        session_options["history_spill_dir"] = args.history_spill
+    sessions = CalculatorSessions(
+        _create_calculator,
+        shards=args.session_shards,
+        idle_timeout=args.session_idle_timeout,
+        max_sessions=args.max_sessions,
+        max_memory=args.session_memory_mb * 1024 * 1024
+    )
+
     logger.info(f"启动计算器 MCP 服务器 on {args.host}:{args.port}")
 
     config = uvicorn.Config(
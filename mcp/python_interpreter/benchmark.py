@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+解释器代码准备阶段性能基准测试
+对比旧流程（解析 + 列表式安全检查 + exec 源码时再次解析编译）与新流程
+（单次解析 + 集合式检查 + 编译检查后的 AST + 编译缓存）处理典型代码片段的耗时
+"""
+
+import argparse
+import ast
+import contextlib
+import io
+import marshal
+import time
+
+from server import PythonInterpreter, _build_safe_globals
+
+SNIPPETS = [
+    # 简单计算
+    "x = 2 ** 10\nprint(x)",
+    # 数据处理
+    """data = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5]
+counts = collections.Counter(data)
+total = 0
+for v in data:
+    total += v
+mean = total / len(data)
+variance = 0.0
+for v in data:
+    variance += (v - mean) ** 2
+variance /= len(data)
+print(f"mean={mean:.3f} var={variance:.3f}")
+print(counts.most_common(3))""",
+    # 函数与循环
+    """def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+def is_prime(n):
+    if n < 2:
+        return False
+    for d in range(2, int(math.sqrt(n)) + 1):
+        if n % d == 0:
+            return False
+    return True
+
+primes = []
+for i in range(30):
+    value = fib(i)
+    if is_prime(value):
+        primes.append(value)
+print(primes)""",
+    # 字符串与 JSON 处理
+    """rows = [[1, 2], [3, 4]]
+product = [[0, 0], [0, 0]]
+for i in range(2):
+    for j in range(2):
+        for k in range(2):
+            product[i][j] += rows[i][k] * rows[k][j]
+text = json.dumps({"result": product})
+words = re.findall(r"\\d+", text)
+summary = functools.reduce(lambda a, b: a + int(b), words, 0)
+print(text, len(words), summary)""",
+]
+
+
+def legacy_check(code: str) -> bool:
+    """旧流程的安全检查：ast.walk 遍历，每个节点线性扫描列表"""
+    tree = ast.parse(code)
+    dangerous_nodes = [ast.Import, ast.ImportFrom]
+    dangerous_calls = [
+        'exec', 'eval', 'compile', '__import__', 'open', 'file',
+        'input', 'raw_input', 'reload', 'vars', 'locals', 'globals',
+        'getattr', 'setattr', 'delattr', 'hasattr'
+    ]
+    for node in ast.walk(tree):
+        if any(isinstance(node, dangerous_type) for dangerous_type in dangerous_nodes):
+            return False
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name):
+                if node.func.id in dangerous_calls:
+                    return False
+            elif isinstance(node.func, ast.Attribute):
+                if node.func.attr in ['system', 'popen', 'spawn', 'fork']:
+                    return False
+        if isinstance(node, ast.Attribute):
+            if node.attr in ['__class__', '__bases__', '__subclasses__', '__globals__']:
+                return False
+    return True
+
+
+def run_legacy(workload: list) -> float:
+    """旧流程：检查时解析一次，exec 源码时再解析编译一次；返回平均耗时（微秒）"""
+    start = time.perf_counter()
+    for code in workload:
+        legacy_check(code)
+        compile(code, "<string>", "exec")
+    return (time.perf_counter() - start) / len(workload) * 1e6
+
+
+def run_compiled(interpreter: PythonInterpreter, workload: list) -> float:
+    """新流程：compile_code 得到字节码，沙箱进程中 marshal.loads；返回平均耗时（微秒）"""
+    start = time.perf_counter()
+    for code in workload:
+        bytecode, _, _ = interpreter.compile_code(code)
+        marshal.loads(bytecode)
+    return (time.perf_counter() - start) / len(workload) * 1e6
+
+
+def run_end_to_end(interpreter: PythonInterpreter, workload: list, safe_globals: dict) -> float:
+    """新流程加上实际执行（与沙箱进程内的执行方式相同）；返回平均耗时（微秒）"""
+    start = time.perf_counter()
+    for code in workload:
+        bytecode, _, _ = interpreter.compile_code(code)
+        exec(marshal.loads(bytecode), safe_globals.copy(), {})
+    return (time.perf_counter() - start) / len(workload) * 1e6
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="解释器代码准备阶段性能基准测试")
+    parser.add_argument("--repeat", type=int, default=2000,
+                        help="每个片段重复次数 (默认: 2000)")
+    args = parser.parse_args()
+
+    safe_globals = _build_safe_globals()
+    workload = SNIPPETS * args.repeat
+
+    legacy_us = run_legacy(workload)
+    cold = PythonInterpreter()
+    cold.code_cache.capacity = 0
+    cold_us = run_compiled(cold, workload)
+    warm = PythonInterpreter()
+    warm_us = run_compiled(warm, workload)
+    # 片段的 print 输出写入内存，不计入终端输出开销
+    with contextlib.redirect_stdout(io.StringIO()):
+        total_us = run_end_to_end(warm, workload, safe_globals)
+
+    print(f"片段数: {len(SNIPPETS)}, 执行次数: {len(workload)}")
+    print("代码准备（解析、安全检查、编译）:")
+    print(f"  旧流程:           {legacy_us:8.1f} 微秒/次")
+    print(f"  单次解析(无缓存): {cold_us:8.1f} 微秒/次 ({legacy_us / cold_us:.1f}x)")
+    print(f"  单次解析(有缓存): {warm_us:8.1f} 微秒/次 ({legacy_us / warm_us:.1f}x)")
+    print(f"缓存命中时含执行的总耗时: {total_us:8.1f} 微秒/次")
+    print(f"缓存统计: {warm.code_cache.stats()}")
+
+if __name__ == "__main__":
+    main()
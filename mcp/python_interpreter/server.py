@@ -4,21 +4,46 @@ Python 代码解释器 MCP 服务器
 提供安全的Python代码执行功能的 MCP 工具
 """
 
+import array
 import asyncio
+import collections
+import cProfile
+import hashlib
 import json
 import logging
+import marshal
+import math
+import mimetypes
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import resource
+import secrets
+import shutil
+import signal
+import sqlite3
+import threading
 import sys
+import tempfile
 import io
 import ast
+import itertools
+import reprlib
 import time
+import tracemalloc
 import argparse
+import re
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from multiprocessing import reduction
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import traceback
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 from mcp.server import Server
 from mcp.types import (
@@ -32,265 +57,2745 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("python-interpreter-mcp-server")
 
 
-class PythonInterpreter:
-    """Python解释器核心类"""
-
-    def __init__(self):
-        """初始化Python解释器"""
-        self.execution_history = []
-        self.global_vars = {}
-
-        # 创建受限的执行环境
-        self.safe_globals = {
-            '__builtins__': {
-                # 基本函数
-                'abs': abs, 'all': all, 'any': any, 'bin': bin, 'bool': bool,
-                'chr': chr, 'dict': dict, 'dir': dir, 'divmod': divmod,
-                'enumerate': enumerate, 'filter': filter, 'float': float,
-                'format': format, 'frozenset': frozenset, 'hex': hex,
-                'int': int, 'isinstance': isinstance, 'issubclass': issubclass,
-                'iter': iter, 'len': len, 'list': list, 'map': map,
-                'max': max, 'min': min, 'next': next, 'oct': oct,
-                'ord': ord, 'pow': pow, 'print': print, 'range': range,
-                'reversed': reversed, 'round': round, 'set': set,
-                'slice': slice, 'sorted': sorted, 'str': str, 'sum': sum,
-                'tuple': tuple, 'type': type, 'zip': zip,
-
-                # 异常
-                'Exception': Exception, 'ValueError': ValueError,
-                'TypeError': TypeError, 'IndexError': IndexError,
-                'KeyError': KeyError, 'AttributeError': AttributeError,
-                'ZeroDivisionError': ZeroDivisionError, 'ImportError': ImportError,
-            },
+# fork server 模板进程预先导入的模块：本模块（含沙箱主循环）以及沙箱中可用的模块。
+# 作为脚本运行时按文件名导入本模块：fork server 会忽略 "__main__" 预加载项，
+# 否则每个沙箱进程都要重新导入 fastapi 等依赖
+_PRELOAD_MODULES = [
+    os.path.splitext(os.path.basename(__file__))[0] if __name__ == "__main__" else __name__,
+    "math", "random", "datetime", "json", "re",
+    "collections", "itertools", "functools",
+]
+_DEFAULT_START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# 沙箱进程导出二进制结果的目录：优先使用内存文件系统 /dev/shm
+_BUFFER_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# 制品的默认目录：文件名为内容的 SHA-256，目录名包含主进程 PID，多个服务器实例互不影响
+_DEFAULT_ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), f"mcp-artifacts-{os.getpid()}")
+
+# execute_python_batch 一次最多执行的代码段数
+_MAX_BATCH_SNIPPETS = 100
+
+# 执行历史等持久化数据的默认目录
+_DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def _build_safe_globals() -> Dict[str, Any]:
+    """创建受限的执行环境（在沙箱进程内调用）"""
+    return {
+        '__builtins__': {
+            # 基本函数
+            'abs': abs, 'all': all, 'any': any, 'bin': bin, 'bool': bool,
+            # 构造 save_artifact 的二进制数据；只是字节容器，不提供文件或系统访问
+            'bytes': bytes, 'bytearray': bytearray,
+            'chr': chr, 'dict': dict, 'dir': dir, 'divmod': divmod,
+            'enumerate': enumerate, 'filter': filter, 'float': float,
+            'format': format, 'frozenset': frozenset, 'hex': hex,
+            'int': int, 'isinstance': isinstance, 'issubclass': issubclass,
+            'iter': iter, 'len': len, 'list': list, 'map': map,
+            'max': max, 'min': min, 'next': next, 'oct': oct,
+            'ord': ord, 'pow': pow, 'print': print, 'range': range,
+            'reversed': reversed, 'round': round, 'set': set,
+            'slice': slice, 'sorted': sorted, 'str': str, 'sum': sum,
+            'tuple': tuple, 'type': type, 'zip': zip,
+
+            # 异常
+            'Exception': Exception, 'ValueError': ValueError,
+            'TypeError': TypeError, 'IndexError': IndexError,
+            'KeyError': KeyError, 'AttributeError': AttributeError,
+            'ZeroDivisionError': ZeroDivisionError, 'ImportError': ImportError,
+        },
+
+        # 安全的模块
+        'math': __import__('math'),
+        'random': __import__('random'),
+        'datetime': __import__('datetime'),
+        'json': __import__('json'),
+        're': __import__('re'),
+        'collections': __import__('collections'),
+        'itertools': __import__('itertools'),
+        'functools': __import__('functools'),
+
+        # 保存制品（见 _save_artifact）
+        'save_artifact': _ArtifactSaver(),
+    }
+
+
+class _OutputCapture:
+    """一次执行的输出通道（在沙箱进程内使用）
+
+    stdout 和 stderr 共享 max_bytes 字节的上限，超出部分丢弃并追加一次截断标记，
+    内存占用与代码打印的数据量无关。给定 conn 时，输出按行攒批（至少间隔 flush_interval 秒
+    或攒满 flush_bytes）推送给主进程，长时间运行的代码也能实时看到进度。
+    """
+
+    def __init__(self, max_bytes: int, conn: Any = None,
+                 flush_interval: float = 0.05, flush_bytes: int = 8192):
+        self.max_bytes = max_bytes
+        self.conn = conn
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.kept = {"stdout": [], "stderr": []}
+        self.pending: List[Tuple[str, str]] = []
+        self.pending_size = 0
+        self.last_flush = 0.0
+        self.total_bytes = 0
+        self.kept_bytes = 0
+        self.truncated = False
+
+    def write(self, stream: str, text: str) -> None:
+        """写入一段输出，超出上限的部分被截断"""
+        size = len(text) if text.isascii() else len(text.encode("utf-8", "surrogatepass"))
+        self.total_bytes += size
+        if self.truncated:
+            return
+        room = self.max_bytes - self.kept_bytes
+        if size > room:
+            if text.isascii():
+                text = text[:room]
+            else:
+                text = text.encode("utf-8", "surrogatepass")[:room].decode("utf-8", "ignore")
+            text += f"\n[输出超过 {self.max_bytes} 字节，其余部分已截断]\n"
+            self.truncated = True
+            size = room
+        self.kept_bytes += size
+        self.kept[stream].append(text)
+        if self.conn is not None:
+            self.pending.append((stream, text))
+            self.pending_size += size
+            now = time.monotonic()
+            if (self.pending_size >= self.flush_bytes or self.truncated
+                    or ("\n" in text and now - self.last_flush >= self.flush_interval)):
+                self.flush(now)
+
+    def flush(self, now: Optional[float] = None) -> None:
+        """把攒下的输出推送给主进程，相邻的同一通道输出合并为一条消息"""
+        if not self.pending:
+            return
+        merged: List[Tuple[str, List[str]]] = []
+        for stream, text in self.pending:
+            if merged and merged[-1][0] == stream:
+                merged[-1][1].append(text)
+            else:
+                merged.append((stream, [text]))
+        for stream, parts in merged:
+            self.conn.send({"stream": stream, "data": "".join(parts)})
+        self.pending = []
+        self.pending_size = 0
+        self.last_flush = now if now is not None else time.monotonic()
+
+    def getvalue(self, stream: str) -> str:
+        return "".join(self.kept[stream])
+
 
-            # 安全的模块
-            'math': __import__('math'),
-            'random': __import__('random'),
-            'datetime': __import__('datetime'),
-            'json': __import__('json'),
-            're': __import__('re'),
-            'collections': __import__('collections'),
-            'itertools': __import__('itertools'),
-            'functools': __import__('functools'),
+class _OutputChannel(io.TextIOBase):
+    """替换 sys.stdout / sys.stderr 的文件对象，写入委托给 _OutputCapture"""
+
+    def __init__(self, capture: _OutputCapture, stream: str):
+        self.capture = capture
+        self.stream = stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        self.capture.write(self.stream, text)
+        return len(text)
+
+
+def _run_code(code: Any, safe_globals: Dict[str, Any], local_vars: Dict[str, Any],
+              capture: _OutputCapture) -> Dict[str, Any]:
+    """执行代码并捕获输出（在沙箱进程内调用，同一进程同一时刻只执行一段代码）"""
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+
+    start_time = time.time()
+    sys.stdout = _OutputChannel(capture, "stdout")
+    sys.stderr = _OutputChannel(capture, "stderr")
+    try:
+        exec(code, safe_globals.copy(), local_vars)
+    except Exception as e:
+        execution_time = time.time() - start_time
+        error_msg = f"{type(e).__name__}: {str(e)}"
+
+        # 获取详细错误信息
+        stderr_output = capture.getvalue("stderr")
+        if stderr_output:
+            error_msg += f"\n{stderr_output}"
+
+        return {
+            "success": False,
+            "error": error_msg,
+            "output": capture.getvalue("stdout"),
+            "variables": "",
+            "execution_time": execution_time,
+            "type": "error"
         }
+    finally:
+        # 恢复输出
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+        if capture.conn is not None:
+            capture.flush()
+
+    execution_time = time.time() - start_time
+
+    # 获取输出
+    stdout_output = capture.getvalue("stdout")
+    stderr_output = capture.getvalue("stderr")
+
+    output = ""
+    if stdout_output:
+        output += stdout_output
+    if stderr_output:
+        output += f"\n[错误输出]\n{stderr_output}"
+
+    # 显示变量（仅显示用户定义的变量，每个变量只给出长度有界的预览）
+    variables_info = ""
+    names = _user_variables(local_vars, safe_globals)
+    if names:
+        variables_info = "\n[变量]\n"
+        for key in names[:_MAX_LISTED_VARIABLES]:
+            variables_info += f"{key} = {_preview(local_vars[key])}\n"
+        if len(names) > _MAX_LISTED_VARIABLES:
+            variables_info += f"... 另有 {len(names) - _MAX_LISTED_VARIABLES} 个变量，可通过 get_variables 分页查看\n"
 
-    def is_safe_code(self, code: str) -> tuple[bool, str]:
-        """检查代码是否安全"""
-        try:
-            tree = ast.parse(code)
-        except SyntaxError as e:
-            return False, f"语法错误: {e}"
+    return {
+        "success": True,
+        "error": None,
+        "output": output.strip(),
+        "variables": variables_info.strip(),
+        "execution_time": execution_time,
+        "type": "execution"
+    }
 
-        # 危险的AST节点类型
-        dangerous_nodes = [
-            ast.Import,  # import语句
-            ast.ImportFrom,  # from ... import语句
-        ]
 
-        # 危险的函数调用
-        dangerous_calls = [
-            'exec', 'eval', 'compile', '__import__', 'open', 'file',
-            'input', 'raw_input', 'reload', 'vars', 'locals', 'globals',
-            'getattr', 'setattr', 'delattr', 'hasattr'
-        ]
+# 变量预览：容器最多展示前若干项，字符串和其他对象的 repr 截断到固定长度
+_PREVIEW = reprlib.Repr()
+_PREVIEW.maxlevel = 3
+_PREVIEW.maxlist = _PREVIEW.maxtuple = _PREVIEW.maxset = _PREVIEW.maxfrozenset = 10
+_PREVIEW.maxdeque = _PREVIEW.maxarray = _PREVIEW.maxdict = 10
+_PREVIEW.maxstring = _PREVIEW.maxother = 120
+_PREVIEW.maxlong = 60
+# 执行结果中最多列出的变量数
+_MAX_LISTED_VARIABLES = 50
 
-        for node in ast.walk(tree):
-            # 检查危险节点
-            if any(isinstance(node, dangerous_type) for dangerous_type in dangerous_nodes):
-                return False, f"不允许的操作: {type(node).__name__}"
-
-            # 检查函数调用
-            if isinstance(node, ast.Call):
-                if isinstance(node.func, ast.Name):
-                    if node.func.id in dangerous_calls:
-                        return False, f"不允许的函数调用: {node.func.id}"
-                elif isinstance(node.func, ast.Attribute):
-                    # 检查属性访问，如 os.system
-                    if hasattr(node.func, 'attr'):
-                        if node.func.attr in ['system', 'popen', 'spawn', 'fork']:
-                            return False, f"不允许的方法调用: {node.func.attr}"
-
-            # 检查属性访问
-            if isinstance(node, ast.Attribute):
-                dangerous_attrs = ['__class__', '__bases__',
-                                   '__subclasses__', '__globals__']
-                if node.attr in dangerous_attrs:
-                    return False, f"不允许访问属性: {node.attr}"
-
-        return True, ""
-
-    def execute_code(self, code: str, timeout: float = 10, persistent: bool = False) -> Dict[str, Any]:
-        """安全执行Python代码"""
-        try:
-            # 检查代码安全性
-            is_safe, error_msg = self.is_safe_code(code)
-            if not is_safe:
-                return {
-                    "success": False,
-                    "error": f"代码安全检查失败: {error_msg}",
-                    "output": "",
-                    "execution_time": 0,
-                    "type": "security_error"
-                }
 
-            # 捕获输出
-            old_stdout = sys.stdout
-            old_stderr = sys.stderr
-            stdout_capture = io.StringIO()
-            stderr_capture = io.StringIO()
+def _user_variables(namespace: Dict[str, Any], safe_globals: Dict[str, Any]) -> List[str]:
+    """命名空间中的用户变量名（按定义顺序）"""
+    return [k for k in namespace if not k.startswith('_') and k not in safe_globals]
 
-            start_time = time.time()
 
-            # 重定向输出
-            sys.stdout = stdout_capture
-            sys.stderr = stderr_capture
+def _preview(value: Any) -> str:
+    """长度有界的 repr 预览"""
+    try:
+        return _PREVIEW.repr(value)
+    except Exception:
+        return "<无法显示>"
 
-            # 选择变量作用域
-            if persistent:
-                # 持久化模式：使用全局变量
-                local_vars = self.global_vars
+
+def _approx_size(value: Any) -> int:
+    """粗略估算对象占用的内存（字节）：缓冲区对象取 nbytes，容器按抽样元素的平均大小外推"""
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    try:
+        size = sys.getsizeof(value)
+        if isinstance(value, (list, tuple, set, frozenset, dict, collections.deque)) and value:
+            items = value.items() if isinstance(value, dict) else value
+            sample = list(itertools.islice(items, 100))
+            if isinstance(value, dict):
+                per_item = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in sample) / len(sample)
             else:
-                # 临时模式：使用新的局部变量
-                local_vars = {}
+                per_item = sum(sys.getsizeof(item) for item in sample) / len(sample)
+            size += int(per_item * len(value))
+        return size
+    except Exception:
+        return 0
+
+
+def _summarize_variable(name: str, value: Any) -> Dict[str, Any]:
+    """变量摘要：类型、长度或形状、截断预览和估算内存，代价与变量大小无关"""
+    summary: Dict[str, Any] = {"name": name, "type": type(value).__name__}
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple):
+        summary["shape"] = list(shape)
+        dtype = getattr(value, "dtype", None)
+        if dtype is not None:
+            summary["dtype"] = str(dtype)
+    elif isinstance(value, (str, bytes, bytearray, list, tuple, set, frozenset, dict,
+                            collections.deque, range)):
+        summary["length"] = len(value)
+    summary["preview"] = _preview(value)
+    summary["approx_bytes"] = _approx_size(value)
+    return summary
+
+
+def _list_variables(namespace: Dict[str, Any], safe_globals: Dict[str, Any],
+                    offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+    """分页列出命名空间中用户变量的摘要（在沙箱进程内调用）"""
+    names = _user_variables(namespace, safe_globals)
+    page = names[offset:offset + limit]
+    return {
+        "variables": [_summarize_variable(name, namespace[name]) for name in page],
+        "total": len(names)
+    }
 
-            # 执行代码
-            exec(code, self.safe_globals.copy(), local_vars)
 
-            execution_time = time.time() - start_time
+def _variable_value(namespace: Dict[str, Any], name: str, offset: int, length: int,
+                    cache: Dict[str, Any]) -> Dict[str, Any]:
+    """分块返回变量完整 repr 的一段（在沙箱进程内调用）
 
-            # 获取输出
-            stdout_output = stdout_capture.getvalue()
-            stderr_output = stderr_capture.getvalue()
+    完整 repr 只计算一次并缓存，直到下一次执行代码，逐块读取大变量时不会重复计算。
+    """
+    if name not in namespace or name.startswith('_'):
+        return {"error": f"变量不存在: {name}"}
+    value = namespace[name]
+    if cache.get("name") != name or cache.get("id") != id(value):
+        try:
+            text = repr(value)
+        except Exception as e:
+            return {"error": f"无法显示变量 {name}: {type(e).__name__}: {e}"}
+        cache.clear()
+        cache.update(name=name, id=id(value), text=text)
+    text = cache["text"]
+    chunk = text[offset:offset + length]
+    next_offset = offset + len(chunk)
+    return {
+        "name": name,
+        "type": type(value).__name__,
+        "offset": offset,
+        "data": chunk,
+        "total_length": len(text),
+        "next_offset": next_offset if next_offset < len(text) else None
+    }
 
-            output = ""
-            if stdout_output:
-                output += stdout_output
-            if stderr_output:
-                output += f"\n[错误输出]\n{stderr_output}"
 
-            # 如果是持久化模式，更新全局变量
-            if persistent:
-                self.global_vars = local_vars
-
-            # 记录执行历史
-            execution_record = {
-                "code": code,
-                "success": True,
-                "output": output.strip(),
-                "execution_time": execution_time,
-                "persistent": persistent,
-                "timestamp": datetime.now().isoformat()
-            }
-            self.execution_history.append(execution_record)
-
-            # 显示变量（仅显示用户定义的变量）
-            variables_info = ""
-            user_vars = {k: v for k, v in local_vars.items()
-                         if not k.startswith('_') and k not in self.safe_globals}
-            if user_vars:
-                variables_info = "\n[变量]\n"
-                for key, value in user_vars.items():
-                    try:
-                        variables_info += f"{key} = {repr(value)}\n"
-                    except:
-                        variables_info += f"{key} = <无法显示>\n"
+# 快照恢复时允许构造的类型，其余全局对象一律拒绝，防止快照文件被篡改后在沙箱进程中执行任意代码
+_SNAPSHOT_ALLOWED_GLOBALS = frozenset(
+    [("builtins", name) for name in ("set", "frozenset", "complex", "bytearray", "range", "slice",
+                                      "list", "dict", "tuple", "str", "bytes", "int", "float", "bool")]
+    + [("collections", name) for name in ("OrderedDict", "defaultdict", "deque", "Counter")]
+    + [("datetime", name) for name in ("datetime", "date", "time", "timedelta", "timezone")]
+    + [("decimal", "Decimal"), ("fractions", "Fraction"), ("numpy", "ndarray"), ("numpy", "dtype"),
+       ("numpy.core.multiarray", "_reconstruct"), ("numpy.core.multiarray", "scalar"),
+       ("numpy._core.multiarray", "_reconstruct"), ("numpy._core.multiarray", "scalar")]
+)
 
-            return {
-                "success": True,
-                "error": None,
-                "output": output.strip(),
-                "variables": variables_info.strip(),
-                "execution_time": execution_time,
-                "persistent": persistent,
-                "type": "execution"
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """只允许构造白名单中类型的 Unpickler"""
+
+    def find_class(self, module: str, name: str) -> Any:
+        if (module, name) not in _SNAPSHOT_ALLOWED_GLOBALS:
+            raise pickle.UnpicklingError(f"快照中包含不允许的类型: {module}.{name}")
+        return super().find_class(module, name)
+
+
+def _snapshot_namespace(namespace: Dict[str, Any], safe_globals: Dict[str, Any],
+                        max_bytes: int) -> Dict[str, Any]:
+    """逐个序列化用户变量（在沙箱进程内调用），无法序列化或超出大小上限的变量记入 skipped
+
+    每个变量单独序列化，一个变量失败不影响其他变量；变量之间的共享引用在恢复后不再共享。
+    """
+    variables: Dict[str, bytes] = {}
+    skipped = []
+    total = 0
+    for name in _user_variables(namespace, safe_globals):
+        value = namespace[name]
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            skipped.append({"name": name, "type": type(value).__name__,
+                            "reason": f"{type(e).__name__}: {e}"})
+            continue
+        if total + len(data) > max_bytes:
+            skipped.append({"name": name, "type": type(value).__name__,
+                            "reason": f"快照大小超过上限（{max_bytes} 字节）"})
+            continue
+        variables[name] = data
+        total += len(data)
+    return {
+        "data": pickle.dumps({"variables": variables, "skipped": skipped},
+                             protocol=pickle.HIGHEST_PROTOCOL),
+        "saved": list(variables),
+        "skipped": skipped,
+        "bytes": total
+    }
+
+
+def _restore_namespace(namespace: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+    """从快照恢复变量（在沙箱进程内调用），只允许白名单中的类型
+
+    返回恢复成功的变量、恢复失败的变量，以及保存快照时就无法序列化的变量（not_saved）。
+    """
+    restored, failed = [], []
+    try:
+        snapshot = _SnapshotUnpickler(io.BytesIO(data)).load()
+        variables, not_saved = dict(snapshot["variables"]), list(snapshot["skipped"])
+    except Exception as e:
+        return {"variables": [], "failed": [{"name": "*", "reason": f"{type(e).__name__}: {e}"}],
+                "not_saved": []}
+    for name, blob in variables.items():
+        try:
+            namespace[name] = _SnapshotUnpickler(io.BytesIO(blob)).load()
+            restored.append(name)
+        except Exception as e:
+            failed.append({"name": name, "reason": f"{type(e).__name__}: {e}"})
+    return {"variables": restored, "failed": failed, "not_saved": not_saved}
+
+
+def _pack_numbers(values: Any) -> Optional[array.array]:
+    """把纯数值列表打包为 array.array（全为整数时为 int64，否则为 float64），无法打包时返回 None"""
+    if all(type(v) is int for v in values):
+        try:
+            return array.array('q', values)
+        except OverflowError:
+            return None
+    if all(type(v) is int or type(v) is float for v in values):
+        return array.array('d', values)
+    return None
+
+
+def _export_buffers(namespace: Dict[str, Any], names: List[str], directory: str, prefix: str,
+                    max_bytes: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """把支持缓冲区协议的变量原样写入内存文件系统中的文件（在沙箱进程内调用）
+
+    数据直接从对象的缓冲区写入文件，不经过 pickle 和 repr；主进程用 sendfile 把文件发给客户端。
+    纯数值的列表和元组先打包为 int64 / float64 数组。返回 (导出结果, 错误列表)。
+    """
+    buffers, errors = [], []
+    for name in names:
+        if not isinstance(name, str) or name.startswith('_') or name not in namespace:
+            errors.append({"name": str(name), "error": "变量不存在"})
+            continue
+        value = namespace[name]
+        source_type = type(value).__name__
+        if isinstance(value, (list, tuple)):
+            value = _pack_numbers(value)
+        try:
+            view = memoryview(value)
+        except (TypeError, ValueError):
+            errors.append({"name": name, "error": f"{source_type} 不支持缓冲区协议"
+                                                  "（支持 bytes、array.array、NumPy 数组和纯数值列表等）"})
+            continue
+        with view:
+            if view.nbytes > max_bytes:
+                errors.append({"name": name, "error": f"大小 {view.nbytes} 字节超过上限 {max_bytes} 字节"})
+                continue
+            path = os.path.join(directory, prefix + secrets.token_hex(16))
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(view if view.contiguous else view.tobytes())
+            meta = {"name": name, "path": path, "nbytes": view.nbytes, "format": view.format,
+                    "itemsize": view.itemsize, "shape": list(view.shape), "type": source_type}
+        dtype = getattr(value, "dtype", None)
+        if dtype is not None and hasattr(dtype, "str"):
+            meta["dtype"] = dtype.str
+        buffers.append(meta)
+    return buffers, errors
+
+
+# 常见二进制格式的文件头，用于在未给出 MIME 类型时识别制品类型
+_ARTIFACT_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+)
+_MIME_TYPE_PATTERN = re.compile(r"^[\w.+-]+/[\w.+-]+(;\s*[\w.+-]+=[\w.+-]+)*$")
+_MAX_ARTIFACTS_PER_EXECUTION = 64
+
+# 本次执行中 save_artifact 的写入位置、总大小上限、已写入字节数和已保存的制品（沙箱进程内使用）
+_artifact_state: Dict[str, Any] = {"directory": None, "max_bytes": 0, "total_bytes": 0, "saved": {}}
+
+
+def _save_artifact(data: Any, name: Optional[str] = None, mime_type: Optional[str] = None) -> str:
+    """把 bytes 或 str 保存为制品，返回制品 ID（内容的 SHA-256）
+
+    沙箱代码通过它输出大块数据（CSV、图片等），数据以原始字节写入磁盘，执行结果的 artifacts
+    中只给出引用，客户端经 GET /artifacts/{id} 下载。相同内容只保存一份。
+    文件先写入本次执行专用的暂存目录，由主进程在执行结束后登记；一次执行写入的总字节数不超过 max_bytes。
+    """
+    directory = _artifact_state["directory"]
+    if directory is None:
+        raise RuntimeError("当前执行不支持保存制品")
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+        default_type = "text/plain; charset=utf-8"
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        default_type = None
+    else:
+        raise TypeError(f"制品数据必须是 bytes 或 str，而不是 {type(data).__name__}")
+    if name is not None:
+        if not isinstance(name, str) or not name.isprintable():
+            raise ValueError("制品名称必须是不含控制字符的字符串")
+        name = name.replace("/", "_").replace("\\", "_")[:255]
+    if mime_type is not None and (not isinstance(mime_type, str) or len(mime_type) > 255
+                                  or not _MIME_TYPE_PATTERN.match(mime_type)):
+        raise ValueError(f"无效的 MIME 类型: {mime_type!r}")
+    saved = _artifact_state["saved"]
+    with memoryview(data) as view:
+        size = view.nbytes
+        if _artifact_state["total_bytes"] + size > _artifact_state["max_bytes"]:
+            raise ValueError(f"本次执行保存的制品总大小超过上限 {_artifact_state['max_bytes']} 字节")
+        artifact_id = hashlib.sha256(view).hexdigest()
+        if artifact_id in saved:
+            return artifact_id
+        if len(saved) >= _MAX_ARTIFACTS_PER_EXECUTION:
+            raise ValueError(f"一次执行最多保存 {_MAX_ARTIFACTS_PER_EXECUTION} 个制品")
+        if mime_type is None and name is not None:
+            mime_type = mimetypes.guess_type(name)[0]
+        if mime_type is None:
+            head = bytes(view[:8])
+            mime_type = next((kind for magic, kind in _ARTIFACT_SIGNATURES if head.startswith(magic)),
+                             default_type or "application/octet-stream")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, artifact_id)
+        _artifact_state["total_bytes"] += size
+        with open(path, "wb") as f:
+            f.write(view if view.contiguous else view.tobytes())
+    saved[artifact_id] = {"id": artifact_id, "path": path, "size": size,
+                          "mime_type": mime_type, "name": name}
+    return artifact_id
+
+
+class _ArtifactSaver:
+    """沙箱中的 save_artifact：没有 __globals__、__builtins__ 等函数属性的可调用对象
+
+    直接暴露 _save_artifact 时，沙箱代码可以经 save_artifact.__builtins__ 拿到主模块的完整内置函数。
+    """
+
+    __slots__ = ()
+
+    def __call__(self, data: Any, name: Optional[str] = None, mime_type: Optional[str] = None) -> str:
+        return _save_artifact(data, name, mime_type)
+
+    def __repr__(self) -> str:
+        return "<built-in function save_artifact>"
+
+
+def _set_cpu_limit(seconds: float) -> None:
+    """把 CPU 时间软限制设为“已用 CPU 时间 + seconds”，超出后内核以 SIGXCPU 结束本进程"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(math.ceil(usage.ru_utime + usage.ru_stime + seconds))
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _address_space() -> int:
+    """当前进程已占用的虚拟地址空间（字节），无法读取时返回 0"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _set_memory_limit(baseline: int, limit: Optional[int]) -> None:
+    """把地址空间软限制设为“进程启动时的占用 + limit”字节，超出时分配内存会抛出 MemoryError"""
+    soft = resource.RLIM_INFINITY if limit is None else baseline + limit
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY and soft != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def _reset_peak_rss() -> None:
+    """把本进程的峰值 RSS 重置为当前 RSS（Linux 的 /proc/self/clear_refs），不支持时忽略"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    """本进程的峰值 RSS（字节）：优先读取 /proc/self/status 的 VmHWM，否则取 ru_maxrss"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _ResourceMeter:
+    """测量一次执行的资源用量：CPU 用户态/内核态时间、墙钟时间、峰值 RSS 和 Python 对象分配量"""
+
+    def __init__(self, trace_allocations: bool):
+        self.trace_allocations = trace_allocations
+
+    def __enter__(self) -> "_ResourceMeter":
+        _reset_peak_rss()
+        if self.trace_allocations:
+            tracemalloc.start()
+        self.usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.wall = time.perf_counter() - self.wall
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.result = {
+            "cpu_user_seconds": round(usage.ru_utime - self.usage.ru_utime, 6),
+            "cpu_system_seconds": round(usage.ru_stime - self.usage.ru_stime, 6),
+            "wall_seconds": round(self.wall, 6),
+            "peak_rss_bytes": _peak_rss(),
+            "allocated_bytes": None,
+            "peak_allocated_bytes": None
+        }
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.result["allocated_bytes"] = current
+            self.result["peak_allocated_bytes"] = peak
+
+
+_MAX_PROFILE_TOP = 100
+_MAX_COLLAPSED_STACKS = 200
+_PROFILE_SAMPLE_INTERVAL = 0.005
+
+
+class _Profiler:
+    """在沙箱进程内对一次执行做性能分析
+
+    cProfile 给出每个函数的调用次数、自身时间和累计时间；同时用 ITIMER_PROF 定时器按 CPU 时间采样调用栈，
+    汇总为折叠栈（每行 "外层;…;内层 采样数"，可直接交给 flamegraph.pl 等工具）。
+    """
+
+    def __init__(self, top: int):
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.stacks: Dict[Tuple[Any, ...], int] = {}
+
+    def _sample(self, signum: int, frame: Any) -> None:
+        # 只记录代码对象，格式化留到 result()，尽量不在被分析的执行中调用 Python 函数
+        codes = []
+        while frame is not None and frame.f_code.co_filename != __file__:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        if codes:
+            stack = tuple(codes)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def __enter__(self) -> "_Profiler":
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, _PROFILE_SAMPLE_INTERVAL, _PROFILE_SAMPLE_INTERVAL)
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.profile.disable()
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def result(self) -> Dict[str, Any]:
+        """按累计时间和自身时间排序的前 top 个函数，以及折叠栈摘要"""
+        self.profile.create_stats()
+        functions = []
+        total_calls = 0
+        primitive_calls = 0
+        for (filename, line, name), (cc, nc, tt, ct, callers) in self.profile.stats.items():
+            # 本模块的函数（执行入口、采样处理函数）及只被它们调用的函数不计入结果
+            if filename == __file__ or (callers and all(caller[0] == __file__ for caller in callers)):
+                continue
+            total_calls += nc
+            primitive_calls += cc
+            functions.append({
+                "function": name,
+                "file": os.path.basename(filename) if filename != "~" else None,
+                "line": line or None,
+                "calls": nc,
+                "primitive_calls": cc,
+                "self_seconds": round(tt, 6),
+                "cumulative_seconds": round(ct, 6)
+            })
+        stacks = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        collapsed = []
+        for codes, count in stacks[:_MAX_COLLAPSED_STACKS]:
+            frames = (f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                      for code in reversed(codes))
+            collapsed.append(f"{';'.join(frames)} {count}")
+        return {
+            "total_calls": total_calls,
+            "primitive_calls": primitive_calls,
+            "top_cumulative": sorted(functions, key=lambda f: f["cumulative_seconds"],
+                                     reverse=True)[:self.top],
+            "top_self": sorted(functions, key=lambda f: f["self_seconds"], reverse=True)[:self.top],
+            "samples": sum(self.stacks.values()),
+            "sample_interval_seconds": _PROFILE_SAMPLE_INTERVAL,
+            "collapsed_stacks": "\n".join(collapsed),
+            "collapsed_stacks_truncated": len(stacks) > _MAX_COLLAPSED_STACKS
+        }
+
+
+def _sandbox_worker(conn: Any) -> None:
+    """沙箱进程主循环：逐条接收请求并在受限环境中执行
+
+    持久化变量保存在本进程的 namespace 中，所以持久化请求总是发给同一个进程（内核）。
+    """
+    # Ctrl+C 由主进程处理，沙箱进程随主进程一起退出；分支进程由内核 fork，退出后自动回收
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    safe_globals = _build_safe_globals()
+    conn.send({"type": "ready"})
+    _serve_requests(conn, safe_globals, {}, _address_space())
+
+
+def _fork_kernel(conn: Any, safe_globals: Dict[str, Any], namespace: Dict[str, Any],
+                 baseline: int) -> Dict[str, Any]:
+    """fork 当前内核得到分支进程，分支通过随请求传来的管道与主进程通信
+
+    分支进程以写时复制方式继承命名空间，之后与原内核互不影响；它不会回到调用方，
+    管道关闭后直接退出。
+    """
+    fd = reduction.recv_handle(conn)
+    try:
+        pid = os.fork()
+    except OSError as e:
+        os.close(fd)
+        return {"error": f"fork 失败: {e}"}
+    if pid == 0:
+        try:
+            conn.close()
+            # 各分支使用不同的随机数序列
+            safe_globals["random"].seed()
+            _serve_requests(multiprocessing.connection.Connection(fd), safe_globals, namespace, baseline)
+        finally:
+            os._exit(0)
+    os.close(fd)
+    return {"pid": pid, "variables": len(_user_variables(namespace, safe_globals))}
+
+
+def _serve_requests(conn: Any, safe_globals: Dict[str, Any], namespace: Dict[str, Any],
+                    baseline: int) -> None:
+    """逐条处理管道上的请求，直到管道关闭"""
+    value_cache: Dict[str, Any] = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+
+        op = request.get("op")
+        if op == "execute":
+            value_cache.clear()
+            _set_cpu_limit(request["cpu_limit"])
+            _set_memory_limit(baseline, request.get("memory_limit"))
+            local_vars = namespace if request.get("persistent") else {}
+            capture = _OutputCapture(request["max_output_bytes"],
+                                     conn if request.get("stream") else None)
+            code = marshal.loads(request["bytecode"])
+            _artifact_state.update(directory=request.get("artifact_dir"),
+                                   max_bytes=request.get("max_artifact_bytes", 0), total_bytes=0, saved={})
+            with _ResourceMeter(request.get("trace_allocations", False)) as meter:
+                if request.get("profile"):
+                    with _Profiler(request["profile"]) as profiler:
+                        response = _run_code(code, safe_globals, local_vars, capture)
+                    response["profile"] = profiler.result()
+                else:
+                    response = _run_code(code, safe_globals, local_vars, capture)
+            response["resources"] = meter.result
+            if _artifact_state["saved"]:
+                response["artifacts"] = list(_artifact_state["saved"].values())
+            _artifact_state.update(directory=None, saved={})
+            if request.get("export") and response["success"]:
+                response["buffers"], response["buffer_errors"] = _export_buffers(
+                    local_vars, request["export"], request["buffer_dir"], request["buffer_prefix"],
+                    request["max_buffer_bytes"])
+            response["output_bytes"] = capture.total_bytes
+            response["output_truncated"] = capture.truncated
+        elif op == "variables":
+            response = _list_variables(namespace, safe_globals, request["offset"], request["limit"])
+        elif op == "variable_value":
+            _set_cpu_limit(request["cpu_limit"])
+            _set_memory_limit(baseline, request.get("memory_limit"))
+            response = _variable_value(namespace, request["name"], request["offset"],
+                                       request["length"], value_cache)
+        elif op == "snapshot":
+            _set_cpu_limit(request["cpu_limit"])
+            response = _snapshot_namespace(namespace, safe_globals, request["max_bytes"])
+        elif op == "restore":
+            _set_cpu_limit(request["cpu_limit"])
+            _set_memory_limit(baseline, request.get("memory_limit"))
+            response = _restore_namespace(namespace, request["data"])
+        elif op == "fork":
+            response = _fork_kernel(conn, safe_globals, namespace, baseline)
+        elif op == "clear":
+            count = len(_user_variables(namespace, safe_globals))
+            namespace.clear()
+            value_cache.clear()
+            response = {"cleared_count": count}
+        else:
+            response = {"error": f"未知请求: {op}"}
+        conn.send(response)
+
+
+def _describe_exit(exitcode: Optional[int]) -> str:
+    """把沙箱进程的退出码转换为可读的原因"""
+    if exitcode == -signal.SIGXCPU:
+        return "CPU 时间超限，沙箱进程已终止"
+    if exitcode == -signal.SIGKILL:
+        return "沙箱进程被强制终止"
+    if exitcode is not None and exitcode < 0:
+        return f"沙箱进程被信号 {signal.Signals(-exitcode).name} 终止"
+    return f"沙箱进程意外退出（退出码 {exitcode}）"
+
+
+class SandboxCrashError(RuntimeError):
+    """沙箱进程在执行过程中退出"""
+
+
+class SandboxWorker:
+    """一个沙箱进程及其通信管道"""
+
+    def __init__(self, context: Any):
+        """启动进程并等待其完成初始化（阻塞调用，应放在线程池中执行）"""
+        started = time.perf_counter()
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_sandbox_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.pid = self.process.pid
+        self.executions = 0
+        try:
+            self.conn.recv()
+        except EOFError:
+            reason = self.kill()
+            raise SandboxCrashError(f"沙箱进程启动失败: {reason}")
+        self.spawn_time = time.perf_counter() - started
+
+    @property
+    def alive(self) -> bool:
+        return self.conn is not None
+
+    async def call(self, request: Dict[str, Any], timeout: float,
+                   on_output: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   handle: Optional[int] = None) -> Dict[str, Any]:
+        """发送一条请求并等待响应
+
+        响应之前收到的输出片段（含 stream 键的消息）交给 on_output；给定 handle 时随请求传递该文件描述符。
+        超时、被取消或进程退出时都会结束该进程（之后 alive 为 False）并抛出异常。
+        """
+        if self.conn is None:
+            raise SandboxCrashError("沙箱进程已退出")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            self.conn.send(request)
+            if handle is not None:
+                reduction.send_handle(self.conn, handle, self.pid)
+            while True:
+                await self._wait_readable(deadline)
+                response = self.conn.recv()
+                if "stream" not in response:
+                    break
+                if on_output is not None:
+                    on_output(response)
+        except asyncio.TimeoutError:
+            self.kill()
+            raise TimeoutError(f"执行超时（超过 {timeout:g} 秒），沙箱进程已终止")
+        except (EOFError, OSError):
+            raise SandboxCrashError(self.kill())
+        except BaseException:
+            # 请求被取消等情况：进程状态未知，直接结束
+            self.kill()
+            raise
+        self.executions += 1
+        return response
+
+    async def _wait_readable(self, deadline: float) -> None:
+        """等待管道可读，不占用线程"""
+        if self.conn.poll():
+            return
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, max(0.0, deadline - loop.time()))
+        finally:
+            loop.remove_reader(fd)
+
+    def kill(self) -> str:
+        """结束进程，返回退出原因"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.process.exitcode is None:
+            self.process.kill()
+        self.process.join(1)
+        return _describe_exit(self.process.exitcode)
+
+
+class ForkedWorker(SandboxWorker):
+    """由内核 fork 得到的分支进程
+
+    分支进程是内核进程的子进程而不是本进程的子进程，通过 pidfd 结束它，避免进程号被复用后误杀。
+    """
+
+    def __init__(self, conn: Any, pid: int):
+        self.conn = conn
+        self.pid = pid
+        self.executions = 0
+        self.spawn_time = 0.0
+        try:
+            self.pidfd: Optional[int] = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.pidfd = None
+
+    def kill(self) -> str:
+        """结束分支进程；分支不是本进程的子进程，无法取得退出码"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        try:
+            if self.pidfd is not None:
+                signal.pidfd_send_signal(self.pidfd, signal.SIGKILL)
+            else:
+                os.kill(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, OSError):
+            pass
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+        return "分支进程已退出"
+
+
+class SandboxPool:
+    """预先启动的沙箱进程池
+
+    非持久化的执行请求交给任意空闲进程，多个请求在不同进程中并行执行；
+    超时、被取消或异常退出的进程会被结束，并在后台启动新进程补足池大小。
+
+    默认使用 fork server 启动方式：模板进程只导入一次预加载模块，之后每个沙箱进程
+    都由它 fork 得到（写时复制），启动开销接近一次 fork。执行次数达到 max_executions
+    的进程会被回收，设为 1 即每次执行都使用全新的进程。
+    """
+
+    def __init__(self, workers: int = 4, start_method: str = _DEFAULT_START_METHOD,
+                 preload: Optional[List[str]] = None, max_executions: int = 100):
+        """初始化进程池，进程在 start() 时才启动"""
+        self.size = workers
+        self.start_method = start_method
+        self.max_executions = max_executions
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            self._context.set_forkserver_preload(_PRELOAD_MODULES + list(preload or []))
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: set = set()
+        self.executions = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.replaced = 0
+        self.recycled = 0
+        self.spawned = 0
+        self.spawn_time_total = 0.0
+        self.spawn_time_max = 0.0
+        self.spawn_time_last = 0.0
+
+    def spawn(self) -> SandboxWorker:
+        """启动一个沙箱进程（阻塞调用），并记录启动耗时"""
+        worker = SandboxWorker(self._context)
+        self.spawned += 1
+        self.spawn_time_total += worker.spawn_time
+        self.spawn_time_max = max(self.spawn_time_max, worker.spawn_time)
+        self.spawn_time_last = worker.spawn_time
+        return worker
+
+    async def start(self) -> None:
+        """启动池中的进程（已启动时直接返回）"""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        workers = await asyncio.gather(
+            *(loop.run_in_executor(None, self.spawn) for _ in range(self.size)))
+        for worker in workers:
+            self._workers.add(worker)
+            self._idle.put_nowait(worker)
+
+    async def run(self, request: Dict[str, Any], timeout: float,
+                  on_output: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """在空闲进程中执行请求
+
+        timeout 从调用时开始计算，同时包括等待空闲进程和执行的时间，一次请求的总耗时不超过 timeout。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        await self.start()
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"等待空闲沙箱进程超时（{timeout:g} 秒）")
+
+        self.executions += 1
+        waited = timeout - (deadline - loop.time())
+        try:
+            return await worker.call(request, max(0.0, deadline - loop.time()), on_output)
+        except TimeoutError as e:
+            self.timeouts += 1
+            if waited < 0.01:
+                raise TimeoutError(f"执行超时（超过 {timeout:g} 秒），沙箱进程已终止") from e
+            raise TimeoutError(f"执行超时（超过 {timeout:g} 秒，其中等待空闲沙箱进程 {waited:.2f} 秒），"
+                               f"沙箱进程已终止") from e
+        except SandboxCrashError:
+            self.crashes += 1
+            raise
+        finally:
+            self._release(worker)
+
+    def _release(self, worker: SandboxWorker) -> None:
+        """归还进程；已结束或达到执行次数上限的进程在后台替换"""
+        if worker.alive and worker.executions < self.max_executions:
+            self._idle.put_nowait(worker)
+            return
+        if worker.alive:
+            worker.kill()
+            self.recycled += 1
+        else:
+            self.replaced += 1
+        self._workers.discard(worker)
+        replacement = asyncio.get_running_loop().run_in_executor(None, self.spawn)
+        replacement.add_done_callback(self._add_idle)
+
+    def _add_idle(self, future: "asyncio.Future") -> None:
+        """替换进程启动完成后放回空闲队列"""
+        if future.exception() is not None:
+            logger.error(f"启动沙箱进程失败: {future.exception()}")
+        elif self._idle is not None:
+            self._workers.add(future.result())
+            self._idle.put_nowait(future.result())
+        else:
+            future.result().kill()
+
+    def close(self) -> None:
+        """结束所有进程"""
+        for worker in list(self._workers):
+            worker.kill()
+        self._workers.clear()
+        self._idle = None
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "workers": self.size,
+            "running_workers": len(self._workers),
+            "idle_workers": self._idle.qsize() if self._idle is not None else 0,
+            "start_method": self.start_method,
+            "executions": self.executions,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+            "replaced": self.replaced,
+            "recycled": self.recycled,
+            "spawned": self.spawned,
+            "spawn_ms": {
+                "last": round(self.spawn_time_last * 1000, 3),
+                "avg": round(self.spawn_time_total / self.spawned * 1000, 3) if self.spawned else 0.0,
+                "max": round(self.spawn_time_max * 1000, 3)
             }
+        }
+
+
+# 禁止的语法节点、函数调用和方法调用（双下划线属性的访问在 SafetyChecker 中一律禁止）
+_DANGEROUS_NODES = frozenset({ast.Import, ast.ImportFrom})
+_DANGEROUS_CALLS = frozenset({
+    'exec', 'eval', 'compile', '__import__', 'open', 'file',
+    'input', 'raw_input', 'reload', 'vars', 'locals', 'globals',
+    'getattr', 'setattr', 'delattr', 'hasattr'
+})
+_DANGEROUS_METHODS = frozenset({'system', 'popen', 'spawn', 'fork'})
+# 引用这些名称的代码结果不确定，不缓存执行结果
+_NONDETERMINISTIC_NAMES = frozenset({'random', 'datetime'})
+
+
+class UnsafeCodeError(Exception):
+    """代码未通过安全检查"""
+
+
+class SafetyChecker:
+    """单次遍历 AST 的安全检查
+
+    用显式栈代替 ast.NodeVisitor 的递归分派，违规判断都是集合查找；
+    遇到第一个违规节点时抛出 UnsafeCodeError。同一次遍历中顺带判断代码是否确定性
+    （没有引用 random、datetime 等不确定来源），返回该判断结果。
+    """
+
+    @staticmethod
+    def check(tree: ast.AST) -> bool:
+        deterministic = True
+        stack = [tree]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node = pop()
+            if not isinstance(node, ast.AST):
+                continue
+            cls = type(node)
+            if cls is ast.Call:
+                func = node.func
+                if type(func) is ast.Name and func.id in _DANGEROUS_CALLS:
+                    raise UnsafeCodeError(f"不允许的函数调用: {func.id}")
+                if type(func) is ast.Attribute and func.attr in _DANGEROUS_METHODS:
+                    raise UnsafeCodeError(f"不允许的方法调用: {func.attr}")
+            elif cls is ast.Attribute:
+                # 双下划线属性（__class__、__globals__、__builtins__ 等）都可能通向沙箱外的对象
+                attr = node.attr
+                if attr.startswith('__') and attr.endswith('__'):
+                    raise UnsafeCodeError(f"不允许访问属性: {attr}")
+            elif cls is ast.Name:
+                if node.id in _NONDETERMINISTIC_NAMES:
+                    deterministic = False
+            elif cls in _DANGEROUS_NODES:
+                raise UnsafeCodeError(f"不允许的操作: {cls.__name__}")
+
+            for field in node._fields:
+                value = getattr(node, field, None)
+                if type(value) is list:
+                    stack.extend(value)
+                elif isinstance(value, ast.AST):
+                    push(value)
+        return deterministic
+
+
+class ResultCache:
+    """确定性代码的执行结果缓存（LRU + TTL）
+
+    只缓存非持久化、执行成功的结果；条目数不超过 capacity，输出总大小不超过 max_bytes，
+    超过 ttl 秒的条目视为失效。
+    """
+
+    def __init__(self, capacity: int = 256, ttl: float = 300.0, max_bytes: int = 64 * 1024 * 1024):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """查找未过期的缓存结果"""
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key: bytes, result: Dict[str, Any]) -> None:
+        """写入执行结果，超出容量或总大小时淘汰最久未使用的项"""
+        size = len(result.get("output") or "") + len(result.get("variables") or "")
+        if self.capacity <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic(), size, result)
+        self.total_bytes += size
+        while len(self._entries) > self.capacity or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: bytes) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "capacity": self.capacity,
+            "ttl_seconds": self.ttl,
+            "size": len(self._entries),
+            "total_bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+class CodeCache:
+    """编译结果缓存（LRU），键为源码的 SHA-256"""
+
+    def __init__(self, capacity: int = 1024):
+        """初始化缓存"""
+        self.capacity = capacity
+        self._entries: "OrderedDict[bytes, Tuple[Optional[bytes], str, bool]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> Optional[Tuple[Optional[bytes], str, bool]]:
+        """查找缓存项，命中时将其移到队尾"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: bytes, entry: Tuple[Optional[bytes], str, bool]) -> None:
+        """写入缓存项，超出容量时淘汰最久未使用的项"""
+        if self.capacity <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+DEFAULT_SESSION = "default"
+_SESSION_ID_PATTERN = re.compile(r"^[\w.:@-]{1,128}$")
+
+
+class SnapshotStore:
+    """会话命名空间快照的磁盘存储，每个会话一个文件（文件名为会话 ID 的哈希）"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.pickle")
+
+    def exists(self, session_id: str) -> bool:
+        return os.path.exists(self._path(session_id))
 
+    def save(self, session_id: str, data: bytes) -> None:
+        """先写临时文件再改名，写到一半时进程退出不会留下损坏的快照"""
+        path = self._path(session_id)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        try:
+            with open(self._path(session_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, session_id: str) -> None:
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """快照数量和总大小"""
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory)
+                 if entry.name.endswith(".pickle")]
+        return {"directory": self.directory, "count": len(sizes), "bytes": sum(sizes)}
+
+
+class Kernel:
+    """一个会话的持久化内核进程"""
+
+    def __init__(self, session_id: str, parent: Optional[str] = None):
+        self.session_id = session_id
+        self.parent = parent
+        self.worker: Optional[SandboxWorker] = None
+        self.lock = asyncio.Lock()
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+
+
+class BranchQuotaError(RuntimeError):
+    """会话的分支数已达上限"""
+
+
+class KernelManager:
+    """按会话隔离的持久化内核
+
+    每个会话拥有独立的内核进程，变量保存在该进程的命名空间中，会话之间互不可见。
+    空闲超时的内核会被回收；会话数达到上限时回收最久未使用的空闲内核。
+    给定 snapshots 时，内核被回收或服务器正常关闭前先把可序列化的变量写入快照，
+    该会话下次调用时启动新内核并从快照恢复。
+    fork 把会话的内核进程 fork 为新会话（分支），每个会话同时存在的分支数不超过 max_branches。
+    """
+
+    def __init__(self, pool: SandboxPool, max_sessions: int = 100,
+                 idle_timeout: float = 1800.0, snapshots: Optional[SnapshotStore] = None,
+                 snapshot_timeout: float = 30.0, max_snapshot_bytes: int = 256 * 1024 * 1024,
+                 max_branches: int = 8):
+        """初始化内核表，内核在会话首次执行持久化代码时启动"""
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.max_branches = max_branches
+        self.idle_timeout = idle_timeout
+        self.snapshots = snapshots
+        self.snapshot_timeout = snapshot_timeout
+        self.max_snapshot_bytes = max_snapshot_bytes
+        self._kernels: "OrderedDict[str, Kernel]" = OrderedDict()
+        self.created = 0
+        self.idle_evictions = 0
+        self.lru_evictions = 0
+        self.snapshots_saved = 0
+        self.snapshots_restored = 0
+        self.forks = 0
+
+    @staticmethod
+    def normalize(session_id: Optional[str]) -> str:
+        """校验会话 ID，未提供时使用默认会话"""
+        session_id = session_id or DEFAULT_SESSION
+        if not isinstance(session_id, str) or not _SESSION_ID_PATTERN.match(session_id):
+            raise ValueError("会话 ID 只能包含字母、数字和 . : @ _ -，长度不超过 128")
+        return session_id
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._kernels
+
+    async def call(self, session_id: str, request: Dict[str, Any], timeout: float,
+                   create: bool = True,
+                   on_output: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   handle: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """把请求发给会话的内核；内核和快照都不存在且 create 为 False 时返回 None
+
+        新内核启动后先从快照恢复变量，恢复结果附在本次响应的 restored 字段中。
+        内核在执行中超时或退出后即从表中移除，下次调用时重新启动（变量丢失）。
+        """
+        while True:
+            kernel = self._kernels.get(session_id)
+            if kernel is None:
+                if not create and not self._has_snapshot(session_id):
+                    return None
+                await self._make_room()
+                kernel = self._kernels.get(session_id)
+                if kernel is None:
+                    kernel = Kernel(session_id)
+                    self._kernels[session_id] = kernel
+                    self.created += 1
+            self._kernels.move_to_end(session_id)
+
+            async with kernel.lock:
+                if self._kernels.get(session_id) is not kernel:
+                    # 等待期间内核已被回收，重新获取
+                    continue
+                try:
+                    restored = None
+                    if kernel.worker is None:
+                        loop = asyncio.get_running_loop()
+                        kernel.worker = await loop.run_in_executor(None, self.pool.spawn)
+                        restored = await self._restore(kernel, request.get("memory_limit"))
+                    response = await kernel.worker.call(request, timeout, on_output, handle)
+                    if restored is not None:
+                        response = dict(response, restored=restored)
+                    return response
+                finally:
+                    kernel.last_used = time.monotonic()
+                    if kernel.worker is None or not kernel.worker.alive:
+                        self._discard(kernel)
+
+    def _has_snapshot(self, session_id: str) -> bool:
+        return self.snapshots is not None and self.snapshots.exists(session_id)
+
+    def branches(self, session_id: str) -> List[str]:
+        """会话当前存在的分支"""
+        return [kernel.session_id for kernel in self._kernels.values() if kernel.parent == session_id]
+
+    async def fork(self, session_id: str, branch_id: str, timeout: float = 30.0) -> Optional[Dict[str, Any]]:
+        """把会话的内核进程 fork 为新会话 branch_id；会话没有内核和快照时返回 None
+
+        分支以写时复制方式共享 fork 时的内存，之后与原会话互不影响。
+        """
+        if branch_id == session_id or branch_id in self._kernels or self._has_snapshot(branch_id):
+            raise ValueError(f"会话 {branch_id} 已存在")
+        await self._make_room()
+        if branch_id in self._kernels:
+            raise ValueError(f"会话 {branch_id} 已存在")
+        if len(self.branches(session_id)) >= self.max_branches:
+            raise BranchQuotaError(f"会话 {session_id} 的分支数已达上限（{self.max_branches}）")
+
+        # 先占住分支的位置并持有其锁，fork 完成前对分支的调用会等待
+        branch = Kernel(branch_id, parent=session_id)
+        self._kernels[branch_id] = branch
+        async with branch.lock:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            try:
+                response = await self.call(session_id, {"op": "fork"}, timeout, create=False,
+                                           handle=child_conn.fileno())
+                if response is not None and "error" not in response:
+                    branch.worker = ForkedWorker(parent_conn, response["pid"])
+            finally:
+                child_conn.close()
+                if branch.worker is None:
+                    parent_conn.close()
+                    self._discard(branch)
+        if response is None or "error" in response:
+            return response
+        self.forks += 1
+        logger.info(f"会话 {session_id} 分支为 {branch_id}（{response['variables']} 个变量）")
+        return response
+
+    async def close_session(self, session_id: str) -> bool:
+        """结束会话的内核并删除其快照（变量丢弃），返回会话是否存在"""
+        existed = self._has_snapshot(session_id)
+        kernel = self._kernels.get(session_id)
+        if kernel is not None:
+            async with kernel.lock:
+                if self._kernels.get(session_id) is kernel:
+                    self._discard(kernel)
+                    existed = True
+        if self.snapshots is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.snapshots.delete, session_id)
+        return existed
+
+    async def _restore(self, kernel: Kernel, memory_limit: Optional[int]) -> Optional[Dict[str, Any]]:
+        """从快照恢复新内核的变量，恢复后删除快照；没有快照时返回 None"""
+        if self.snapshots is None:
+            return None
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.snapshots.load, kernel.session_id)
+        if data is None:
+            return None
+        try:
+            restored = await kernel.worker.call(
+                {"op": "restore", "data": data, "cpu_limit": self.snapshot_timeout,
+                 "memory_limit": memory_limit},
+                self.snapshot_timeout)
+        except (TimeoutError, SandboxCrashError) as e:
+            # 快照无法恢复时丢弃它并换一个干净的内核，避免之后每次调用都失败
+            logger.error(f"会话 {kernel.session_id} 恢复快照失败: {e}")
+            restored = {"variables": [], "failed": [{"name": "*", "reason": str(e)}], "not_saved": []}
+            kernel.worker = await loop.run_in_executor(None, self.pool.spawn)
+        await loop.run_in_executor(None, self.snapshots.delete, kernel.session_id)
+        self.snapshots_restored += 1
+        logger.info(f"会话 {kernel.session_id} 从快照恢复 {len(restored['variables'])} 个变量，"
+                    f"失败 {len(restored['failed'])} 个")
+        return restored
+
+    async def _snapshot(self, kernel: Kernel) -> None:
+        """把内核中可序列化的变量写入快照（调用方持有内核锁），失败时只记录日志"""
+        if self.snapshots is None or kernel.worker is None or not kernel.worker.alive:
+            return
+        try:
+            response = await kernel.worker.call(
+                {"op": "snapshot", "max_bytes": self.max_snapshot_bytes,
+                 "cpu_limit": self.snapshot_timeout},
+                self.snapshot_timeout)
+            loop = asyncio.get_running_loop()
+            if response["saved"] or response["skipped"]:
+                await loop.run_in_executor(None, self.snapshots.save, kernel.session_id, response["data"])
+                self.snapshots_saved += 1
+            else:
+                await loop.run_in_executor(None, self.snapshots.delete, kernel.session_id)
         except Exception as e:
-            execution_time = time.time() - start_time
-            error_msg = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"会话 {kernel.session_id} 保存快照失败: {e}")
+            return
+        if response["saved"] or response["skipped"]:
+            skipped = ", ".join(f"{item['name']}（{item['reason']}）" for item in response["skipped"])
+            logger.info(f"会话 {kernel.session_id} 保存快照: {len(response['saved'])} 个变量，"
+                        f"{response['bytes']} 字节" + (f"；未保存: {skipped}" if skipped else ""))
+
+    async def _evict(self, kernel: Kernel) -> None:
+        """保存快照后回收内核（调用方持有内核锁）"""
+        await self._snapshot(kernel)
+        self._discard(kernel)
+
+    async def _make_room(self) -> None:
+        """会话数达到上限时回收最久未使用的空闲内核"""
+        while len(self._kernels) >= self.max_sessions:
+            victim = next((kernel for kernel in self._kernels.values() if not kernel.lock.locked()), None)
+            if victim is None:
+                raise RuntimeError(f"活跃会话数已达上限（{self.max_sessions}）")
+            async with victim.lock:
+                if self._kernels.get(victim.session_id) is not victim:
+                    continue
+                await self._evict(victim)
+            self.lru_evictions += 1
+            logger.info(f"会话数达到上限，回收内核: {victim.session_id}")
+
+    def _discard(self, kernel: Kernel) -> None:
+        """从表中移除内核并结束其进程"""
+        if self._kernels.get(kernel.session_id) is kernel:
+            del self._kernels[kernel.session_id]
+        if kernel.worker is not None:
+            kernel.worker.kill()
+
+    async def evict_idle(self) -> int:
+        """保存快照后回收空闲超时的内核，返回回收数量"""
+        now = time.monotonic()
+        expired = [kernel for kernel in self._kernels.values()
+                   if not kernel.lock.locked() and now - kernel.last_used > self.idle_timeout]
+        count = 0
+        for kernel in expired:
+            async with kernel.lock:
+                if (self._kernels.get(kernel.session_id) is not kernel
+                        or time.monotonic() - kernel.last_used <= self.idle_timeout):
+                    continue
+                await self._evict(kernel)
+            count += 1
+        self.idle_evictions += count
+        if count:
+            logger.info(f"回收空闲内核 {count} 个")
+        return count
+
+    async def close(self) -> None:
+        """保存所有空闲内核的快照并结束所有内核进程；仍在执行的内核直接结束"""
+        async def close_kernel(kernel: Kernel) -> None:
+            if kernel.lock.locked():
+                logger.warning(f"会话 {kernel.session_id} 仍在执行，未保存快照")
+                self._discard(kernel)
+                return
+            async with kernel.lock:
+                await self._evict(kernel)
+
+        await asyncio.gather(*(close_kernel(kernel) for kernel in list(self._kernels.values())))
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "sessions": len(self._kernels),
+            "busy_sessions": sum(1 for kernel in self._kernels.values() if kernel.lock.locked()),
+            "max_sessions": self.max_sessions,
+            "idle_timeout_seconds": self.idle_timeout,
+            "created": self.created,
+            "idle_evictions": self.idle_evictions,
+            "lru_evictions": self.lru_evictions,
+            "snapshots_saved": self.snapshots_saved,
+            "snapshots_restored": self.snapshots_restored,
+            "branches": sum(1 for kernel in self._kernels.values() if kernel.parent is not None),
+            "max_branches": self.max_branches,
+            "forks": self.forks,
+            "snapshot_store": self.snapshots.stats() if self.snapshots is not None else None
+        }
+
+
+class HistoryStore:
+    """执行历史：内存中只保留最近 tail_size 条，完整历史追加写入 SQLite（WAL 模式）
+
+    记录先进入待写队列，攒满 batch_size 条或调用 flush 时批量写入。最近一页且不带过滤条件的查询
+    直接由内存中的尾部记录回答，其他查询按索引（时间、会话、是否成功）在数据库中分页，不会整体加载。
+    记录总数（含待写记录）在内存中计数，数据库中的记录数保存在 history_meta 表中、与写入在同一事务内更新，
+    启动和不带过滤条件的查询都不需要 COUNT(*) 扫描全表。
+    写入失败（磁盘已满、文件被锁等）后按指数退避重试，待写记录最多保留 max_pending 条，
+    超出时丢弃最早的记录并计数。未指定 path 时只保留内存中的尾部记录。
+    """
+
+    _COLUMNS = ("id", "timestamp", "session_id", "success", "persistent", "type",
+                "execution_time", "code", "output", "error", "resources")
+
+    def __init__(self, path: Optional[str] = None, tail_size: int = 200, batch_size: int = 64,
+                 max_pending: int = 1024, max_backoff: float = 60.0):
+        self.path = path
+        self.tail: "deque[Dict[str, Any]]" = deque(maxlen=max(1, tail_size))
+        self.batch_size = batch_size
+        self.max_pending = max(batch_size, max_pending)
+        self.max_backoff = max_backoff
+        self._pending: List[Dict[str, Any]] = []
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self.write_errors = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._next_id = 1
+        self._total = 0
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS executions (
+                    id INTEGER PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    success INTEGER NOT NULL,
+                    persistent INTEGER NOT NULL,
+                    type TEXT,
+                    execution_time REAL,
+                    code TEXT NOT NULL,
+                    output TEXT,
+                    error TEXT,
+                    resources TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_executions_timestamp ON executions (timestamp);
+                CREATE INDEX IF NOT EXISTS idx_executions_session ON executions (session_id, id);
+                CREATE INDEX IF NOT EXISTS idx_executions_success ON executions (success, id);
+                CREATE TABLE IF NOT EXISTS history_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            self._next_id = (self._db.execute("SELECT MAX(id) FROM executions").fetchone()[0] or 0) + 1
+            row = self._db.execute("SELECT value FROM history_meta WHERE key = 'total'").fetchone()
+            if row is None:
+                # 没有计数行的旧数据库：只在第一次打开时计数一次
+                self._db.execute("INSERT INTO history_meta (key, value) "
+                                 "SELECT 'total', COUNT(*) FROM executions")
+                row = self._db.execute("SELECT value FROM history_meta WHERE key = 'total'").fetchone()
+            self._total = row[0]
+
+    def append(self, record: Dict[str, Any]) -> bool:
+        """追加一条记录，返回待写记录是否已攒满一批
+
+        append 本身不写磁盘；返回 True 时由调用方在线程池中调用 flush，避免阻塞事件循环。
+        """
+        with self._lock:
+            record = dict(record, id=self._next_id)
+            self._next_id += 1
+            self._total += 1
+            self.tail.append(record)
+            if self._db is None:
+                return False
+            self._pending.append(record)
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                # 数据库持续不可写时丢弃最早的待写记录，内存占用有上限
+                del self._pending[:overflow]
+                self._total -= overflow
+                self.dropped += overflow
+            return len(self._pending) >= self.batch_size
+
+    def flush(self, force: bool = False) -> None:
+        """把待写记录写入数据库；上次写入失败后的退避时间内跳过，除非 force"""
+        with self._lock:
+            if self._db is None or not self._pending:
+                return
+            if not force and time.monotonic() < self._retry_at:
+                return
+            rows = [(r["id"], r["timestamp"], r["session_id"], int(r["success"]), int(r["persistent"]),
+                     r.get("type"), r["execution_time"], r["code"], r["output"], r.get("error"),
+                     json.dumps(r["resources"]) if r.get("resources") is not None else None)
+                    for r in self._pending]
+            try:
+                with self._db:
+                    self._db.execute("BEGIN")
+                    self._db.executemany(
+                        f"INSERT INTO executions ({', '.join(self._COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(self._COLUMNS))})", rows)
+                    self._db.execute("UPDATE history_meta SET value = value + ? WHERE key = 'total'",
+                                     (len(rows),))
+            except sqlite3.Error as e:
+                self.write_errors += 1
+                self._backoff = min(self.max_backoff, self._backoff * 2 or 1.0)
+                self._retry_at = time.monotonic() + self._backoff
+                logger.error(f"写入执行历史失败（{len(self._pending)} 条待写，{self._backoff:.0f} 秒后重试）: {e}")
+                return
+            self._pending = []
+            self._backoff = 0.0
+            self._retry_at = 0.0
+
+    def query(self, limit: int = 10, before_id: Optional[int] = None,
+              session_id: Optional[str] = None, success: Optional[bool] = None,
+              since: Optional[str] = None, until: Optional[str] = None) -> Dict[str, Any]:
+        """查询 id 小于 before_id 的最近 limit 条记录（按时间顺序返回），以及满足条件的记录总数
+
+        next_before_id 用于继续向前翻页，没有更早的记录时为 None。时间范围为 ISO 格式字符串。
+        """
+        filters = {"session_id": session_id, "success": success, "since": since, "until": until}
+        unfiltered = before_id is None and all(value is None for value in filters.values())
+        if self._db is None or (unfiltered and limit <= len(self.tail)):
+            matched = [r for r in self.tail if self._matches(r, None, **filters)]
+            candidates = [r for r in matched if before_id is None or r["id"] < before_id]
+            page = candidates[-limit:]
+            total = len(matched) if self._db is None else self._total
+            more = len(candidates) > len(page) or total > len(matched)
+            return {"history": page, "total": total,
+                    "next_before_id": page[0]["id"] if more and page else None}
+
+        self.flush()
+        clauses, params = self._where(before_id, **filters)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM executions {clauses} ORDER BY id DESC LIMIT ?",
+                params + [limit + 1]).fetchall()
+        page = [self._row_to_record(row) for row in reversed(rows[:limit])]
+        total = self._total if all(value is None for value in filters.values()) else self._count(filters)
+        return {"history": page, "total": total,
+                "next_before_id": page[0]["id"] if len(rows) > limit else None}
+
+    @staticmethod
+    def _matches(record: Dict[str, Any], before_id: Optional[int], session_id: Optional[str],
+                 success: Optional[bool], since: Optional[str], until: Optional[str]) -> bool:
+        return ((before_id is None or record["id"] < before_id)
+                and (session_id is None or record["session_id"] == session_id)
+                and (success is None or record["success"] == success)
+                and (since is None or record["timestamp"] >= since)
+                and (until is None or record["timestamp"] < until))
+
+    @staticmethod
+    def _where(before_id: Optional[int] = None, session_id: Optional[str] = None,
+               success: Optional[bool] = None, since: Optional[str] = None,
+               until: Optional[str] = None) -> Tuple[str, List[Any]]:
+        conditions, params = [], []
+        for condition, value in (("id < ?", before_id), ("session_id = ?", session_id),
+                                 ("success = ?", None if success is None else int(success)),
+                                 ("timestamp >= ?", since), ("timestamp < ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return ("WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def _count(self, filters: Dict[str, Any]) -> int:
+        clauses, params = self._where(**filters)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM executions {clauses}", params).fetchone()[0]
+
+    def _row_to_record(self, row: Tuple[Any, ...]) -> Dict[str, Any]:
+        record = dict(zip(self._COLUMNS, row))
+        record["success"] = bool(record["success"])
+        record["persistent"] = bool(record["persistent"])
+        record["resources"] = json.loads(record["resources"]) if record["resources"] else None
+        if record["error"] is None:
+            del record["error"]
+        return record
+
+    def clear(self) -> int:
+        """清空历史，返回清除的记录数（包括尚未写入数据库的记录）"""
+        with self._lock:
+            count = len(self.tail) if self._db is None else self._total
+            self.tail.clear()
+            self._pending = []
+            self._total = 0
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("BEGIN")
+                    self._db.execute("DELETE FROM executions")
+                    self._db.execute("UPDATE history_meta SET value = 0 WHERE key = 'total'")
+        return count
+
+    def close(self) -> None:
+        """写入待写记录并关闭数据库"""
+        self.flush(force=True)
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "path": self.path,
+            "tail_records": len(self.tail),
+            "tail_size": self.tail.maxlen,
+            "pending_writes": len(self._pending),
+            "max_pending_writes": self.max_pending,
+            "write_errors": self.write_errors,
+            "dropped_records": self.dropped,
+            "total_records": self._total,
+            "last_id": self._next_id - 1
+        }
+
+
+class BufferStore:
+    """沙箱进程导出的二进制结果
+
+    每个结果是内存文件系统中的一个文件，由句柄引用、经 GET /buffers/{handle} 下载；
+    超过 ttl 秒或总大小超过 max_bytes 时回收最早的结果。
+    """
+
+    def __init__(self, directory: str = _BUFFER_DIR, ttl: float = 600.0,
+                 max_bytes: int = 2 * 1024 * 1024 * 1024, max_buffer_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        # 文件名包含主进程 PID，关闭时可以清理沙箱进程崩溃后遗留的文件
+        self.prefix = f"mcp-buffer-{os.getpid()}-"
+        self._buffers: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.exported = 0
+        self.downloads = 0
+        self.expired = 0
+
+    def register(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """登记沙箱进程写入的文件，返回给客户端的描述（不含文件路径）"""
+        handle = os.path.basename(meta["path"])[len(self.prefix):]
+        entry = dict(meta, handle=handle, created=time.monotonic())
+        self._buffers[handle] = entry
+        self.total_bytes += entry["nbytes"]
+        self.exported += 1
+        self._enforce_limit()
+        public = {k: v for k, v in entry.items() if k not in ("path", "created")}
+        public["url"] = f"/buffers/{handle}"
+        public["expires_in"] = self.ttl
+        return public
+
+    def get(self, handle: str) -> Optional[Dict[str, Any]]:
+        entry = self._buffers.get(handle)
+        if entry is not None and time.monotonic() - entry["created"] > self.ttl:
+            self.delete(handle)
+            self.expired += 1
+            return None
+        return entry
+
+    def delete(self, handle: str) -> bool:
+        entry = self._buffers.pop(handle, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry["nbytes"]
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _enforce_limit(self) -> None:
+        while self.total_bytes > self.max_bytes and self._buffers:
+            self.delete(next(iter(self._buffers)))
+            self.expired += 1
+
+    def expire(self) -> int:
+        """回收过期的结果，返回回收数量"""
+        now = time.monotonic()
+        stale = [handle for handle, entry in self._buffers.items() if now - entry["created"] > self.ttl]
+        for handle in stale:
+            self.delete(handle)
+        self.expired += len(stale)
+        return len(stale)
+
+    def close(self) -> None:
+        """删除所有结果文件，包括沙箱进程崩溃后未登记的文件"""
+        for handle in list(self._buffers):
+            self.delete(handle)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(self.prefix):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "directory": self.directory,
+            "buffers": len(self._buffers),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "exported": self.exported,
+            "downloads": self.downloads,
+            "expired": self.expired
+        }
+
+
+class ArtifactStore:
+    """沙箱代码通过 save_artifact 保存的制品
+
+    制品按内容寻址：文件名是内容的 SHA-256，相同内容只保存一份。超过 ttl 秒未被再次保存或下载、
+    或总大小超过 max_bytes 时回收最久未使用的制品。索引只在内存中，启动时清理目录中遗留的文件。
+    每次执行把文件写入 .pending 下独立的暂存目录，登记时移入制品目录；执行结束后删除暂存目录，
+    超时或崩溃的执行留下的文件不会残留。
+    """
+
+    def __init__(self, directory: str = _DEFAULT_ARTIFACT_DIR, ttl: float = 3600.0,
+                 max_bytes: int = 1024 * 1024 * 1024, max_artifact_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_artifact_bytes = max_artifact_bytes
+        self._artifacts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.saved = 0
+        self.downloads = 0
+        self.expired = 0
+        self._remove_files()
+
+    def pending_directory(self) -> str:
+        """一次执行专用的暂存目录（由沙箱进程在第一次保存制品时创建）"""
+        return os.path.join(self.directory, ".pending", secrets.token_hex(8))
+
+    def release_pending(self, directory: str) -> None:
+        """删除暂存目录及其中未登记的文件"""
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def register(self, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """把暂存目录中的制品移入制品目录并登记，返回给客户端的引用（不含文件路径）；文件已不存在时返回 None"""
+        entry = self._artifacts.get(meta["id"])
+        if entry is None:
+            path = os.path.join(self.directory, meta["id"])
+            try:
+                os.replace(meta["path"], path)
+            except OSError:
+                return None
+            entry = dict(meta, path=path)
+            self._artifacts[entry["id"]] = entry
+            self.total_bytes += entry["size"]
+        elif meta["name"] and not entry["name"]:
+            entry["name"] = meta["name"]
+        entry["used"] = time.monotonic()
+        self._artifacts.move_to_end(entry["id"])
+        self.saved += 1
+        self._enforce_limit()
+        return {
+            "id": entry["id"],
+            "name": meta["name"],
+            "size": entry["size"],
+            "mime_type": entry["mime_type"],
+            "url": f"/artifacts/{entry['id']}",
+            "expires_in": self.ttl
+        }
+
+    def get(self, artifact_id: str) -> Optional[Dict[str, Any]]:
+        """查找未过期的制品，并刷新其最近使用时间"""
+        entry = self._artifacts.get(artifact_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["used"] > self.ttl:
+            self.delete(artifact_id)
+            self.expired += 1
+            return None
+        entry["used"] = time.monotonic()
+        self._artifacts.move_to_end(artifact_id)
+        return entry
+
+    def delete(self, artifact_id: str) -> bool:
+        entry = self._artifacts.pop(artifact_id, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry["size"]
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _enforce_limit(self) -> None:
+        while self.total_bytes > self.max_bytes and self._artifacts:
+            self.delete(next(iter(self._artifacts)))
+            self.expired += 1
+
+    def expire(self) -> int:
+        """回收过期的制品，返回回收数量"""
+        now = time.monotonic()
+        stale = [artifact_id for artifact_id, entry in self._artifacts.items()
+                 if now - entry["used"] > self.ttl]
+        for artifact_id in stale:
+            self.delete(artifact_id)
+        self.expired += len(stale)
+        return len(stale)
+
+    def _remove_files(self) -> None:
+        """删除目录中的所有制品文件和暂存目录，包括未登记的文件"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        """删除所有制品文件；默认目录本身也一并删除"""
+        self._artifacts.clear()
+        self.total_bytes = 0
+        self._remove_files()
+        if self.directory == _DEFAULT_ARTIFACT_DIR:
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "directory": self.directory,
+            "artifacts": len(self._artifacts),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "saved": self.saved,
+            "downloads": self.downloads,
+            "expired": self.expired
+        }
+
+
+class UsageTracker:
+    """按会话累计资源用量，用于找出占用服务器资源最多的会话
+
+    最多保留 max_sessions 个会话的累计值，超出时淘汰最久没有执行的会话。
+    """
+
+    _SORT_KEYS = ("cpu_seconds", "wall_seconds", "executions", "peak_rss_bytes",
+                  "allocated_bytes", "output_bytes")
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._usage: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.totals = self._empty()
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {
+            "executions": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "cpu_user_seconds": 0.0,
+            "cpu_system_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "wall_seconds": 0.0,
+            "peak_rss_bytes": 0,
+            "allocated_bytes": 0,
+            "output_bytes": 0
+        }
+
+    def record(self, session_id: str, result: Dict[str, Any]) -> None:
+        """累计一次执行的资源用量"""
+        usage = self._usage.get(session_id)
+        if usage is None:
+            if len(self._usage) >= self.max_sessions:
+                self._usage.popitem(last=False)
+            usage = self._usage[session_id] = self._empty()
+        self._usage.move_to_end(session_id)
+        resources = result.get("resources") or {}
+        for entry in (usage, self.totals):
+            entry["executions"] += 1
+            if not result["success"]:
+                entry["errors"] += 1
+            if result.get("type") == "timeout":
+                entry["timeouts"] += 1
+            cpu_user = resources.get("cpu_user_seconds") or 0.0
+            cpu_system = resources.get("cpu_system_seconds") or 0.0
+            entry["cpu_user_seconds"] += cpu_user
+            entry["cpu_system_seconds"] += cpu_system
+            entry["cpu_seconds"] += cpu_user + cpu_system
+            entry["wall_seconds"] += resources.get("wall_seconds") or 0.0
+            entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], resources.get("peak_rss_bytes") or 0)
+            entry["allocated_bytes"] += resources.get("peak_allocated_bytes") or 0
+            entry["output_bytes"] += result.get("output_bytes") or 0
+        usage["last_execution"] = datetime.now().isoformat()
+
+    def report(self, session_id: Optional[str] = None, top: int = 20,
+               sort_by: str = "cpu_seconds") -> Dict[str, Any]:
+        """单个会话的累计用量，或按 sort_by 降序排列的前 top 个会话"""
+        if sort_by not in self._SORT_KEYS:
+            raise ValueError(f"不支持的排序字段: {sort_by}，可选: {', '.join(self._SORT_KEYS)}")
+        if session_id is not None:
+            usage = self._usage.get(session_id)
+            sessions = [dict(usage, session_id=session_id)] if usage else []
+        else:
+            ranked = sorted(self._usage.items(), key=lambda item: item[1][sort_by], reverse=True)
+            sessions = [dict(usage, session_id=sid) for sid, usage in ranked[:max(0, top)]]
+        for entry in sessions:
+            self._round(entry)
+        return {
+            "sessions": sessions,
+            "tracked_sessions": len(self._usage),
+            "sort_by": sort_by,
+            "totals": self._round(dict(self.totals))
+        }
+
+    @staticmethod
+    def _round(entry: Dict[str, Any]) -> Dict[str, Any]:
+        for key in ("cpu_user_seconds", "cpu_system_seconds", "cpu_seconds", "wall_seconds"):
+            entry[key] = round(entry[key], 6)
+        return entry
+
+
+class JobQueueFullError(RuntimeError):
+    """作业队列已满"""
+
+
+class Job:
+    """一个异步执行作业"""
+
+    def __init__(self, session_id: str, code: str, timeout: float, persistent: bool,
+                 max_output_bytes: Optional[int]):
+        self.id = secrets.token_hex(16)
+        self.session_id = session_id
+        self.code = code
+        self.timeout = timeout
+        self.persistent = persistent
+        self.max_output_bytes = max_output_bytes
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output: List[str] = []
+        self.output_length = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def append_output(self, message: Dict[str, Any]) -> None:
+        """收到沙箱进程的输出片段（stderr 片段同样并入输出）"""
+        self.output.append(message["data"])
+        self.output_length += len(message["data"])
+        self.notify()
+
+    def notify(self) -> None:
+        """唤醒等待新输出或状态变化的调用方"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout: float) -> None:
+        """等待新输出或状态变化，最多 timeout 秒"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
-            # 获取详细错误信息
-            stderr_output = stderr_capture.getvalue()
-            if stderr_output:
-                error_msg += f"\n{stderr_output}"
+    def info(self) -> Dict[str, Any]:
+        """作业状态（不含输出和结果）"""
+        now = time.time()
+        return {
+            "job_id": self.id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "persistent": self.persistent,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "queued_seconds": round((self.started_at or now) - self.created_at, 3),
+            "running_seconds": round((self.finished_at or now) - self.started_at, 3) if self.started_at else None,
+            "output_length": self.output_length
+        }
+
+
+class JobQueue:
+    """异步执行作业队列
+
+    提交后立即返回作业 ID，作业由 max_running 个后台任务依次取出执行。每个会话有自己的等待队列，
+    后台任务优先取执行中作业最少的会话的作业（相同时轮转），一个会话提交大量作业不会让其他会话长时间等待。
+    等待中的作业总数不超过 max_pending；完成的作业保留 retention 秒（最多 max_finished 个）供查询。
+    """
+
+    def __init__(self, interpreter: "PythonInterpreter", max_pending: int = 100,
+                 max_running: Optional[int] = None, retention: float = 3600.0,
+                 max_finished: int = 1000):
+        self.interpreter = interpreter
+        self.max_pending = max_pending
+        self.max_running = max_running
+        self.retention = retention
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = {}
+        self._queues: Dict[str, "deque[Job]"] = {}
+        self._running: Dict[str, int] = {}
+        self._last_dispatch: Dict[str, int] = {}
+        self._dispatch_seq = 0
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self._pending = 0
+        self._ready: Optional[asyncio.Semaphore] = None
+        self._runners: List[asyncio.Task] = []
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    async def start(self) -> None:
+        """启动后台执行任务，默认数量与沙箱进程池大小相同"""
+        self._ready = asyncio.Semaphore(0)
+        runners = self.max_running or self.interpreter.pool.size
+        self._runners = [asyncio.create_task(self._run()) for _ in range(runners)]
+
+    def submit(self, code: str, timeout: float = 10, persistent: bool = False,
+               session_id: Optional[str] = None, max_output_bytes: Optional[int] = None) -> Job:
+        """提交作业，队列已满时抛出 JobQueueFullError"""
+        session_id = self.interpreter.kernels.normalize(session_id)
+        if not isinstance(code, str):
+            raise ValueError("缺少代码")
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise JobQueueFullError(f"作业队列已满（{self.max_pending} 个等待中的作业），请稍后重试")
+        job = Job(session_id, code, timeout, persistent, max_output_bytes)
+        self._jobs[job.id] = job
+        self._queues.setdefault(session_id, deque()).append(job)
+        self._pending += 1
+        self.submitted += 1
+        self._ready.release()
+        return job
+
+    def _next(self) -> Optional[Job]:
+        """取出执行中作业最少的会话的下一个作业，相同时取最久没有被调度的会话"""
+        if not self._queues:
+            return None
+        session_id = min(self._queues, key=lambda sid: (self._running.get(sid, 0),
+                                                         self._last_dispatch.get(sid, 0)))
+        queue = self._queues[session_id]
+        job = queue.popleft()
+        if not queue:
+            del self._queues[session_id]
+        self._pending -= 1
+        self._dispatch_seq += 1
+        self._last_dispatch[session_id] = self._dispatch_seq
+        self._running[session_id] = self._running.get(session_id, 0) + 1
+        return job
+
+    async def _run(self) -> None:
+        """后台执行任务：取出作业并执行，直到被取消"""
+        while True:
+            await self._ready.acquire()
+            job = self._next()
+            if job is None:
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            job.notify()
+            job.task = asyncio.create_task(self.interpreter.execute_code(
+                job.code, job.timeout, job.persistent, job.session_id, job.max_output_bytes,
+                on_output=job.append_output))
+            try:
+                # shield：后台任务被取消（队列关闭）时不会连带取消作业，两种取消可以区分开
+                job.result = await asyncio.shield(job.task)
+                job.status = "succeeded" if job.result["success"] else "failed"
+            except asyncio.CancelledError:
+                if not job.task.cancelled():
+                    # 队列本身被关闭
+                    job.task.cancel()
+                    raise
+                job.status = "cancelled"
+            except Exception as e:
+                job.result = {"success": False, "error": str(e), "type": "error"}
+                job.status = "failed"
+            self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        if job.started_at is not None:
+            self._running[job.session_id] -= 1
+            if not self._running[job.session_id]:
+                del self._running[job.session_id]
+                if job.session_id not in self._queues:
+                    self._last_dispatch.pop(job.session_id, None)
+        job.finished_at = time.time()
+        job.task = None
+        if job.status == "cancelled":
+            self.cancelled += 1
+        else:
+            self.completed += 1
+        self._finished[job.id] = job
+        while len(self._finished) > self.max_finished:
+            _, old = self._finished.popitem(last=False)
+            self._jobs.pop(old.id, None)
+        job.notify()
+
+    def get(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id) if isinstance(job_id, str) else None
+        if job is None:
+            raise KeyError(f"作业不存在或已过期: {job_id}")
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        """取消作业：等待中的作业直接移出队列，执行中的作业终止其沙箱进程"""
+        job = self.get(job_id)
+        if job.status == "queued":
+            queue = self._queues.get(job.session_id)
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.session_id]
+            self._pending -= 1
+            job.status = "cancelled"
+            self._finish(job)
+        elif job.status == "running" and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def output(self, job_id: str, offset: int = 0, wait: float = 0) -> Dict[str, Any]:
+        """读取作业从 offset 开始的输出；wait 大于 0 时最多等待 wait 秒直到有新输出或作业结束"""
+        job = self.get(job_id)
+        offset = max(0, int(offset))
+        if wait > 0 and not job.done and job.output_length <= offset:
+            await job.wait(min(float(wait), 30.0))
+        text = "".join(job.output)[offset:]
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "offset": offset,
+            "data": text,
+            "next_offset": offset + len(text),
+            "done": job.done
+        }
 
-            # 记录执行历史
-            execution_record = {
-                "code": code,
+    def expire(self) -> int:
+        """清理超过保留时间的已完成作业"""
+        now = time.time()
+        stale = [job for job in self._finished.values() if now - job.finished_at > self.retention]
+        for job in stale:
+            del self._finished[job.id]
+            self._jobs.pop(job.id, None)
+        return len(stale)
+
+    async def close(self) -> None:
+        """停止后台任务，终止执行中的作业"""
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+
+    def stats(self) -> Dict[str, Any]:
+        """运行统计"""
+        return {
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "running": sum(self._running.values()),
+            "sessions_waiting": len(self._queues),
+            "retained": len(self._jobs),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "cancelled": self.cancelled
+        }
+
+
+class PythonInterpreter:
+    """Python解释器核心类
+
+    代码在沙箱进程中执行：非持久化请求由进程池并行处理，持久化请求交给所属会话的内核进程，
+    其中保存着该会话跨次执行的变量。
+    """
+
+    def __init__(self, workers: int = 4, max_timeout: float = 60,
+                 max_output_bytes: int = 1024 * 1024,
+                 max_cpu_seconds: Optional[float] = None,
+                 memory_limit_mb: Optional[int] = 1024,
+                 trace_allocations: bool = False):
+        """初始化Python解释器
+
+        max_cpu_seconds 为单次执行的 CPU 时间上限（默认与执行超时相同），
+        memory_limit_mb 为沙箱进程可额外使用的地址空间（None 表示不限）。
+        trace_allocations 打开后用 tracemalloc 统计每次执行的分配量，分配密集的代码会慢一个数量级。
+        """
+        self.history = HistoryStore()
+        self.code_cache = CodeCache()
+        self.result_cache = ResultCache()
+        self.pool = SandboxPool(workers)
+        self.kernels = KernelManager(self.pool)
+        self.usage = UsageTracker()
+        self.buffers = BufferStore()
+        self.artifacts = ArtifactStore()
+        self.jobs = JobQueue(self)
+        self.max_timeout = max_timeout
+        self.max_output_bytes = max_output_bytes
+        self.max_cpu_seconds = max_cpu_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.trace_allocations = trace_allocations
+
+    def compile_code(self, code: str) -> Tuple[Optional[bytes], str, bool]:
+        """解析、检查并编译代码，返回 (marshal 后的字节码, 错误信息, 是否确定性)
+
+        源码只解析一次，检查通过的 AST 直接编译；结果（包括检查失败的结果）按源码哈希缓存，
+        重复执行同一段代码时跳过解析、检查和编译。
+        """
+        key = hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest()
+        entry = self.code_cache.get(key)
+        if entry is not None:
+            return entry
+
+        try:
+            tree = ast.parse(code, filename="<sandbox>")
+        except SyntaxError as e:
+            entry = (None, f"语法错误: {e}", False)
+        else:
+            try:
+                deterministic = SafetyChecker.check(tree)
+                entry = (marshal.dumps(compile(tree, "<sandbox>", "exec")), "", deterministic)
+            except UnsafeCodeError as e:
+                entry = (None, str(e), False)
+            except (SyntaxError, ValueError) as e:
+                entry = (None, f"语法错误: {e}", False)
+        self.code_cache.put(key, entry)
+        return entry
+
+    def is_safe_code(self, code: str) -> tuple[bool, str]:
+        """检查代码是否安全"""
+        bytecode, error_msg, _ = self.compile_code(code)
+        return bytecode is not None, error_msg
+
+    async def start(self) -> None:
+        """预先启动沙箱进程池和作业队列"""
+        await self.pool.start()
+        await self.jobs.start()
+
+    async def execute_code(self, code: str, timeout: float = 10, persistent: bool = False,
+                           session_id: Optional[str] = None,
+                           max_output_bytes: Optional[int] = None,
+                           on_output: Optional[Callable[[Dict[str, Any]], None]] = None,
+                           memory_limit_mb: Optional[int] = None,
+                           export_variables: Optional[List[str]] = None,
+                           profile: bool = False, profile_top: int = 20) -> Dict[str, Any]:
+        """在沙箱进程中安全执行Python代码
+
+        timeout 同时作为墙钟时间和 CPU 时间的上限（CPU 时间还受服务器 max_cpu_seconds 约束），
+        超出时沙箱进程被终止并替换。输出总量不超过 max_output_bytes、额外地址空间不超过
+        memory_limit_mb，两者都不能超过服务器上限；给定 on_output 时，执行过程中的输出片段会实时交给它。
+        结果的 resources 字段给出本次执行的 CPU、墙钟时间、峰值 RSS 和分配量。
+        export_variables 中支持缓冲区协议的变量以二进制文件导出，结果的 buffers 字段给出下载句柄。
+        profile 为真时在沙箱进程内做性能分析，结果的 profile 字段给出前 profile_top 个函数和折叠栈。
+
+        不引用不确定来源的非持久化代码，其成功结果按代码和输出上限缓存，再次执行时直接返回，
+        结果的 cache_hit 表示是否命中。
+        """
+        session_id = self.kernels.normalize(session_id)
+        # 检查代码安全性并编译
+        bytecode, error_msg, deterministic = self.compile_code(code)
+        if bytecode is None:
+            return {
                 "success": False,
-                "error": error_msg,
-                "output": stdout_capture.getvalue(),
-                "execution_time": execution_time,
-                "persistent": persistent,
-                "timestamp": datetime.now().isoformat()
+                "error": f"代码安全检查失败: {error_msg}",
+                "output": "",
+                "execution_time": 0,
+                "type": "security_error"
             }
-            self.execution_history.append(execution_record)
 
-            return {
+        timeout = min(max(float(timeout), 0.1), self.max_timeout)
+        if max_output_bytes is None:
+            max_output_bytes = self.max_output_bytes
+        cpu_limit = timeout if self.max_cpu_seconds is None else min(timeout, self.max_cpu_seconds)
+        request = {"op": "execute", "bytecode": bytecode,
+                   "persistent": persistent, "cpu_limit": cpu_limit,
+                   "memory_limit": self._memory_limit(memory_limit_mb),
+                   "max_output_bytes": max(0, min(int(max_output_bytes), self.max_output_bytes)),
+                   "stream": on_output is not None,
+                   "trace_allocations": self.trace_allocations,
+                   "artifact_dir": self.artifacts.pending_directory(),
+                   "max_artifact_bytes": self.artifacts.max_artifact_bytes}
+        if export_variables:
+            request.update(export=list(export_variables)[:64], buffer_dir=self.buffers.directory,
+                           buffer_prefix=self.buffers.prefix,
+                           max_buffer_bytes=self.buffers.max_buffer_bytes)
+        if profile:
+            request["profile"] = max(1, min(int(profile_top), _MAX_PROFILE_TOP))
+        # 持久化执行依赖会话状态，流式输出和导出变量有副作用，性能分析需要真正执行，都不使用结果缓存
+        cache_key = None
+        if (deterministic and not persistent and on_output is None and not export_variables
+                and not profile):
+            cache_key = (hashlib.sha256(bytecode).digest()
+                         + request["max_output_bytes"].to_bytes(8, "big"))
+        start_time = time.time()
+        cached = self.result_cache.get(cache_key) if cache_key is not None else None
+        try:
+            if cached is not None:
+                result = dict(cached, execution_time=time.time() - start_time, resources=None)
+            elif persistent:
+                result = await self.kernels.call(session_id, request, timeout, on_output=on_output)
+            else:
+                result = await self.pool.run(request, timeout, on_output)
+        except (TimeoutError, SandboxCrashError) as e:
+            error_msg = str(e)
+            if persistent:
+                error_msg += "，持久化变量已丢失"
+            result = {
                 "success": False,
                 "error": error_msg,
-                "output": stdout_capture.getvalue(),
+                "output": "",
                 "variables": "",
-                "execution_time": execution_time,
-                "persistent": persistent,
-                "type": "error"
+                "execution_time": time.time() - start_time,
+                "type": "timeout" if isinstance(e, TimeoutError) else "sandbox_error",
+                # 沙箱进程已被终止，只能给出墙钟时间
+                "resources": {"wall_seconds": round(time.time() - start_time, 6)}
             }
-
+        except BaseException:
+            # 执行被取消时同样清理暂存的制品
+            self.artifacts.release_pending(request["artifact_dir"])
+            raise
+        # 保存了制品的执行有副作用，不缓存
+        if cache_key is not None and cached is None and result["success"] and "artifacts" not in result:
+            self.result_cache.put(cache_key, result.copy())
+        result["cache_hit"] = cached is not None
+        result["persistent"] = persistent
+        result["session_id"] = session_id
+        if "buffers" in result:
+            result["buffers"] = [self.buffers.register(meta) for meta in result["buffers"]]
+        if "artifacts" in result:
+            artifacts = (self.artifacts.register(meta) for meta in result["artifacts"])
+            result["artifacts"] = [artifact for artifact in artifacts if artifact is not None]
+        if cached is None:
+            self.artifacts.release_pending(request["artifact_dir"])
+        self.usage.record(session_id, result)
+
+        # 记录执行历史
+        execution_record = {
+            "session_id": session_id,
+            "code": code,
+            "success": result["success"],
+            "output": result["output"].strip() if result["success"] else result["output"],
+            "execution_time": result["execution_time"],
+            "resources": result.get("resources"),
+            "persistent": persistent,
+            "type": result.get("type"),
+            "timestamp": datetime.now().isoformat()
+        }
+        if not result["success"]:
+            execution_record["error"] = result["error"]
+        if self.history.append(execution_record):
+            await asyncio.get_running_loop().run_in_executor(None, self.history.flush)
+
+        return result
+
+    @staticmethod
+    def batch_jobs(snippets: Any, timeout: float) -> List[Tuple[str, float]]:
+        """校验批量执行的代码列表，返回 [(代码, 超时时间)]"""
+        if not isinstance(snippets, list) or not snippets:
+            raise ValueError("snippets 必须是非空列表")
+        if len(snippets) > _MAX_BATCH_SNIPPETS:
+            raise ValueError(f"一次最多执行 {_MAX_BATCH_SNIPPETS} 段代码")
+        jobs = []
+        for snippet in snippets:
+            if isinstance(snippet, str):
+                jobs.append((snippet, timeout))
+            elif isinstance(snippet, dict) and isinstance(snippet.get("code"), str):
+                jobs.append((snippet["code"], snippet.get("timeout", timeout)))
+            else:
+                raise ValueError("snippets 的每一项必须是代码字符串或包含 code 的对象")
+        return jobs
+
+    async def execute_batch(self, snippets: List[Any], timeout: float = 10,
+                            max_concurrency: Optional[int] = None, order: str = "input",
+                            session_id: Optional[str] = None,
+                            max_output_bytes: Optional[int] = None,
+                            on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """并行执行多段互不依赖的代码（非持久化），每段代码使用独立的沙箱进程
+
+        snippets 中每项是代码字符串或 {"code": ..., "timeout": ...}。最多同时执行 max_concurrency 段
+        （默认与进程池大小相同）；order 为 "input" 时结果按输入顺序返回，为 "completion" 时按完成顺序返回，
+        每个结果带有 index。未指定 max_output_bytes 时整批输出共享单次执行的输出上限。
+        给定 on_result 时，每段代码执行完成后立即把结果交给它。
+        """
+        if order not in ("input", "completion"):
+            raise ValueError("order 只能是 input 或 completion")
+        jobs = self.batch_jobs(snippets, timeout)
+        if max_output_bytes is None:
+            max_output_bytes = max(4096, self.max_output_bytes // len(jobs))
+        concurrency = max(1, min(int(max_concurrency or self.pool.size), self.pool.size, len(jobs)))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index: int, code: str, snippet_timeout: float) -> Dict[str, Any]:
+            async with semaphore:
+                result = await self.execute_code(code, snippet_timeout, False, session_id, max_output_bytes)
+            result["index"] = index
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        start_time = time.time()
+        tasks = [asyncio.create_task(run(index, code, snippet_timeout))
+                 for index, (code, snippet_timeout) in enumerate(jobs)]
+        try:
+            if order == "input":
+                results = list(await asyncio.gather(*tasks))
+            else:
+                results = [await task for task in asyncio.as_completed(tasks)]
         finally:
-            # 恢复输出
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
+            # 调用方取消（如客户端断开）时终止仍在执行的代码
+            for task in tasks:
+                task.cancel()
+        succeeded = sum(1 for result in results if result["success"])
+        return {
+            "results": results,
+            "count": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "order": order,
+            "max_concurrency": concurrency,
+            "total_time": time.time() - start_time
+        }
 
-    def get_variables(self) -> Dict[str, Any]:
-        """获取当前全局变量"""
-        user_vars = {k: v for k, v in self.global_vars.items()
-                     if not k.startswith('_')}
+    def submit_job(self, code: str, timeout: float = 10, persistent: bool = False,
+                   session_id: Optional[str] = None,
+                   max_output_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """提交异步执行作业，立即返回作业 ID"""
+        try:
+            job = self.jobs.submit(code, timeout, persistent, session_id, max_output_bytes)
+        except JobQueueFullError as e:
+            return {"success": False, "error": str(e), "type": "queue_full"}
+        return dict(job.info(), success=True)
 
-        variables_list = []
-        for key, value in user_vars.items():
-            try:
-                variables_list.append({
-                    "name": key,
-                    "value": repr(value),
-                    "type": type(value).__name__
-                })
-            except:
-                variables_list.append({
-                    "name": key,
-                    "value": "<无法显示>",
-                    "type": type(value).__name__
-                })
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        """查询作业状态"""
+        return self._job_call(lambda: dict(self.jobs.get(job_id).info(), success=True))
 
+    async def job_output(self, job_id: str, offset: int = 0, wait: float = 0) -> Dict[str, Any]:
+        """读取作业的增量输出"""
+        try:
+            return dict(await self.jobs.output(job_id, offset, wait), success=True)
+        except KeyError as e:
+            return {"success": False, "error": e.args[0]}
+
+    def job_result(self, job_id: str) -> Dict[str, Any]:
+        """获取已完成作业的结果，结果与 execute_python 相同"""
+        def result() -> Dict[str, Any]:
+            job = self.jobs.get(job_id)
+            if not job.done:
+                return dict(job.info(), success=False, error="作业尚未完成")
+            return dict(job.info(), success=True, result=job.result)
+        return self._job_call(result)
+
+    def cancel_job(self, job_id: str) -> Dict[str, Any]:
+        """取消作业"""
+        return self._job_call(lambda: dict(self.jobs.cancel(job_id).info(), success=True))
+
+    @staticmethod
+    def _job_call(func: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            return func()
+        except KeyError as e:
+            return {"success": False, "error": e.args[0]}
+
+    def _memory_limit(self, memory_limit_mb: Optional[int]) -> Optional[int]:
+        """本次执行的地址空间上限（字节）：请求值与服务器上限中较小的一个"""
+        limits = [int(mb) for mb in (memory_limit_mb, self.memory_limit_mb) if mb]
+        return min(limits) * 1024 * 1024 if limits else None
+
+    async def get_variables(self, session_id: Optional[str] = None,
+                            offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """分页获取会话全局变量的摘要（类型、长度或形状、截断预览、估算内存）"""
+        session_id = self.kernels.normalize(session_id)
+        offset = max(0, int(offset))
+        limit = max(1, min(int(limit), 500))
+        response = await self.kernels.call(
+            session_id, {"op": "variables", "offset": offset, "limit": limit},
+            self.max_timeout, create=False)
+        variables_list = response["variables"] if response else []
+        total = response["total"] if response else 0
         return {
+            "session_id": session_id,
             "variables": variables_list,
             "count": len(variables_list),
+            "total": total,
+            "offset": offset,
+            "next_offset": offset + len(variables_list) if offset + len(variables_list) < total else None,
             "timestamp": datetime.now().isoformat()
         }
 
-    def clear_variables(self) -> Dict[str, Any]:
-        """清空全局变量"""
-        count = len([k for k in self.global_vars.keys()
-                    if not k.startswith('_')])
-        self.global_vars.clear()
+    async def get_variable_value(self, name: str, session_id: Optional[str] = None,
+                                 offset: int = 0, length: int = 65536) -> Dict[str, Any]:
+        """分块获取会话中某个变量的完整 repr"""
+        session_id = self.kernels.normalize(session_id)
+        if not isinstance(name, str) or not name:
+            return {"success": False, "error": "缺少变量名"}
+        request = {
+            "op": "variable_value",
+            "name": name,
+            "offset": max(0, int(offset)),
+            "length": max(1, min(int(length), self.max_output_bytes)),
+            "cpu_limit": self.max_timeout,
+            "memory_limit": self._memory_limit(None)
+        }
+        try:
+            response = await self.kernels.call(session_id, request, self.max_timeout, create=False)
+        except (TimeoutError, SandboxCrashError) as e:
+            return {"success": False, "session_id": session_id, "error": f"{e}，持久化变量已丢失"}
+        if response is None:
+            return {"success": False, "session_id": session_id, "error": f"变量不存在: {name}"}
+        if "error" in response:
+            return {"success": False, "session_id": session_id, "error": response["error"]}
+        return dict(response, success=True, session_id=session_id)
+
+    def limits(self) -> Dict[str, Any]:
+        """服务器对单次执行施加的资源上限"""
+        return {
+            "max_timeout_seconds": self.max_timeout,
+            "max_cpu_seconds": self.max_cpu_seconds,
+            "memory_limit_bytes": self._memory_limit(None),
+            "max_output_bytes": self.max_output_bytes,
+            "trace_allocations": self.trace_allocations
+        }
 
+    async def clear_variables(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """清空会话的全局变量"""
+        session_id = self.kernels.normalize(session_id)
+        response = await self.kernels.call(
+            session_id, {"op": "clear"}, self.max_timeout, create=False)
         return {
             "success": True,
-            "cleared_count": count,
+            "session_id": session_id,
+            "cleared_count": response["cleared_count"] if response else 0,
             "timestamp": datetime.now().isoformat()
         }
 
-    def get_history(self, limit: int = 10) -> Dict[str, Any]:
-        """获取执行历史"""
+    async def fork_session(self, session_id: Optional[str] = None,
+                           branch_session_id: Optional[str] = None) -> Dict[str, Any]:
+        """把会话的持久化内核 fork 为新会话，新会话继承当前全部变量"""
+        session_id = self.kernels.normalize(session_id)
+        branch_id = self.kernels.normalize(branch_session_id or f"{session_id}.{secrets.token_hex(4)}")
+        start_time = time.perf_counter()
+        try:
+            response = await self.kernels.fork(session_id, branch_id)
+        except BranchQuotaError as e:
+            return {"success": False, "error": str(e), "type": "quota_exceeded"}
+        except (TimeoutError, SandboxCrashError, ValueError) as e:
+            return {"success": False, "error": str(e)}
+        if response is None:
+            return {"success": False, "error": f"会话 {session_id} 没有持久化变量，无法分支"}
+        if "error" in response:
+            return {"success": False, "error": response["error"]}
         return {
-            "history": self.execution_history[-limit:],
-            "total_executions": len(self.execution_history),
+            "success": True,
+            "session_id": branch_id,
+            "parent_session_id": session_id,
+            "variable_count": response["variables"],
+            "branches": self.kernels.branches(session_id),
+            "fork_ms": round((time.perf_counter() - start_time) * 1000, 3),
             "timestamp": datetime.now().isoformat()
         }
 
-    def clear_history(self) -> Dict[str, Any]:
+    async def close_session(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """结束会话的持久化内核并丢弃其变量（包括快照），释放会话和分支配额"""
+        session_id = self.kernels.normalize(session_id)
+        closed = await self.kernels.close_session(session_id)
+        return {
+            "success": True,
+            "session_id": session_id,
+            "closed": closed,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def get_history(self, limit: int = 10, before_id: Optional[int] = None,
+                          session_id: Optional[str] = None, success: Optional[bool] = None,
+                          since: Optional[str] = None, until: Optional[str] = None) -> Dict[str, Any]:
+        """分页查询执行历史，可按会话、是否成功和时间范围过滤；数据库查询在线程池中执行"""
+        limit = max(1, min(int(limit), 100))
+        before_id = int(before_id) if before_id is not None else None
+        loop = asyncio.get_running_loop()
+        page = await loop.run_in_executor(
+            None, self.history.query, limit, before_id, session_id, success, since, until)
+        return {
+            "history": page["history"],
+            "total_executions": page["total"],
+            "next_before_id": page["next_before_id"],
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def clear_history(self) -> Dict[str, Any]:
         """清空执行历史"""
-        count = len(self.execution_history)
-        self.execution_history.clear()
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(None, self.history.clear)
 
         return {
             "success": True,
@@ -298,19 +2803,40 @@ class PythonInterpreter:
             "timestamp": datetime.now().isoformat()
         }
 
+    async def close(self) -> None:
+        """停止作业队列，保存会话快照并结束所有沙箱进程，写入尚未保存的执行历史"""
+        await self.jobs.close()
+        await self.kernels.close()
+        self.pool.close()
+        self.buffers.close()
+        self.artifacts.close()
+        self.history.close()
+
 
 # 创建服务器实例
 server = Server("python-interpreter-mcp-server")
 interpreter = PythonInterpreter()
 
 
+_SESSION_ID_PROPERTY = {
+    "type": "string",
+    "description": "会话 ID，不同会话的持久化变量互相隔离（默认: default）"
+}
+
+
+_JOB_ID_PROPERTY = {
+    "type": "string",
+    "description": "submit_python_job 返回的作业 ID"
+}
+
+
 @server.list_tools()
 async def handle_list_tools() -> list[Tool]:
     """列出可用的工具"""
     return [
         Tool(
             name="execute_python",
-            description="执行Python代码并返回结果，支持基础数学运算、数据处理等安全操作",
+            description="执行Python代码并返回结果，支持基础数学运算、数据处理等安全操作；大块输出（CSV、图片等）可用 save_artifact(data, name, mime_type) 保存为制品，结果中返回下载地址",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -329,17 +2855,229 @@ async def handle_list_tools() -> list[Tool]:
                         "type": "boolean",
                         "description": "是否保持变量状态（持久化模式），默认false",
                         "default": False
-                    }
+                    },
+                    "max_output_bytes": {
+                        "type": "integer",
+                        "description": "输出（stdout 与 stderr 合计）的字节上限，超出部分被截断，默认 1MB",
+                        "minimum": 0
+                    },
+                    "memory_limit_mb": {
+                        "type": "integer",
+                        "description": "本次执行可额外使用的内存（地址空间），MB，不能超过服务器上限",
+                        "minimum": 1
+                    },
+                    "export_variables": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "执行后以二进制形式导出的变量名（bytes、array.array、NumPy 数组、纯数值列表等），结果中给出下载地址 /buffers/{handle}"
+                    },
+                    "profile": {
+                        "type": "boolean",
+                        "description": "是否对本次执行做性能分析，结果中给出耗时最多的函数、调用次数和折叠栈",
+                        "default": False
+                    },
+                    "profile_top": {
+                        "type": "integer",
+                        "description": "性能分析结果中列出的函数数量，默认20",
+                        "default": 20,
+                        "minimum": 1,
+                        "maximum": _MAX_PROFILE_TOP
+                    },
+                    "session_id": _SESSION_ID_PROPERTY
+                },
+                "required": ["code"]
+            }
+        ),
+        Tool(
+            name="execute_python_batch",
+            description="并行执行多段互不依赖的Python代码（如参数变体、逐个文件的分析），一次调用返回每段代码的结果",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "snippets": {
+                        "type": "array",
+                        "description": "代码列表，每项为代码字符串或 {\"code\": ..., \"timeout\": ...}，最多100段",
+                        "items": {
+                            "anyOf": [
+                                {"type": "string"},
+                                {
+                                    "type": "object",
+                                    "properties": {
+                                        "code": {"type": "string"},
+                                        "timeout": {"type": "number"}
+                                    },
+                                    "required": ["code"]
+                                }
+                            ]
+                        },
+                        "minItems": 1,
+                        "maxItems": 100
+                    },
+                    "timeout": {
+                        "type": "number",
+                        "description": "每段代码的默认超时时间（秒），默认10秒",
+                        "default": 10,
+                        "minimum": 1,
+                        "maximum": 60
+                    },
+                    "max_concurrency": {
+                        "type": "integer",
+                        "description": "最多同时执行的代码段数，默认与沙箱进程池大小相同",
+                        "minimum": 1
+                    },
+                    "order": {
+                        "type": "string",
+                        "enum": ["input", "completion"],
+                        "description": "结果顺序：input 按输入顺序，completion 按完成顺序，默认 input",
+                        "default": "input"
+                    },
+                    "max_output_bytes": {
+                        "type": "integer",
+                        "description": "每段代码的输出字节上限，默认为单次执行上限平均分给各段",
+                        "minimum": 0
+                    },
+                    "session_id": _SESSION_ID_PROPERTY
+                },
+                "required": ["snippets"]
+            }
+        ),
+        Tool(
+            name="submit_python_job",
+            description="提交长时间运行的Python代码作为异步作业，立即返回作业 ID；之后用 get_job_status / get_job_output / get_job_result 查询，cancel_job 取消",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "code": {
+                        "type": "string",
+                        "description": "要执行的Python代码"
+                    },
+                    "timeout": {
+                        "type": "number",
+                        "description": "执行超时时间（秒），默认10秒",
+                        "default": 10,
+                        "minimum": 1,
+                        "maximum": 60
+                    },
+                    "persistent": {
+                        "type": "boolean",
+                        "description": "是否在会话内核中执行（保持变量状态），默认false",
+                        "default": False
+                    },
+                    "max_output_bytes": {
+                        "type": "integer",
+                        "description": "输出的字节上限，默认 1MB",
+                        "minimum": 0
+                    },
+                    "session_id": _SESSION_ID_PROPERTY
                 },
                 "required": ["code"]
             }
         ),
+        Tool(
+            name="get_job_status",
+            description="查询异步作业的状态（queued / running / succeeded / failed / cancelled）",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": _JOB_ID_PROPERTY
+                },
+                "required": ["job_id"]
+            }
+        ),
+        Tool(
+            name="get_job_output",
+            description="读取异步作业目前为止的输出（增量读取），可等待新输出",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": _JOB_ID_PROPERTY,
+                    "offset": {
+                        "type": "integer",
+                        "description": "从第几个字符开始读取，传入上次结果的 next_offset 只读新输出，默认0",
+                        "default": 0,
+                        "minimum": 0
+                    },
+                    "wait": {
+                        "type": "number",
+                        "description": "没有新输出时最多等待的秒数（长轮询），默认0，最多30",
+                        "default": 0,
+                        "minimum": 0,
+                        "maximum": 30
+                    }
+                },
+                "required": ["job_id"]
+            }
+        ),
+        Tool(
+            name="get_job_result",
+            description="获取已完成异步作业的结果（与 execute_python 的结果相同）",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": _JOB_ID_PROPERTY
+                },
+                "required": ["job_id"]
+            }
+        ),
+        Tool(
+            name="cancel_job",
+            description="取消异步作业：等待中的作业移出队列，执行中的作业被终止",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "job_id": _JOB_ID_PROPERTY
+                },
+                "required": ["job_id"]
+            }
+        ),
         Tool(
             name="get_variables",
-            description="获取当前Python环境中的全局变量",
+            description="分页获取当前Python环境中全局变量的摘要（类型、长度或形状、截断预览、估算内存）",
             inputSchema={
                 "type": "object",
-                "properties": {}
+                "properties": {
+                    "offset": {
+                        "type": "integer",
+                        "description": "从第几个变量开始，默认0",
+                        "default": 0,
+                        "minimum": 0
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "每页变量数，默认50",
+                        "default": 50,
+                        "minimum": 1,
+                        "maximum": 500
+                    },
+                    "session_id": _SESSION_ID_PROPERTY
+                }
+            }
+        ),
+        Tool(
+            name="get_variable_value",
+            description="分块获取某个变量的完整值（repr），用于查看 get_variables 中被截断的大变量",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "name": {
+                        "type": "string",
+                        "description": "变量名"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "起始字符位置，默认0；继续读取时传入上次结果的 next_offset",
+                        "default": 0,
+                        "minimum": 0
+                    },
+                    "length": {
+                        "type": "integer",
+                        "description": "本次读取的字符数，默认65536",
+                        "default": 65536,
+                        "minimum": 1
+                    },
+                    "session_id": _SESSION_ID_PROPERTY
+                },
+                "required": ["name"]
             }
         ),
         Tool(
@@ -347,7 +3085,36 @@ async def handle_list_tools() -> list[Tool]:
             description="清空Python环境中的全局变量",
             inputSchema={
                 "type": "object",
-                "properties": {}
+                "properties": {
+                    "session_id": _SESSION_ID_PROPERTY
+                }
+            }
+        ),
+        Tool(
+            name="fork_session",
+            description="把会话的持久化环境复制为新会话（分支），新会话继承当前全部变量，适合从同一份准备好的数据出发尝试多种做法",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "session_id": {
+                        "type": "string",
+                        "description": "被分支的会话 ID（默认: default）"
+                    },
+                    "branch_session_id": {
+                        "type": "string",
+                        "description": "新会话的 ID，不提供时自动生成"
+                    }
+                }
+            }
+        ),
+        Tool(
+            name="close_session",
+            description="结束会话并丢弃其全部持久化变量，用于释放不再需要的分支",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "session_id": _SESSION_ID_PROPERTY
+                }
             }
         ),
         Tool(
@@ -362,6 +3129,26 @@ async def handle_list_tools() -> list[Tool]:
                         "default": 10,
                         "minimum": 1,
                         "maximum": 100
+                    },
+                    "before_id": {
+                        "type": "integer",
+                        "description": "只返回 id 小于该值的记录，传入上次结果的 next_before_id 继续向前翻页"
+                    },
+                    "session_id": {
+                        "type": "string",
+                        "description": "只返回该会话的记录"
+                    },
+                    "success": {
+                        "type": "boolean",
+                        "description": "只返回执行成功（true）或失败（false）的记录"
+                    },
+                    "since": {
+                        "type": "string",
+                        "description": "起始时间（ISO 格式，包含），如 2024-01-01T00:00:00"
+                    },
+                    "until": {
+                        "type": "string",
+                        "description": "截止时间（ISO 格式，不包含）"
                     }
                 }
             }
@@ -382,27 +3169,105 @@ async def handle_call_tool(name: str, arguments: dict) -> list[TextContent]:
     """处理工具调用"""
     try:
         if name == "execute_python":
-            result = interpreter.execute_code(
+            result = await interpreter.execute_code(
                 arguments.get("code", ""),
                 arguments.get("timeout", 10),
-                arguments.get("persistent", False)
+                arguments.get("persistent", False),
+                arguments.get("session_id"),
+                arguments.get("max_output_bytes"),
+                memory_limit_mb=arguments.get("memory_limit_mb"),
+                export_variables=arguments.get("export_variables"),
+                profile=arguments.get("profile", False),
+                profile_top=arguments.get("profile_top", 20)
+            )
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "execute_python_batch":
+            result = await interpreter.execute_batch(
+                arguments.get("snippets"),
+                arguments.get("timeout", 10),
+                arguments.get("max_concurrency"),
+                arguments.get("order", "input"),
+                arguments.get("session_id"),
+                arguments.get("max_output_bytes")
             )
             return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
+        elif name == "submit_python_job":
+            result = interpreter.submit_job(
+                arguments.get("code"),
+                arguments.get("timeout", 10),
+                arguments.get("persistent", False),
+                arguments.get("session_id"),
+                arguments.get("max_output_bytes")
+            )
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "get_job_status":
+            result = interpreter.job_status(arguments.get("job_id"))
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "get_job_output":
+            result = await interpreter.job_output(
+                arguments.get("job_id"),
+                arguments.get("offset", 0),
+                arguments.get("wait", 0)
+            )
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "get_job_result":
+            result = interpreter.job_result(arguments.get("job_id"))
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "cancel_job":
+            result = interpreter.cancel_job(arguments.get("job_id"))
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
         elif name == "get_variables":
-            result = interpreter.get_variables()
+            result = await interpreter.get_variables(
+                arguments.get("session_id"),
+                arguments.get("offset", 0),
+                arguments.get("limit", 50)
+            )
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "get_variable_value":
+            result = await interpreter.get_variable_value(
+                arguments.get("name"),
+                arguments.get("session_id"),
+                arguments.get("offset", 0),
+                arguments.get("length", 65536)
+            )
             return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
         elif name == "clear_variables":
-            result = interpreter.clear_variables()
+            result = await interpreter.clear_variables(arguments.get("session_id"))
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "fork_session":
+            result = await interpreter.fork_session(
+                arguments.get("session_id"),
+                arguments.get("branch_session_id")
+            )
+            return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
+
+        elif name == "close_session":
+            result = await interpreter.close_session(arguments.get("session_id"))
             return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
         elif name == "get_execution_history":
-            result = interpreter.get_history(arguments.get("limit", 10))
+            result = await interpreter.get_history(
+                arguments.get("limit", 10),
+                arguments.get("before_id"),
+                arguments.get("session_id"),
+                arguments.get("success"),
+                arguments.get("since"),
+                arguments.get("until")
+            )
             return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
         elif name == "clear_execution_history":
-            result = interpreter.clear_history()
+            result = await interpreter.clear_history()
             return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
         else:
@@ -438,6 +3303,31 @@ class ToolResponse(BaseModel):
     error: Optional[str] = None
 
 
+class ExecuteRequest(BaseModel):
+    code: str
+    timeout: float = 10
+    persistent: bool = False
+    session_id: Optional[str] = None
+    max_output_bytes: Optional[int] = None
+    memory_limit_mb: Optional[int] = None
+    export_variables: Optional[List[str]] = None
+    profile: bool = False
+    profile_top: int = 20
+
+
+class BatchRequest(BaseModel):
+    snippets: List[Any]
+    timeout: float = 10
+    max_concurrency: Optional[int] = None
+    session_id: Optional[str] = None
+    max_output_bytes: Optional[int] = None
+
+
+def _sse(event: str, data: Any) -> str:
+    """格式化一条 SSE 事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.get("/")
 async def root():
     """根路径，返回服务器信息"""
@@ -448,7 +3338,14 @@ async def root():
         "endpoints": {
             "tools": "/tools",
             "call_tool": "/call_tool",
-            "mcp_info": "/mcp/info"
+            "mcp_info": "/mcp/info",
+            "execute_stream": "/execute/stream",
+            "execute_batch_stream": "/execute/batch/stream",
+            "job_stream": "/jobs/{job_id}/stream",
+            "stats": "/stats",
+            "usage": "/usage",
+            "buffers": "/buffers/{handle}",
+            "artifacts": "/artifacts/{artifact_id}"
         }
     }
 
@@ -466,14 +3363,50 @@ async def mcp_info():
                 "name": "execute_python",
                 "description": "执行Python代码并返回结果，支持基础数学运算、数据处理等安全操作"
             },
+            {
+                "name": "execute_python_batch",
+                "description": "并行执行多段互不依赖的Python代码（如参数变体、逐个文件的分析），一次调用返回每段代码的结果"
+            },
+            {
+                "name": "submit_python_job",
+                "description": "提交长时间运行的Python代码作为异步作业，立即返回作业 ID"
+            },
+            {
+                "name": "get_job_status",
+                "description": "查询异步作业的状态"
+            },
+            {
+                "name": "get_job_output",
+                "description": "读取异步作业目前为止的输出（增量读取），可等待新输出"
+            },
+            {
+                "name": "get_job_result",
+                "description": "获取已完成异步作业的结果"
+            },
+            {
+                "name": "cancel_job",
+                "description": "取消异步作业"
+            },
             {
                 "name": "get_variables",
-                "description": "获取当前Python环境中的全局变量"
+                "description": "分页获取当前Python环境中全局变量的摘要（类型、长度或形状、截断预览、估算内存）"
+            },
+            {
+                "name": "get_variable_value",
+                "description": "分块获取某个变量的完整值（repr），用于查看 get_variables 中被截断的大变量"
             },
             {
                 "name": "clear_variables",
                 "description": "清空Python环境中的全局变量"
             },
+            {
+                "name": "fork_session",
+                "description": "把会话的持久化环境复制为新会话（分支），新会话继承当前全部变量"
+            },
+            {
+                "name": "close_session",
+                "description": "结束会话并丢弃其全部持久化变量"
+            },
             {
                 "name": "get_execution_history",
                 "description": "获取Python代码执行历史记录"
@@ -519,32 +3452,114 @@ async def list_tools():
 
 
 @app.post("/call_tool")
-async def call_tool(request: ToolCallRequest) -> ToolResponse:
-    """调用工具"""
+async def call_tool(
+    request: ToolCallRequest,
+    session_header: Optional[str] = Header(None, alias="X-Session-Id")
+) -> ToolResponse:
+    """调用工具，会话 ID 取自 session_id 参数或 X-Session-Id 请求头"""
     try:
+        session_id = request.arguments.get("session_id") or session_header
+
         if request.tool_name == "execute_python":
-            result = interpreter.execute_code(
+            result = await interpreter.execute_code(
                 request.arguments.get("code", ""),
                 request.arguments.get("timeout", 10),
-                request.arguments.get("persistent", False)
+                request.arguments.get("persistent", False),
+                session_id,
+                request.arguments.get("max_output_bytes"),
+                memory_limit_mb=request.arguments.get("memory_limit_mb"),
+                export_variables=request.arguments.get("export_variables"),
+                profile=request.arguments.get("profile", False),
+                profile_top=request.arguments.get("profile_top", 20)
             )
             return ToolResponse(success=True, data=result)
 
+        elif request.tool_name == "execute_python_batch":
+            result = await interpreter.execute_batch(
+                request.arguments.get("snippets"),
+                request.arguments.get("timeout", 10),
+                request.arguments.get("max_concurrency"),
+                request.arguments.get("order", "input"),
+                session_id,
+                request.arguments.get("max_output_bytes")
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "submit_python_job":
+            result = interpreter.submit_job(
+                request.arguments.get("code"),
+                request.arguments.get("timeout", 10),
+                request.arguments.get("persistent", False),
+                session_id,
+                request.arguments.get("max_output_bytes")
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "get_job_status":
+            result = interpreter.job_status(request.arguments.get("job_id"))
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "get_job_output":
+            result = await interpreter.job_output(
+                request.arguments.get("job_id"),
+                request.arguments.get("offset", 0),
+                request.arguments.get("wait", 0)
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "get_job_result":
+            result = interpreter.job_result(request.arguments.get("job_id"))
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "cancel_job":
+            result = interpreter.cancel_job(request.arguments.get("job_id"))
+            return ToolResponse(success=True, data=result)
+
         elif request.tool_name == "get_variables":
-            result = interpreter.get_variables()
+            result = await interpreter.get_variables(
+                session_id,
+                request.arguments.get("offset", 0),
+                request.arguments.get("limit", 50)
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "get_variable_value":
+            result = await interpreter.get_variable_value(
+                request.arguments.get("name"),
+                session_id,
+                request.arguments.get("offset", 0),
+                request.arguments.get("length", 65536)
+            )
             return ToolResponse(success=True, data=result)
 
         elif request.tool_name == "clear_variables":
-            result = interpreter.clear_variables()
+            result = await interpreter.clear_variables(session_id)
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "fork_session":
+            result = await interpreter.fork_session(
+                session_id,
+                request.arguments.get("branch_session_id")
+            )
+            return ToolResponse(success=True, data=result)
+
+        elif request.tool_name == "close_session":
+            result = await interpreter.close_session(session_id)
             return ToolResponse(success=True, data=result)
 
         elif request.tool_name == "get_execution_history":
-            result = interpreter.get_history(
-                request.arguments.get("limit", 10))
+            result = await interpreter.get_history(
+                request.arguments.get("limit", 10),
+                request.arguments.get("before_id"),
+                request.arguments.get("session_id"),
+                request.arguments.get("success"),
+                request.arguments.get("since"),
+                request.arguments.get("until")
+            )
             return ToolResponse(success=True, data=result)
 
         elif request.tool_name == "clear_execution_history":
-            result = interpreter.clear_history()
+            result = await interpreter.clear_history()
             return ToolResponse(success=True, data=result)
 
         else:
@@ -555,6 +3570,263 @@ async def call_tool(request: ToolCallRequest) -> ToolResponse:
         return ToolResponse(success=False, error=f"调用失败: {str(e)}")
 
 
+@app.post("/execute/stream")
+async def execute_stream(
+    request: ExecuteRequest,
+    session_header: Optional[str] = Header(None, alias="X-Session-Id")
+):
+    """执行代码，以 SSE 事件流实时返回输出
+
+    执行过程中依次发送 stdout / stderr 事件（data.data 为输出片段），最后发送 result 事件，
+    内容与 execute_python 的结果相同，但不再重复 output。客户端断开时执行被终止。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run() -> Dict[str, Any]:
+        try:
+            return await interpreter.execute_code(
+                request.code,
+                request.timeout,
+                request.persistent,
+                request.session_id or session_header,
+                request.max_output_bytes,
+                on_output=queue.put_nowait,
+                memory_limit_mb=request.memory_limit_mb,
+                export_variables=request.export_variables,
+                profile=request.profile,
+                profile_top=request.profile_top
+            )
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(run())
+
+    async def generate():
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                yield _sse(message["stream"], {"data": message["data"]})
+            try:
+                result = await task
+            except Exception as e:
+                logger.error(f"流式执行失败: {e}")
+                yield _sse("error", {"error": str(e)})
+                return
+            yield _sse("result", {k: v for k, v in result.items() if k != "output"})
+        finally:
+            # 客户端提前断开时取消执行，对应的沙箱进程会被终止并替换
+            task.cancel()
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/execute/batch/stream")
+async def execute_batch_stream(
+    request: BatchRequest,
+    session_header: Optional[str] = Header(None, alias="X-Session-Id")
+):
+    """并行执行多段代码，以 NDJSON 按完成顺序流式返回结果
+
+    每段代码完成后输出一行 result（index 为输入中的位置），全部完成后输出一行 end（汇总）。
+    客户端断开时终止仍在执行的代码。
+    """
+    try:
+        interpreter.batch_jobs(request.snippets, request.timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run() -> Dict[str, Any]:
+        try:
+            return await interpreter.execute_batch(
+                request.snippets,
+                request.timeout,
+                request.max_concurrency,
+                "completion",
+                request.session_id or session_header,
+                request.max_output_bytes,
+                on_result=queue.put_nowait
+            )
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.create_task(run())
+
+    async def generate():
+        try:
+            while True:
+                result = await queue.get()
+                if result is None:
+                    break
+                yield json.dumps({"type": "result", "index": result["index"], "result": result},
+                                 ensure_ascii=False) + "\n"
+            try:
+                summary = await task
+            except Exception as e:
+                logger.error(f"批量执行失败: {e}")
+                yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+                return
+            summary = {k: v for k, v in summary.items() if k != "results"}
+            yield json.dumps(dict(summary, type="end"), ensure_ascii=False) + "\n"
+        finally:
+            task.cancel()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}/stream")
+async def job_stream(job_id: str, offset: int = 0):
+    """以 SSE 事件流返回作业从 offset 开始的输出，作业结束时发送 result 事件（不重复 output）
+
+    客户端断开不会取消作业，之后可以带上已收到的长度作为 offset 重新连接。
+    """
+    try:
+        interpreter.jobs.get(job_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+    async def generate():
+        position = max(0, offset)
+        while True:
+            try:
+                chunk = await interpreter.jobs.output(job_id, position, wait=15)
+            except KeyError:
+                yield _sse("error", {"error": f"作业不存在或已过期: {job_id}"})
+                return
+            if chunk["data"]:
+                yield _sse("output", {"data": chunk["data"], "offset": chunk["offset"]})
+                position = chunk["next_offset"]
+            if chunk["done"]:
+                result = interpreter.job_result(job_id)
+                if result.get("result"):
+                    result["result"] = {k: v for k, v in result["result"].items() if k != "output"}
+                yield _sse("result", result)
+                return
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/stats")
+async def stats():
+    """运行时统计信息"""
+    return {
+        "code_cache": interpreter.code_cache.stats(),
+        "result_cache": interpreter.result_cache.stats(),
+        "sandbox_pool": interpreter.pool.stats(),
+        "kernels": interpreter.kernels.stats(),
+        "history": interpreter.history.stats(),
+        "buffers": interpreter.buffers.stats(),
+        "artifacts": interpreter.artifacts.stats(),
+        "jobs": interpreter.jobs.stats(),
+        "limits": interpreter.limits(),
+        "usage_totals": interpreter.usage.report(top=0)["totals"],
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.get("/usage")
+async def usage(session_id: Optional[str] = None, top: int = 20, sort_by: str = "cpu_seconds"):
+    """按会话累计的资源用量，默认按 CPU 时间降序列出前 20 个会话"""
+    try:
+        report = interpreter.usage.report(session_id, top, sort_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    report["timestamp"] = datetime.now().isoformat()
+    return report
+
+
+@app.get("/buffers/{handle}")
+async def download_buffer(handle: str):
+    """下载导出的二进制结果（原始字节），格式信息在 X-Buffer-* 响应头中"""
+    entry = interpreter.buffers.get(handle)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="结果不存在或已过期")
+    interpreter.buffers.downloads += 1
+    headers = {
+        "X-Buffer-Name": entry["name"],
+        "X-Buffer-Format": entry["format"],
+        "X-Buffer-Itemsize": str(entry["itemsize"]),
+        "X-Buffer-Shape": ",".join(str(n) for n in entry["shape"])
+    }
+    if "dtype" in entry:
+        headers["X-Buffer-Dtype"] = entry["dtype"]
+    return FileResponse(entry["path"], media_type="application/octet-stream",
+                        filename=f"{entry['name']}.bin", headers=headers)
+
+
+@app.delete("/buffers/{handle}")
+async def delete_buffer(handle: str):
+    """提前释放导出的二进制结果"""
+    if not interpreter.buffers.delete(handle):
+        raise HTTPException(status_code=404, detail="结果不存在或已过期")
+    return {"success": True, "handle": handle}
+
+
+# 下载时可以内联显示的制品类型，其他类型一律作为附件下载
+_INLINE_ARTIFACT_TYPES = frozenset({
+    "image/png", "image/jpeg", "image/gif", "image/webp",
+    "text/plain", "text/csv", "application/json", "application/pdf"
+})
+
+
+@app.get("/artifacts/{artifact_id}")
+async def download_artifact(artifact_id: str):
+    """下载制品，支持 Range 请求；内容按 ID 寻址，不会改变"""
+    entry = interpreter.artifacts.get(artifact_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="制品不存在或已过期")
+    interpreter.artifacts.downloads += 1
+    # MIME 类型由沙箱代码决定：禁止浏览器猜测类型、禁止执行脚本，只有白名单中的类型内联显示
+    headers = {"ETag": f'"{artifact_id}"', "Cache-Control": "private, max-age=31536000, immutable",
+               "X-Content-Type-Options": "nosniff", "Content-Security-Policy": "sandbox"}
+    inline = entry["mime_type"].split(";")[0].strip().lower() in _INLINE_ARTIFACT_TYPES
+    return FileResponse(entry["path"], media_type=entry["mime_type"],
+                        filename=entry["name"] or artifact_id, headers=headers,
+                        content_disposition_type="inline" if inline else "attachment")
+
+
+@app.delete("/artifacts/{artifact_id}")
+async def delete_artifact(artifact_id: str):
+    """提前删除制品"""
+    if not interpreter.artifacts.delete(artifact_id):
+        raise HTTPException(status_code=404, detail="制品不存在或已过期")
+    return {"success": True, "artifact_id": artifact_id}
+
+
+async def _maintain_kernels() -> None:
+    """定期回收空闲的会话内核，并把待写的执行历史写入磁盘"""
+    interval = max(1.0, min(5.0, interpreter.kernels.idle_timeout / 4))
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await interpreter.kernels.evict_idle()
+            interpreter.buffers.expire()
+            interpreter.artifacts.expire()
+            interpreter.jobs.expire()
+            await loop.run_in_executor(None, interpreter.history.flush)
+        except Exception as e:
+            logger.error(f"内核维护失败: {e}")
+
+
+@app.on_event("startup")
+async def startup_event():
+    """预先启动沙箱进程池，避免首个请求承担进程启动开销；启动内核维护任务"""
+    await interpreter.start()
+    app.state.kernel_maintenance = asyncio.create_task(_maintain_kernels())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时结束所有沙箱进程"""
+    app.state.kernel_maintenance.cancel()
+    await interpreter.close()
+
+
 async def main():
     """运行HTTP服务器"""
     parser = argparse.ArgumentParser(description="Python解释器 MCP 服务器")
@@ -562,8 +3834,101 @@ async def main():
                         help="服务器端口 (默认: 8766)")
     parser.add_argument("--host", type=str, default="0.0.0.0",
                         help="服务器主机 (默认: 0.0.0.0)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="沙箱进程池大小，即可并行执行的请求数 (默认: 4)")
+    parser.add_argument("--max-timeout", type=float, default=60,
+                        help="单次执行允许的最长时间，秒 (默认: 60)")
+    parser.add_argument("--start-method", type=str, default=_DEFAULT_START_METHOD,
+                        choices=multiprocessing.get_all_start_methods(),
+                        help=f"沙箱进程启动方式 (默认: {_DEFAULT_START_METHOD})")
+    parser.add_argument("--preload", type=str, default="",
+                        help="fork server 模板进程额外预加载的模块，逗号分隔，如 numpy,pandas")
+    parser.add_argument("--worker-max-executions", type=int, default=100,
+                        help="沙箱进程执行多少次后被替换，1 表示每次执行都使用新进程 (默认: 100)")
+    parser.add_argument("--max-output-bytes", type=int, default=1024 * 1024,
+                        help="单次执行输出的字节上限 (默认: 1048576)")
+    parser.add_argument("--max-cpu-seconds", type=float, default=None,
+                        help="单次执行的 CPU 时间上限，秒 (默认: 与执行超时相同)")
+    parser.add_argument("--memory-limit-mb", "--session-memory-mb", dest="memory_limit_mb",
+                        type=int, default=1024,
+                        help="每个沙箱进程可额外使用的地址空间，MB，0 表示不限 (默认: 1024)")
+    parser.add_argument("--data-dir", type=str, default=_DEFAULT_DATA_DIR,
+                        help=f"数据目录，保存执行历史（history.sqlite3）和会话快照（snapshots/），空字符串表示不落盘 (默认: {_DEFAULT_DATA_DIR})")
+    parser.add_argument("--history-tail-size", type=int, default=200,
+                        help="内存中保留的最近执行记录数 (默认: 200)")
+    parser.add_argument("--buffer-ttl", type=float, default=600.0,
+                        help="导出的二进制结果保留多少秒 (默认: 600)")
+    parser.add_argument("--buffer-max-mb", type=int, default=2048,
+                        help="导出的二进制结果总大小上限，MB (默认: 2048)")
+    parser.add_argument("--artifact-ttl", type=float, default=3600.0,
+                        help="制品在最后一次保存或下载后保留多少秒 (默认: 3600)")
+    parser.add_argument("--artifact-max-mb", type=int, default=1024,
+                        help="制品总大小上限，MB (默认: 1024)")
+    parser.add_argument("--max-pending-jobs", type=int, default=100,
+                        help="等待执行的异步作业数上限，超出时拒绝提交 (默认: 100)")
+    parser.add_argument("--job-runners", type=int, default=None,
+                        help="同时执行的异步作业数 (默认: 与 --workers 相同)")
+    parser.add_argument("--job-retention", type=float, default=3600.0,
+                        help="已完成的异步作业保留多少秒供查询 (默认: 3600)")
+    parser.add_argument("--trace-allocations", action="store_true",
+                        help="用 tracemalloc 统计每次执行的 Python 对象分配量（分配密集的代码会明显变慢）")
+    parser.add_argument("--code-cache-size", type=int, default=1024,
+                        help="编译结果缓存容量，0 表示禁用 (默认: 1024)")
+    parser.add_argument("--result-cache-size", type=int, default=256,
+                        help="确定性代码执行结果缓存的条目数，0 表示禁用 (默认: 256)")
+    parser.add_argument("--result-cache-ttl", type=float, default=300.0,
+                        help="执行结果缓存的有效期，秒 (默认: 300)")
+    parser.add_argument("--max-sessions", type=int, default=100,
+                        help="同时保留的持久化会话内核数上限 (默认: 100)")
+    parser.add_argument("--session-idle-timeout", type=float, default=1800.0,
+                        help="会话内核空闲多少秒后被回收 (默认: 1800)")
+    parser.add_argument("--max-branches", type=int, default=8,
+                        help="每个会话同时存在的分支数上限 (默认: 8)")
     args = parser.parse_args()
 
+    interpreter.pool = SandboxPool(
+        args.workers,
+        start_method=args.start_method,
+        preload=[name.strip() for name in args.preload.split(",") if name.strip()],
+        max_executions=args.worker_max_executions
+    )
+    interpreter.kernels = KernelManager(
+        interpreter.pool,
+        max_sessions=args.max_sessions,
+        idle_timeout=args.session_idle_timeout,
+        max_branches=args.max_branches
+    )
+    interpreter.code_cache = CodeCache(args.code_cache_size)
+    interpreter.result_cache = ResultCache(args.result_cache_size, args.result_cache_ttl)
+    interpreter.max_timeout = args.max_timeout
+    interpreter.max_output_bytes = args.max_output_bytes
+    interpreter.max_cpu_seconds = args.max_cpu_seconds
+    interpreter.memory_limit_mb = args.memory_limit_mb or None
+    interpreter.trace_allocations = args.trace_allocations
+    interpreter.jobs = JobQueue(
+        interpreter,
+        max_pending=args.max_pending_jobs,
+        max_running=args.job_runners,
+        retention=args.job_retention
+    )
+    interpreter.buffers = BufferStore(
+        ttl=args.buffer_ttl,
+        max_bytes=args.buffer_max_mb * 1024 * 1024,
+        max_buffer_bytes=min(args.buffer_max_mb * 1024 * 1024, 1024 * 1024 * 1024)
+    )
+    interpreter.artifacts = ArtifactStore(
+        os.path.join(args.data_dir, "artifacts") if args.data_dir else _DEFAULT_ARTIFACT_DIR,
+        ttl=args.artifact_ttl,
+        max_bytes=args.artifact_max_mb * 1024 * 1024,
+        max_artifact_bytes=min(args.artifact_max_mb * 1024 * 1024, 256 * 1024 * 1024)
+    )
+    if args.data_dir:
+        interpreter.kernels.snapshots = SnapshotStore(os.path.join(args.data_dir, "snapshots"))
+    interpreter.history = HistoryStore(
+        os.path.join(args.data_dir, "history.sqlite3") if args.data_dir else None,
+        tail_size=args.history_tail_size
+    )
+
     logger.info(f"启动Python解释器 MCP 服务器 on {args.host}:{args.port}")
 
     config = uvicorn.Config(
@@ -0,0 +1,80 @@
+"""
+会话分支测试：继承变量、互不影响、分支配额、关闭分支
+"""
+
+import asyncio
+
+import server
+
+
+def _run(test):
+    async def main():
+        interp = server.PythonInterpreter(workers=2)
+        await interp.start()
+        try:
+            await test(interp)
+        finally:
+            await interp.close()
+    asyncio.run(main())
+
+
+async def _exec(interp: server.PythonInterpreter, session_id: str, code: str) -> str:
+    result = await interp.execute_code(code, persistent=True, session_id=session_id)
+    assert result["success"], result
+    return result["output"].strip()
+
+
+def test_fork_inherits_variables():
+    async def test(interp):
+        await _exec(interp, "parent", "x = 41\ndata = [1, 2, 3]")
+        forked = await interp.fork_session("parent", "branch")
+        assert forked["success"], forked
+        assert forked["session_id"] == "branch"
+        assert forked["parent_session_id"] == "parent"
+        assert forked["branches"] == ["branch"]
+        assert await _exec(interp, "branch", "print(x + 1, sum(data))") == "42 6"
+    _run(test)
+
+
+def test_branch_is_isolated_from_parent():
+    async def test(interp):
+        await _exec(interp, "parent", "x = 1\ndata = [1]")
+        assert (await interp.fork_session("parent", "branch"))["success"]
+        await _exec(interp, "branch", "x = 2\ndata.append(2)")
+        assert await _exec(interp, "parent", "print(x, data)") == "1 [1]"
+        assert await _exec(interp, "branch", "print(x, data)") == "2 [1, 2]"
+    _run(test)
+
+
+def test_fork_without_session_fails():
+    async def test(interp):
+        forked = await interp.fork_session("missing", "branch")
+        assert not forked["success"]
+    _run(test)
+
+
+def test_max_branches():
+    async def test(interp):
+        interp.kernels.max_branches = 1
+        await _exec(interp, "parent", "x = 1")
+        assert (await interp.fork_session("parent", "b1"))["success"]
+        forked = await interp.fork_session("parent", "b2")
+        assert not forked["success"]
+        assert forked["type"] == "quota_exceeded"
+        assert interp.kernels.branches("parent") == ["b1"]
+    _run(test)
+
+
+def test_close_branch_keeps_parent():
+    async def test(interp):
+        interp.kernels.max_branches = 1
+        await _exec(interp, "parent", "x = 7")
+        assert (await interp.fork_session("parent", "b1"))["success"]
+        closed = await interp.close_session("b1")
+        assert closed["success"] and closed["closed"]
+        assert interp.kernels.branches("parent") == []
+        assert await _exec(interp, "parent", "print(x)") == "7"
+        # 关闭分支后配额释放，可以再次分支
+        assert (await interp.fork_session("parent", "b2"))["success"]
+        assert await _exec(interp, "b2", "print(x)") == "7"
+    _run(test)
@@ -0,0 +1,103 @@
+"""
+异步执行作业队列测试：提交、取消、过期
+"""
+
+import asyncio
+
+import server
+
+
+async def _wait_done(interp: server.PythonInterpreter, job_id: str, timeout: float = 30.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        status = interp.job_status(job_id)
+        if status["status"] in ("succeeded", "failed", "cancelled"):
+            return status
+        assert asyncio.get_running_loop().time() < deadline, f"作业未在 {timeout} 秒内结束"
+        await asyncio.sleep(0.05)
+
+
+async def _wait_running(interp: server.PythonInterpreter, job_id: str, timeout: float = 10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while interp.job_status(job_id)["status"] == "queued":
+        assert asyncio.get_running_loop().time() < deadline, f"作业未在 {timeout} 秒内开始执行"
+        await asyncio.sleep(0.05)
+
+
+def _run(test):
+    async def main():
+        interp = server.PythonInterpreter(workers=2)
+        await interp.start()
+        try:
+            await test(interp)
+        finally:
+            await interp.close()
+    asyncio.run(main())
+
+
+def test_submit_returns_result():
+    async def test(interp):
+        job = interp.submit_job("print(6 * 7)")
+        assert job["success"]
+        assert job["status"] in ("queued", "running")
+        status = await _wait_done(interp, job["job_id"])
+        assert status["status"] == "succeeded"
+        result = interp.job_result(job["job_id"])
+        assert result["success"]
+        assert "42" in result["result"]["output"]
+        output = await interp.job_output(job["job_id"])
+        assert output["done"] and "42" in output["data"]
+    _run(test)
+
+
+def test_cancel_running_job():
+    async def test(interp):
+        job = interp.submit_job("while True:\n    pass", timeout=30)
+        await _wait_running(interp, job["job_id"])
+        assert interp.cancel_job(job["job_id"])["success"]
+        status = await _wait_done(interp, job["job_id"], timeout=10)
+        assert status["status"] == "cancelled"
+        assert interp.jobs.stats()["running"] == 0
+        # 取消后沙箱仍可正常执行
+        after = interp.submit_job("print('ok')")
+        assert (await _wait_done(interp, after["job_id"]))["status"] == "succeeded"
+    _run(test)
+
+
+def test_cancel_queued_job():
+    async def test(interp):
+        interp.jobs.max_running = 1
+        await interp.jobs.close()
+        await interp.jobs.start()
+        blocker = interp.submit_job("while True:\n    pass", timeout=30)
+        await _wait_running(interp, blocker["job_id"])
+        queued = interp.submit_job("print('never')")
+        assert interp.job_status(queued["job_id"])["status"] == "queued"
+        assert interp.cancel_job(queued["job_id"])["status"] == "cancelled"
+        assert interp.jobs.stats()["pending"] == 0
+        interp.cancel_job(blocker["job_id"])
+        await _wait_done(interp, blocker["job_id"], timeout=10)
+    _run(test)
+
+
+def test_queue_full():
+    async def test(interp):
+        interp.jobs.max_pending = 0
+        job = interp.submit_job("print(1)")
+        assert not job["success"]
+        assert job["type"] == "queue_full"
+    _run(test)
+
+
+def test_expire_finished_jobs():
+    async def test(interp):
+        job = interp.submit_job("print(1)")
+        await _wait_done(interp, job["job_id"])
+        assert interp.jobs.expire() == 0
+        interp.jobs.retention = 0
+        await asyncio.sleep(0.01)
+        assert interp.jobs.expire() == 1
+        status = interp.job_status(job["job_id"])
+        assert not status["success"]
+        assert not interp.cancel_job(job["job_id"])["success"]
+    _run(test)